@@ -1,4 +1,15 @@
-from dash import Dash, html, dash_table, dcc, callback, Output, Input, callback_context
+from dash import (
+    Dash,
+    html,
+    dash_table,
+    dcc,
+    callback,
+    Output,
+    Input,
+    State,
+    callback_context,
+)
+from dash.exceptions import PreventUpdate
 import dash
 import dash_auth
 import dash_bootstrap_components as dbc
@@ -24,21 +35,63 @@ from utils.demo_io import (
     get_mapping_csv,
     crop_spots_from_slide,
     get_combined_spots_df,
+    list_blobs_with_prefix,
+    set_listing_cache,
+    set_blob_cache,
+    set_fov_fetch_workers,
+    set_fov_image_cache,
+    get_thread_storage_service,
+)
+from utils.blob_cache import BlobCache
+from utils.fov_image_cache import DecodedImageCache
+from utils.listing_cache import ListingCache
+from utils.slide_catalog import (
+    build_slide_catalog_incremental,
+    find_slide_catalog,
+    scan_slide_catalog,
+    with_derived_columns,
 )
 from utils.polars_helpers import (
     get_detection_stats_vs_threshold,
     get_results_from_threshold,
 )
-from utils.zarr_utils import parse_slide, encode_image, get_images_from_zarr_built_in
-from utils.img_embed_utils import generate_temporary_public_url
+from utils.zarr_utils import (
+    parse_slide,
+    parse_slide_pooled,
+    zarr_handle_pool,
+    set_image_encode_workers,
+    encode_image,
+    select_spots,
+    encode_spot_samples,
+    encode_spot_sprite,
+    encode_image_bytes,
+    encode_images,
+    compose_spot_channels,
+    spot_channel_names,
+    spot_sprite_info,
+    spot_sprite_sheet,
+)
+from utils.http_images import image_response, make_etag, not_modified
+from utils.tile_pyramid import TileStore, get_viewer_html
+from utils.fov_mosaic import get_mosaic_key
+from utils.fov_thumbnails import FovThumbnailStore
+from utils.img_embed_utils import SignedUrlCache
+from utils.table_query import apply_row_edits, query_table_page
+from utils.spot_index import SpotIndexCache, spot_sort_methods
 import polars as pl
 from gcsfs import GCSFileSystem
 from PIL import Image
 from io import BytesIO
+from flask import abort, request
 from flask_caching import Cache
 import os
 import json
 import asyncio
+import math
+import mimetypes
+import time
+from threading import Lock
+from urllib.parse import quote, urlencode
 
 VALID_USERNAME_PASSWORD_PAIRS = None
 
@@ -62,6 +115,62 @@ try:
 except:
     pass
 
+incremental_catalog = False
+try:
+    incremental_catalog = cfp["SLIDES"]["incremental_catalog"] in ["true", "True"]
+except:
+    pass
+
+catalog_format = "arrow"
+try:
+    catalog_format = cfp["SLIDES"]["catalog_format"].strip(".")
+except:
+    pass
+
+catalog_threshold = 0.876
+try:
+    catalog_threshold = float(cfp["SLIDES"]["catalog_threshold"])
+except:
+    pass
+
+# minimum seconds between incremental catalog updates of a bucket, each of
+# which fingerprints the inputs of every slide in it
+catalog_refresh_interval = 3600.0
+try:
+    catalog_refresh_interval = float(cfp["SLIDES"]["catalog_refresh_interval"])
+except:
+    pass
+
+slide_scan_workers = 16
+try:
+    slide_scan_workers = int(cfp["SLIDES"]["slide_scan_workers"])
+except:
+    pass
+
+listing_cache_ttl = 300.0
+try:
+    listing_cache_ttl = float(cfp["GCS"]["listing_cache_ttl"])
+except:
+    pass
+
+blob_cache_dir = "blob-cache"
+try:
+    blob_cache_dir = cfp["GCS"]["blob_cache_dir"]
+except:
+    pass
+
+blob_cache_max_mb = 2048
+try:
+    blob_cache_max_mb = int(cfp["GCS"]["blob_cache_max_mb"])
+except:
+    pass
+
+listing_prefetch = False
+try:
+    listing_prefetch = cfp["GCS"]["listing_prefetch"] in ["true", "True"]
+except:
+    pass
+
 cutoff = None
 try:
     cutoff = int(cfp["TESTING"]["slide_count_cutoff"])
@@ -75,12 +184,102 @@ try:
 except:
     pass
 
+# "custom" pages, sorts and filters the slide table on the server and only sends
+# the visible page, "native" sends every slide and lets the browser do it
+slide_table_mode = "custom"
+try:
+    slide_table_mode = cfp["DISPLAY"]["slide_table_mode"]
+except:
+    pass
+
 embedding_url_timeout = 20.0
 try:
     embedding_url_timeout = float(cfp["DISPLAY"]["embedding_url_timeout"])
 except:
     pass
 
+# number of threads signing spot embed URLs
+url_signing_workers = 8
+try:
+    url_signing_workers = int(cfp["DISPLAY"]["url_signing_workers"])
+except:
+    pass
+
+zarr_handle_idle_timeout = 600.0
+try:
+    zarr_handle_idle_timeout = float(cfp["DISPLAY"]["zarr_handle_idle_timeout"])
+except:
+    pass
+zarr_handle_pool.idle_timeout = zarr_handle_idle_timeout
+
+try:
+    set_image_encode_workers(int(cfp["DISPLAY"]["image_encode_workers"]))
+except:
+    pass
+
+# serve spot and FOV images from HTTP routes with browser caching headers,
+# rather than inside callback payloads
+serve_images_by_url = True
+try:
+    serve_images_by_url = cfp["DISPLAY"]["serve_images_by_url"] in ["true", "True"]
+except:
+    pass
+
+# seconds browsers and proxies may reuse an image served by URL
+image_max_age = 3600
+try:
+    image_max_age = int(cfp["DISPLAY"]["image_max_age"])
+except:
+    pass
+
+# "deepzoom" shows single FOVs in a pan/zoom viewer over a tile pyramid kept in
+# tile_store_dir, "image" shows the full resolution image
+fov_view_mode = "deepzoom"
+try:
+    fov_view_mode = cfp["DISPLAY"]["fov_view_mode"]
+except:
+    pass
+
+tile_store_dir = "tile-store"
+try:
+    tile_store_dir = cfp["DISPLAY"]["tile_store_dir"]
+except:
+    pass
+
+tile_store_max_mb = 4096
+try:
+    tile_store_max_mb = int(cfp["DISPLAY"]["tile_store_max_mb"])
+except:
+    pass
+
+# FOV thumbnails shown when hovering over the FOVs table, precomputed by
+# scripts/precompute_fov_thumbnails.py or made on first request
+fov_thumbnail_dir = "fov-thumbnails"
+try:
+    fov_thumbnail_dir = cfp["DISPLAY"]["fov_thumbnail_dir"]
+except:
+    pass
+
+fov_thumbnail_size = 256
+try:
+    fov_thumbnail_size = int(cfp["DISPLAY"]["fov_thumbnail_size"])
+except:
+    pass
+
+# slide-wide FOV mosaics written by scripts/build_fov_mosaics.py
+mosaic_store_dir = "mosaic-store"
+try:
+    mosaic_store_dir = cfp["DISPLAY"]["mosaic_store_dir"]
+except:
+    pass
+
+# seconds the raw spot arrays of a page are kept, for encoding other channels
+spot_array_cache_timeout = 30
+try:
+    spot_array_cache_timeout = int(cfp["DISPLAY"]["spot_array_cache_timeout"])
+except:
+    pass
+
 spot_rows_per_page = 2
 spot_columns_per_page = 5
 
@@ -96,12 +295,42 @@ except:
 
 spots_per_page = spot_rows_per_page * spot_columns_per_page
 
+# "sprite" sends a page of zarr spot images as one sprite sheet per channel,
+# "images" sends every spot as its own image
+spot_grid_mode = "sprite"
+try:
+    spot_grid_mode = cfp["DISPLAY"]["spot_grid_mode"]
+except:
+    pass
+
+# number of slides whose sorted spot indexes are kept in memory
+spot_index_cache_size = 8
+try:
+    spot_index_cache_size = int(cfp["DISPLAY"]["spot_index_cache_size"])
+except:
+    pass
+
+chart_threshold_points = 200
+try:
+    chart_threshold_points = int(cfp["DISPLAY"]["chart_threshold_points"])
+except:
+    pass
+
 cache_timeout = 20
 try:
     cache_timeout = int(cfp["DISPLAY"]["cache_timeout"])
 except:
     pass
 
+# Flask-Caching backend of memoized functions, a backend name such as
+# "filesystem" or an import path. The default stores DataFrames as Arrow IPC
+# and memory-maps them on hits instead of unpickling them
+cache_type = "utils.arrow_cache.ArrowFileSystemCache"
+try:
+    cache_type = cfp["DISPLAY"]["cache_type"]
+except:
+    pass
+
 bucket_names = []
 
 for url in gs_urls:
@@ -119,6 +348,15 @@ except:
     pass
 
 
+# cache blob listings in-process, a ttl of 0 disables the cache
+if listing_cache_ttl > 0:
+    set_listing_cache(ListingCache(ttl=listing_cache_ttl))
+
+# keep downloaded spot csvs on disk, revalidated against their GCS generation,
+# a budget of 0 disables the cache
+if blob_cache_max_mb > 0:
+    set_blob_cache(BlobCache(blob_cache_dir, max_bytes=blob_cache_max_mb * 1024**2))
+
 # Define GCS file system so files can be read
 gcs = GCSFileSystem(token=service_account_key_json)
 
@@ -131,6 +369,31 @@ credentials = service_account.Credentials.from_service_account_file(
 storage_service = build("storage", "v1", credentials=credentials)
 
 
+def make_storage_service():
+    """
+    :brief: Returns a new storage service, for worker threads that can't share
+        storage_service
+    """
+    return build("storage", "v1", credentials=credentials)
+
+
+# decoded FOV images shared by spot cropping and the FOV views, a budget of 0
+# disables the cache
+fov_image_cache_mb = 1024
+try:
+    fov_image_cache_mb = int(cfp["DISPLAY"]["fov_image_cache_mb"])
+except:
+    pass
+if fov_image_cache_mb > 0:
+    set_fov_image_cache(DecodedImageCache(max_bytes=fov_image_cache_mb * 1024**2))
+
+# FOVs cropped from by one spot page are fetched concurrently on this many threads
+try:
+    set_fov_fetch_workers(int(cfp["DISPLAY"]["fov_fetch_workers"]))
+except:
+    pass
+
+
 slides_placeholder = pl.DataFrame(
     {
         "slide_name": ["slide1", "slide2"],
@@ -191,119 +454,548 @@ else:
 
 auth = dash_auth.BasicAuth(app,VALID_USERNAME_PASSWORD_PAIRS)
 
+
+# BasicAuth only wraps the views that exist when it is constructed, so the
+# routes added to app.server below would be served without credentials
+@app.server.before_request
+def require_auth():
+    if not auth.is_authorized():
+        return auth.login_request()
+
+
+def check_bucket(bucket_name):
+    """
+    :brief: abort with 404 unless bucket_name is one of the configured buckets,
+        so routes can't be used to read objects from any other bucket
+    """
+    if bucket_name not in bucket_names:
+        abort(404)
+
+
 cache = Cache(
-    app.server, config={"CACHE_TYPE": "filesystem", "CACHE_DIR": "cache-directory"}
+    app.server, config={"CACHE_TYPE": cache_type, "CACHE_DIR": "cache-directory"}
+)
+
+# signed spot embed URLs, reused until their expiry bucket has passed
+signed_url_cache = SignedUrlCache(
+    client, embedding_url_timeout, max_workers=url_signing_workers
 )
 
+
 @cache.memoize(timeout=cache_timeout)
 def get_spot_channels(bucket_name, spot_dir_path, extension=".png"):
     channel_list = []
     channel_get_prefix = os.path.join(spot_dir_path, "0_")
-    spot_zero_blobs = client.list_blobs(bucket_name, prefix=channel_get_prefix)
-    for blob in spot_zero_blobs:
-        channel_list.append(blob.name.split("_")[-1].split(".")[0])
+    spot_zero_blobs = list_blobs_with_prefix(client, bucket_name, channel_get_prefix)
+    for blob_name in spot_zero_blobs["blobs"]:
+        channel_list.append(blob_name.split("_")[-1].split(".")[0])
     return channel_list
 
 def get_spot_embeds(bucket_name, spot_dir_path ,spot_id_list, extension=".png"):
     channel_list = get_spot_channels(bucket_name, spot_dir_path, extension=extension)
+    spot_paths = []
+    for spot_id in spot_id_list:
+        spot_prefix = os.path.join(spot_dir_path, str(spot_id))
+        for channel in channel_list:
+            spot_paths.append(spot_prefix + "_" + channel + extension)
+    spot_urls = iter(signed_url_cache.get_urls(bucket_name, spot_paths))
     spot_imgs = []
     for spot_id in spot_id_list:
         spot_dict = {"spot_id":spot_id}
-        spot_prefix = os.path.join(spot_dir_path, str(spot_id))
         for channel in channel_list:
-            spot_dict[channel] = generate_temporary_public_url(client, bucket_name,spot_prefix+"_"+channel+extension, embedding_url_timeout)
+            spot_dict[channel] = next(spot_urls)
         spot_imgs.append(spot_dict)
     return spot_imgs
 
+@cache.memoize(timeout=spot_array_cache_timeout)
+def get_spot_arrays_from_zarr(slide_img_url, spot_id_list):
+    """
+    :brief: Returns the raw uint8 spot images of spot_id_list as an ndarray of
+        shape (spots, channels, z, y, x). Kept for a short time only, so
+        switching channels on a page encodes the new channel without reading
+        the zarr again
+    """
+    spot_image_zarr = parse_slide_pooled(gcs, slide_img_url)
+    return select_spots(spot_image_zarr, spot_id_list)
+
+
 @cache.memoize(timeout=cache_timeout)
-def get_spots_from_zarr(slide_img_url, spot_id_list):
+def get_spots_from_zarr(slide_img_url, spot_id_list, channel=None):
     """
     :brief: Returns a list of dicts in the form
-        {"spot_id":spot id, "image_channel_1_label":image_channel_ndarray,...}
-        for all channels in the image returned by our zarr methods
+        {"spot_id":spot id, "image_channel_1_label":encoded image,...}
+        for all channels in the image returned by our zarr methods. Only
+        channel is encoded (all channels if None), the others are None
     """
-    spot_image_zarr = parse_slide(gcs, slide_img_url)
-    images = get_images_from_zarr_built_in(spot_image_zarr,spot_id_list)
-    #for spot_id in spot_id_list:
-    #    images.append(get_image_from_zarr(spot_image_zarr, spot_id))
-    return images
+    spot_samples = get_spot_arrays_from_zarr(slide_img_url, spot_id_list)
+    channels = None
+    if channel is not None:
+        channels = [channel]
+    return encode_spot_samples(spot_samples, spot_id_list, channels=channels)
 
 
 @cache.memoize(timeout=cache_timeout)
-def slide_df_cached(bucket_name, my_cutoff=None):
-    slides = None
+def get_sprite_from_zarr(slide_img_url, spot_id_list, channel, columns):
+    """
+    :brief: Returns one channel of the spots in spot_id_list as a single sprite
+        sheet, see encode_spot_sprite
+    """
+    spot_samples = get_spot_arrays_from_zarr(slide_img_url, spot_id_list)
+    return encode_spot_sprite(spot_samples, spot_id_list, channel, columns)
+
+
+def sprite_cell(sprite, index, width=100):
+    """
+    :brief: an element showing cell index of a sprite sheet, scaled to width
+        pixels wide, by offsetting the sheet as a background image
+    """
+    scale = width / sprite["cell_width"]
+    height = sprite["cell_height"] * scale
+    row = index // sprite["columns"]
+    column = index % sprite["columns"]
+    return html.Div(
+        style={
+            "width": f"{width}px",
+            "height": f"{height:g}px",
+            "background-image": 'url("' + sprite["sprite"] + '")',
+            "background-size": f"{sprite['columns'] * width}px "
+            + f"{sprite['rows'] * height:g}px",
+            "background-position": f"-{column * width}px -{row * height:g}px",
+            "image-rendering": "pixelated",
+        },
+    )
+
+
+default_rel_path_to_zarr_in_slide = "version1/spot_images.zip"
+
+
+def zarr_path_for_slide(
+    bucket_name, slide_name, rel_path_to_zarr_in_slide=default_rel_path_to_zarr_in_slide
+):
+    return (
+        bucket_name.strip("/")
+        + "/"
+        + os.path.join(slide_name, rel_path_to_zarr_in_slide)
+    )
+
+
+@cache.memoize(timeout=cache_timeout)
+def gcs_generation(path):
+    """
+    :brief: Returns the GCS generation of the object at path (including bucket
+        name), used to version the URLs and ETags of images served from it
+    """
+    info = gcs.info(path)
+    return str(info.get("generation", info.get("etag")))
+
+
+@cache.memoize(timeout=spot_array_cache_timeout)
+def get_spot_block_from_zarr(slide_img_url, block):
+    """
+    :brief: Returns the raw spot images of one chunk-aligned block of spots, so
+        the per-spot image route reads each zarr chunk once per page rather than
+        once per spot
+    """
+    spot_image_zarr = parse_slide_pooled(gcs, slide_img_url)
+    block_size = spot_image_zarr.chunks[0]
+    return spot_image_zarr[block * block_size : (block + 1) * block_size]
+
+
+def get_spot_image_urls(
+    bucket_name, slide_name, slide_img_url, spot_id_list, channel, sprite=False
+):
+    """
+    :brief: Returns the same structures as get_spots_from_zarr (or
+        get_sprite_from_zarr if sprite is True), with URLs of the image routes
+        below in place of encoded images. Nothing is encoded until the browser
+        requests an image. Raises if the slide has no spot zarr
+    """
+    spot_image_zarr = parse_slide_pooled(gcs, slide_img_url)
+    version = gcs_generation(slide_img_url)
+    slide_url = "/images/" + "{}/" + quote(bucket_name) + "/" + quote(slide_name)
+    if sprite:
+        sprite_info = spot_sprite_info(
+            spot_image_zarr, spot_id_list, channel, spot_columns_per_page, None
+        )
+        sprite_info["sprite"] = (
+            slide_url.format("spot-sprite")
+            + "/"
+            + sprite_info["channel"]
+            + ".png?"
+            + urlencode(
+                {
+                    "ids": ",".join(str(spot_id) for spot_id in spot_id_list),
+                    "columns": spot_columns_per_page,
+                    "v": version,
+                }
+            )
+        )
+        return sprite_info
+    spot_imgs = []
+    for spot_id in spot_id_list:
+        spot_dict = {"spot_id": spot_id}
+        for name in spot_channel_names:
+            spot_dict[name] = (
+                slide_url.format("spot")
+                + "/"
+                + str(spot_id)
+                + "/"
+                + name
+                + ".png?v="
+                + quote(version)
+            )
+        spot_imgs.append(spot_dict)
+    return spot_imgs
+
+
+@app.server.route("/images/spot/<bucket_name>/<slide_name>/<int:spot_id>/<channel>.png")
+def serve_spot_image(bucket_name, slide_name, spot_id, channel):
+    check_bucket(bucket_name)
+    if channel not in spot_channel_names:
+        abort(404)
+    slide_img_url = zarr_path_for_slide(bucket_name, slide_name)
     try:
-        slides = pl.read_csv(os.path.join(slide_df_cache_dir, bucket_name + ".csv"))
+        generation = gcs_generation(slide_img_url)
     except:
-        slides = get_initial_slide_df_with_predictions_only(
-            client, bucket_name, gcs, cutoff=my_cutoff
-        )
+        abort(404)
+    etag = make_etag(slide_img_url, generation, spot_id, channel)
+    response = not_modified(etag, image_max_age)
+    if response is not None:
+        return response
+    block_size = parse_slide_pooled(gcs, slide_img_url).chunks[0]
+    block = get_spot_block_from_zarr(slide_img_url, spot_id // block_size)
+    spot_sample = block[spot_id % block_size : spot_id % block_size + 1]
+    if len(spot_sample) == 0:
+        abort(404)
+    image = compose_spot_channels(spot_sample, [channel])[channel][0]
+    return image_response(encode_image_bytes(image), "image/png", etag, image_max_age)
+
+
+@app.server.route("/images/spot-sprite/<bucket_name>/<slide_name>/<channel>.png")
+def serve_spot_sprite(bucket_name, slide_name, channel):
+    check_bucket(bucket_name)
+    try:
+        spot_id_list = [int(i) for i in request.args["ids"].split(",") if i != ""]
+        columns = int(request.args["columns"])
+    except:
+        abort(400)
+    if channel not in spot_channel_names or len(spot_id_list) == 0 or columns < 1:
+        abort(404)
+    slide_img_url = zarr_path_for_slide(bucket_name, slide_name)
+    try:
+        generation = gcs_generation(slide_img_url)
+    except:
+        abort(404)
+    etag = make_etag(slide_img_url, generation, channel, columns, spot_id_list)
+    response = not_modified(etag, image_max_age)
+    if response is not None:
+        return response
+    spot_samples = get_spot_arrays_from_zarr(slide_img_url, spot_id_list)
+    channel, sprite = spot_sprite_sheet(spot_samples, channel, columns)
+    return image_response(encode_image_bytes(sprite), "image/png", etag, image_max_age)
+
+
+@app.server.route("/images/fov/<bucket_name>/<slide_name>/<image_name>")
+def serve_fov_image(bucket_name, slide_name, image_name):
+    check_bucket(bucket_name)
+    fov_path = bucket_name + "/" + slide_name + "/spot_detection_result/" + image_name
+    try:
+        generation = gcs_generation(fov_path)
+    except:
+        abort(404)
+    etag = make_etag(fov_path, generation)
+    response = not_modified(etag, image_max_age)
+    if response is not None:
+        return response
+    mimetype = mimetypes.guess_type(image_name)[0] or "application/octet-stream"
+    return image_response(gcs.cat(fov_path), mimetype, etag, image_max_age)
+
+
+# deep zoom tile pyramids of FOV images, built on first view
+tile_store = TileStore(tile_store_dir, max_bytes=tile_store_max_mb * 1024**2)
+
+
+def ensure_fov_pyramid(bucket_name, slide_name, image_name):
+    """
+    :brief: Returns the tile store key of a FOV's pyramid, building the pyramid
+        if this version of the FOV has not been viewed before
+    """
+    fov_path = bucket_name + "/" + slide_name + "/spot_detection_result/" + image_name
+    key = tile_store.get_key(fov_path, gcs_generation(fov_path))
+    tile_store.ensure_pyramid(
+        key,
+        lambda: get_image(
+            get_thread_storage_service(make_storage_service),
+            bucket_name,
+            slide_name,
+            image_name,
+        ),
+    )
+    return key
+
+
+@app.server.route("/tiles/fov/<bucket_name>/<slide_name>/<image_name>.dzi")
+def serve_fov_dzi(bucket_name, slide_name, image_name):
+    check_bucket(bucket_name)
     try:
-        slides = slides.with_columns(
-            (pl.col("predicted_positive") * (5e6) / pl.col("rbcs"))
-            .cast(pl.Int64)
-            .alias("positives/5M rbc")
+        key = ensure_fov_pyramid(bucket_name, slide_name, image_name)
+    except FileNotFoundError:
+        abort(404)
+    etag = make_etag(key)
+    response = not_modified(etag, image_max_age)
+    if response is not None:
+        return response
+    with open(tile_store.get_dzi_path(key), "rb") as f:
+        return image_response(f.read(), "application/xml", etag, image_max_age)
+
+
+@app.server.route(
+    "/tiles/fov/<bucket_name>/<slide_name>/<image_name>_files/"
+    + "<int:level>/<int:column>_<int:row>.<tile_format>"
+)
+def serve_fov_tile(
+    bucket_name, slide_name, image_name, level, column, row, tile_format
+):
+    check_bucket(bucket_name)
+    try:
+        key = ensure_fov_pyramid(bucket_name, slide_name, image_name)
+    except FileNotFoundError:
+        abort(404)
+    etag = make_etag(key, level, column, row)
+    response = not_modified(etag, image_max_age)
+    if response is not None:
+        return response
+    tile_path = tile_store.get_tile_path(key, level, column, row)
+    if tile_path is None or tile_format != tile_store.format:
+        abort(404)
+    mimetype = mimetypes.guess_type(tile_path)[0]
+    with open(tile_path, "rb") as f:
+        return image_response(f.read(), mimetype, etag, image_max_age)
+
+
+@app.server.route("/fov-viewer/<bucket_name>/<slide_name>/<image_name>")
+def serve_fov_viewer(bucket_name, slide_name, image_name):
+    check_bucket(bucket_name)
+    dzi_url = (
+        "/".join(
+            ["/tiles/fov", quote(bucket_name), quote(slide_name), quote(image_name)]
         )
-    except:  # if calculation of positive rate fails for whatever reason, skip
-        pass
-    # add a column for viewing FOVs/spots/charts
-    # leave this in even after using get_initial_slide_df for the slides table
+        + ".dzi"
+    )
+    return get_viewer_html(dzi_url, title=image_name)
+
+
+fov_thumbnail_store = FovThumbnailStore(fov_thumbnail_dir, max_size=fov_thumbnail_size)
+
+
+def fov_thumbnail_url(bucket_name, slide_name, image_name):
+    return "/".join(
+        ["/thumbnails/fov", quote(bucket_name), quote(slide_name), quote(image_name)]
+    )
+
+
+@app.server.route("/thumbnails/fov/<bucket_name>/<slide_name>/<image_name>")
+def serve_fov_thumbnail(bucket_name, slide_name, image_name):
+    check_bucket(bucket_name)
+    fov_path = bucket_name + "/" + slide_name + "/spot_detection_result/" + image_name
     try:
-        slides.select(pl.col("slide_name"))
-    except pl.exceptions.ColumnNotFoundError:
-        try:
-            slides = get_initial_slide_df(client, bucket_name, gcs, cutoff=my_cutoff)
-        except:
-            slides = slides_placeholder
+        thumbnail_path = fov_thumbnail_store.ensure_thumbnail(
+            bucket_name, slide_name, image_name, lambda: gcs.cat(fov_path)
+        )
+    except FileNotFoundError:
+        abort(404)
+    etag = make_etag(thumbnail_path, os.path.getmtime(thumbnail_path))
+    response = not_modified(etag, image_max_age)
+    if response is not None:
+        return response
+    with open(thumbnail_path, "rb") as f:
+        return image_response(f.read(), "image/jpeg", etag, image_max_age)
 
-    slides = slides.with_columns(
-        pl.concat_str(
-            [
-                pl.lit("[View Charts](/"),
-                pl.lit("chartsview_"),
-                pl.lit(bucket_name),
-                pl.lit("/"),
-                pl.col("slide_name"),
-                pl.lit("/)"),
-            ]
-        ).alias("view_charts"),
-        pl.concat_str(
-            [
-                pl.lit("[View Spots](/"),
-                pl.lit("spotsview_"),
-                pl.lit(bucket_name),
-                pl.lit("/"),
-                pl.col("slide_name"),
-                pl.lit("/)"),
-            ]
-        ).alias("view_spots"),
-        pl.concat_str(
-            [
-                pl.lit("[View FOVs](/"),
-                pl.lit("fovsview_"),
-                pl.lit(bucket_name),
-                pl.lit("/"),
-                pl.col("slide_name"),
-                pl.lit("/)"),
-            ]
-        ).alias("view_fovs"),
+
+# mosaics are only built by scripts/build_fov_mosaics.py, the routes below just
+# read them, so the dashboard never evicts them
+mosaic_store = TileStore(mosaic_store_dir, max_bytes=None)
+
+
+def get_mosaic_version(bucket_name, slide_name):
+    """
+    :brief: Returns (tile store key, build time) of a slide's mosaic, or None if
+        it has no mosaic. The build time versions the mosaic's ETags, since
+        rebuilding a mosaic keeps its key
+    """
+    key = get_mosaic_key(mosaic_store, bucket_name, slide_name)
+    try:
+        return key, os.path.getmtime(mosaic_store.get_dzi_path(key))
+    except OSError:
+        return None
+
+
+@app.server.route("/tiles/mosaic/<bucket_name>/<slide_name>.dzi")
+def serve_mosaic_dzi(bucket_name, slide_name):
+    check_bucket(bucket_name)
+    version = get_mosaic_version(bucket_name, slide_name)
+    if version is None:
+        abort(404)
+    etag = make_etag(*version)
+    response = not_modified(etag, image_max_age)
+    if response is not None:
+        return response
+    with open(mosaic_store.get_dzi_path(version[0]), "rb") as f:
+        return image_response(f.read(), "application/xml", etag, image_max_age)
+
+
+@app.server.route(
+    "/tiles/mosaic/<bucket_name>/<slide_name>_files/"
+    + "<int:level>/<int:column>_<int:row>.<tile_format>"
+)
+def serve_mosaic_tile(bucket_name, slide_name, level, column, row, tile_format):
+    check_bucket(bucket_name)
+    version = get_mosaic_version(bucket_name, slide_name)
+    if version is None:
+        abort(404)
+    etag = make_etag(*version, level, column, row)
+    response = not_modified(etag, image_max_age)
+    if response is not None:
+        return response
+    # grid positions without a FOV have no tile
+    tile_path = mosaic_store.get_tile_path(version[0], level, column, row)
+    if tile_path is None or tile_format != mosaic_store.format:
+        abort(404)
+    mimetype = mimetypes.guess_type(tile_path)[0]
+    with open(tile_path, "rb") as f:
+        return image_response(f.read(), mimetype, etag, image_max_age)
+
+
+@app.server.route("/mosaic-viewer/<bucket_name>/<slide_name>")
+def serve_mosaic_viewer(bucket_name, slide_name):
+    check_bucket(bucket_name)
+    dzi_url = (
+        "/".join(["/tiles/mosaic", quote(bucket_name), quote(slide_name)]) + ".dzi"
     )
-    return slides
+    return get_viewer_html(dzi_url, title=slide_name + " mosaic")
+
+
+# bucket name -> time its catalog was last updated incrementally
+catalog_refreshed_at = {}
+catalog_refresh_lock = Lock()
+
+
+def refresh_catalog(bucket_name, catalog_path, my_cutoff=None):
+    """
+    :brief: update the cached catalog of a bucket incrementally, recomputing
+        only new/changed slides. Finding those still fingerprints every slide,
+        so this runs at most once per catalog_refresh_interval per bucket (or
+        whenever there is no catalog yet), and never twice at once
+    """
+    now = time.time()
+    if (
+        os.path.exists(catalog_path)
+        and now - catalog_refreshed_at.get(bucket_name, -math.inf)
+        < catalog_refresh_interval
+    ):
+        return
+    if not catalog_refresh_lock.acquire(blocking=False):
+        return  # another request is updating a catalog, serve the current one
+    try:
+        build_slide_catalog_incremental(
+            client,
+            bucket_name,
+            gcs,
+            catalog_path,
+            threshold=catalog_threshold,
+            cutoff=my_cutoff,
+            max_workers=slide_scan_workers,
+        )
+    except Exception as e:
+        print("failed to update slide catalog for " + bucket_name + ": " + str(e))
+    finally:
+        # failed updates wait out the interval too, rather than walking the
+        # bucket again on every request
+        catalog_refreshed_at[bucket_name] = now
+        catalog_refresh_lock.release()
+
+
+def slide_catalog_lazy(bucket_name, my_cutoff=None):
+    """
+    :brief: returns a pl.LazyFrame over the slide table of a bucket, with the
+        derived rate/link columns added lazily. Reads the catalog in
+        slide_df_cache_dir if there is one (memory-mapped if it is .arrow),
+        otherwise builds the slide table from the bucket
+    """
+    catalog_path = find_slide_catalog(slide_df_cache_dir, bucket_name)
+    if incremental_catalog:
+        if catalog_path is None:
+            catalog_path = os.path.join(
+                slide_df_cache_dir, bucket_name + "." + catalog_format
+            )
+        refresh_catalog(bucket_name, catalog_path, my_cutoff)
+    slides = None
+    try:
+        slides = scan_slide_catalog(catalog_path)
+        # check the catalog is readable before handing it out
+        slides.select(pl.col("slide_name")).head(1).collect()
+    except:
+        slides = get_initial_slide_df_with_predictions_only(
+            client,
+            bucket_name,
+            gcs,
+            cutoff=my_cutoff,
+            max_workers=slide_scan_workers,
+            prefetch=listing_prefetch,
+        )
+        # no slides with predictions, so fall back to top level directories
+        if slides.height == 0:
+            try:
+                slides = get_initial_slide_df(
+                    client,
+                    bucket_name,
+                    gcs,
+                    cutoff=my_cutoff,
+                    max_workers=slide_scan_workers,
+                    prefetch=listing_prefetch,
+                )
+            except:
+                slides = slides_placeholder
+        slides = slides.lazy()
+    # add columns for the positive rate and for viewing FOVs/spots/charts
+    return with_derived_columns(slides, bucket_name)
+
+
+@cache.memoize(timeout=cache_timeout)
+def slide_df_cached(bucket_name, my_cutoff=None):
+    return slide_catalog_lazy(bucket_name, my_cutoff).collect()
 
 
 # Create the image-(parasite output) grid layout
 def create_image_grid_and_options_and_display_count(
-    bucket_name, slide_name, start_index, end_index, sort_method, channel
+    bucket_name,
+    slide_name,
+    start_index,
+    end_index,
+    sort_method,
+    channel,
+    score_range=None,
 ):
     spot_imgs, scores, page_display = spot_images_and_scores_and_display_count(
-        bucket_name, slide_name, start_index, end_index, sort_method
+        bucket_name,
+        slide_name,
+        start_index,
+        end_index,
+        sort_method,
+        channel=channel,
+        sprite=spot_grid_mode == "sprite",
+        score_range=score_range,
     )
 
     # spot_imgs = spot_imgs[0]
     # spot_imgs, scores = ([Image.open("assets/images/nautilus1_tiny.jpg")],[0.99])
     image_rows = []
     channel_options = []
-    if len(spot_imgs) > 0:
+    sprite = None
+    if isinstance(spot_imgs, dict):  # one sprite sheet for the whole page
+        sprite = spot_imgs
+        channel_options = sprite["channels"]
+    elif len(spot_imgs) > 0:
         for k in spot_imgs[0].keys():
             if k == "spot_id":
                 continue
@@ -315,21 +1007,26 @@ def create_image_grid_and_options_and_display_count(
         image_row_list = []
         for j in range(spot_columns_per_page):
             try:
+                spot_index = i * spot_columns_per_page + j
+                if sprite is not None:
+                    if spot_index >= len(sprite["spot_ids"]):
+                        raise IndexError(spot_index)
+                    image = sprite_cell(sprite, spot_index)
+                else:
+                    image = html.Img(
+                        src=spot_imgs[spot_index][selected_channel],
+                        style={
+                            "width": "100px",
+                            "image-rendering": "pixelated",
+                        },
+                    )
                 image_row_list.append(
                     dbc.Col(
                         dbc.Card(
                             dbc.CardBody(
                                 [
-                                    html.Img(
-                                        src=spot_imgs[i * spot_columns_per_page + j][
-                                            selected_channel
-                                        ],
-                                        style={
-                                            "width": "100px",
-                                            "image-rendering": "pixelated",
-                                        },
-                                    ),
-                                    html.P(f"{scores[i*spot_columns_per_page+j]:.2f}"),
+                                    image,
+                                    html.P(f"{scores[spot_index]:.2f}"),
                                 ]
                             ),
                             className="image-cell",
@@ -344,6 +1041,11 @@ def create_image_grid_and_options_and_display_count(
     return image_grid, channel_options, page_display
 
 
+# sort permutations of the spot tables of recently viewed slides, so paging
+# through a slide in some order doesn't sort it again for every page
+spot_index_cache = SpotIndexCache(max_entries=spot_index_cache_size, ttl=cache_timeout)
+
+
 @cache.memoize(timeout=cache_timeout)
 def combined_spots_df(bucket_name, slide_name):
     return get_combined_spots_df(bucket_name, gcs, slide_name)
@@ -370,34 +1072,29 @@ def spot_images_and_scores_and_display_count(
     embed_preferred=True,
     zarr_fallback=True,
     rel_path_to_embeds_in_slide="version3/",
-    rel_path_to_zarr_in_slide="version1/spot_images.zip",
+    rel_path_to_zarr_in_slide=default_rel_path_to_zarr_in_slide,
+    channel=None,
+    sprite=False,
+    score_range=None,
 ):
+    """
+    :param sort_method: one of spot_sort_methods, see SpotIndex.get_permutation
+    :param score_range: (min score, max score) of the spots to page through,
+        either of which may be None, or None for every spot
+    :param channel: channel being displayed. Spots read from a zarr only have
+        this channel encoded, or every channel if None
+    :param sprite: if True, spots read from a zarr are returned as a sprite
+        sheet of channel (a dict, see get_sprite_from_zarr) rather than as a
+        list of per-spot dicts of encoded channels
+    """
     try:
-        spot_df = combined_spots_df(bucket_name, slide_name)
-        spot_count = spot_df.select(pl.count()).item()
-        if sort_method in ["ascending", "descending"]:
-            descending = True
-            if sort_method == "ascending":
-                descending = False
-            spot_df = (
-                spot_df.lazy()
-                .sort(pl.col("parasite output"), descending=descending)
-                .with_row_count()
-                .filter(
-                    (pl.col("row_nr") >= pl.lit(id_start))
-                    & (pl.col("row_nr") <= pl.lit(id_end))
-                )
-                .collect(streaming=True)
-            )
-        else:
-            spot_df = (
-                spot_df.lazy()
-                .filter(
-                    (pl.col("index") >= pl.lit(id_start))
-                    & (pl.col("index") <= pl.lit(id_end))
-                )
-                .collect(streaming=True)
-            )
+        spot_index = spot_index_cache.get(
+            (bucket_name, slide_name),
+            lambda: combined_spots_df(bucket_name, slide_name),
+        )
+        spot_df, spot_count = spot_index.get_page(
+            sort_method, id_start, id_end, score_range=score_range
+        )
         spot_ids = spot_df["index"].to_list()
         scores = spot_df["parasite output"].to_numpy()
     except:
@@ -427,12 +1124,19 @@ def spot_images_and_scores_and_display_count(
             pass
     if zarr_fallback:
         try:
-            zarr_path = (
-                bucket_name.strip("/")
-                + "/"
-                + os.path.join(slide_name, rel_path_to_zarr_in_slide)
+            zarr_path = zarr_path_for_slide(
+                bucket_name, slide_name, rel_path_to_zarr_in_slide
             )
-            spot_imgs = get_spots_from_zarr(zarr_path, spot_ids)
+            if serve_images_by_url:
+                spot_imgs = get_spot_image_urls(
+                    bucket_name, slide_name, zarr_path, spot_ids, channel, sprite
+                )
+            elif sprite:
+                spot_imgs = get_sprite_from_zarr(
+                    zarr_path, spot_ids, channel, spot_columns_per_page
+                )
+            else:
+                spot_imgs = get_spots_from_zarr(zarr_path, spot_ids, channel)
 
             page_display_string = (
                 str(id_start) + "-" + str(id_end) + " of " + str(spot_count)
@@ -440,23 +1144,21 @@ def spot_images_and_scores_and_display_count(
             return (spot_imgs, scores, page_display_string)
         except:  # default to cropping from jpeg
             pass
-    spot_coords = []
-    for spot in spot_df.rows(named=True):
-        spot_coords.append(
-            (
-                spot["FOV_row"],
-                spot["FOV_col"],
-                spot["FOV_z"],
-                spot["x"],
-                spot["y"],
-                spot["r"],
-            )
-        )
-    spot_imgs = crop_spots_from_slide(
-        storage_service, bucket_name, slide_name, spot_coords
+    spot_coords = spot_df.select(
+        ["FOV_row", "FOV_col", "FOV_z", "x", "y", "r"]
+    ).to_numpy()
+    spot_crops = crop_spots_from_slide(
+        storage_service,
+        bucket_name,
+        slide_name,
+        spot_coords,
+        service_factory=make_storage_service,
     )
-    for spot_id, image_index in zip(spot_ids, range(len(spot_imgs))):
-        spot_imgs[image_index] = {"spot_id": spot_id, "compose": spot_imgs[image_index]}
+    # encode on the same pool as spots read from a zarr
+    spot_imgs = [
+        {"spot_id": spot_id, "compose": spot_img}
+        for spot_id, spot_img in zip(spot_ids, encode_images(spot_crops))
+    ]
     page_display_string = str(id_start) + "-" + str(id_end) + " of " + str(spot_count)
     return (spot_imgs, scores, page_display_string)
 
@@ -495,11 +1197,31 @@ spot_table_layout = html.Div(
                     dcc.Dropdown(
                         id="spot-image-sorting-dropdown",
                         placeholder="Select Sorting Method",
-                        options=["no sort", "ascending", "descending"],
+                        options=spot_sort_methods,
                         value="no sort",
                         clearable=False,
                     )
                 ),
+                dbc.Col(
+                    dcc.Input(
+                        id="spot-score-min",
+                        type="number",
+                        debounce=True,
+                        min=0,
+                        max=1,
+                        placeholder="Min score",
+                    )
+                ),
+                dbc.Col(
+                    dcc.Input(
+                        id="spot-score-max",
+                        type="number",
+                        debounce=True,
+                        min=0,
+                        max=1,
+                        placeholder="Max score",
+                    )
+                ),
             ]
         ),
         html.Div(id="image-grid-container"),
@@ -517,16 +1239,29 @@ spot_table_layout = html.Div(
     Input("pagination", "value"),
     Input("spot-image-sorting-dropdown", "value"),
     Input("spot-image-channel-dropdown", "value"),
+    Input("spot-score-min", "value"),
+    Input("spot-score-max", "value"),
 )
-def update_image_grid(bucket_name, slide_name, page, sort_method, channel):
+def update_image_grid(
+    bucket_name, slide_name, page, sort_method, channel, score_min, score_max
+):
     try:
         page = int(page)
     except (ValueError, TypeError):
         page = 1
     start_index = (page - 1) * spots_per_page
     end_index = page * spots_per_page
+    score_range = None
+    if score_min is not None or score_max is not None:
+        score_range = (score_min, score_max)
     return create_image_grid_and_options_and_display_count(
-        bucket_name, slide_name, start_index, end_index, sort_method, channel
+        bucket_name,
+        slide_name,
+        start_index,
+        end_index,
+        sort_method,
+        channel,
+        score_range=score_range,
     )
 
 
@@ -547,7 +1282,7 @@ graph_layout = html.Div(
 @cache.memoize(timeout=cache_timeout)
 def get_plot_df(bucket_name, slide_name):
     spot_df = get_spots_csv(bucket_name, gcs, slide_name)
-    thresholds = np.linspace(0.0, 1.0, 200, endpoint=False)
+    thresholds = np.linspace(0.0, 1.0, chart_threshold_points, endpoint=False)
     plot_df = get_detection_stats_vs_threshold(spot_df, thresholds)
     spot_count = len(spot_df)
     plot_df = plot_df.with_columns(
@@ -615,6 +1350,24 @@ app.layout = html.Div(
     ]
 )
 
+if slide_table_mode == "custom":
+    slide_table_actions = {
+        "filter_action": "custom",
+        "filter_query": "",
+        "sort_action": "custom",
+        "sort_mode": "multi",
+        "sort_by": [],
+        "page_action": "custom",
+        "page_count": 1,
+    }
+else:
+    slide_table_actions = {
+        "filter_action": "native",
+        "sort_action": "native",
+        "sort_mode": "multi",
+        "page_action": "native",
+    }
+
 # TODO: Display data from populate_slide_rows on cell/row select
 index_page = html.Div(
     [
@@ -663,33 +1416,21 @@ index_page = html.Div(
                 for row in slides_placeholder.rows(named=True)
             ],
             tooltip_duration=None,
-            filter_action="native",
-            sort_action="native",
-            sort_mode="multi",
             # column_selectable="single",
             row_selectable="single",
             selected_columns=[],
             selected_rows=[],
-            page_action="native",
             page_current=0,
             page_size=slides_per_page,
+            **slide_table_actions,
         ),
+        # threshold edits of the custom mode slide table, as
+        # {bucket name: {slide name: {column: value}}}
+        dcc.Store(id="slide-edits", data={}),
     ]
 )
 
 
-@app.callback(
-    Output("slides-table", "data"),
-    Output("slides-table", "columns"),
-    Output("slides-table", "tooltip_data"),
-    [
-        Input("bucket-name-dropdown", "value"),
-        Input("slides-table", "selected_rows"),
-        Input("slides-table", "data"),
-        Input("slides-table", "columns"),
-        Input("slides-table", "tooltip_data"),
-    ],
-)
 def update_slide_df_master(bucket_name, selected_rows, data, columns, tooltip_data):
     ctx = callback_context
     if ctx.triggered[0]["prop_id"] == ".":
@@ -703,29 +1444,189 @@ def update_slide_df_master(bucket_name, selected_rows, data, columns, tooltip_da
         return ret_data, columns, tooltip_data
 
 
-def switch_bucket(bucket_name):
-    slides = slide_df_cached(bucket_name, cutoff)
-
-    # drop cols which are all null from slides
-    slides = slides[[s.name for s in slides if not (s.null_count() == slides.height)]]
-
+def get_slide_table_columns(slides):
+    """
+    :brief: DataTable columns of a slide table, leaving out columns which are
+        all null
+    """
     # Allows creation of a link to the FOVs page
-    columns = [
+    return [
         {"id": i, "name": i, "presentation": "markdown"}
         if i in ["view_fovs", "view_charts", "view_spots"]
         else {"name": i, "id": i, "selectable": True, "editable": True}
         if i == "threshold"
         else {"name": i, "id": i, "selectable": True}
         for i in slides.columns
+        if slides[i].null_count() != slides.height
     ]
-    data = slides.to_pandas().to_dict("records")
-    tooltip_data = [
-        {"slide_name": {"value": row["slide_name"], "type": "markdown"}}
-        for row in slides.rows(named=True)
+
+
+def get_slide_table_tooltips(slides):
+    return [
+        {"slide_name": {"value": slide_name, "type": "markdown"}}
+        for slide_name in slides["slide_name"].to_list()
     ]
+
+
+def switch_bucket(bucket_name):
+    slides = slide_df_cached(bucket_name, cutoff)
+    columns = get_slide_table_columns(slides)
+    # drop cols which are all null from slides
+    slides = slides.select([column["id"] for column in columns])
+    data = slides.to_pandas().to_dict("records")
+    tooltip_data = get_slide_table_tooltips(slides)
     return (data, columns, tooltip_data)
 
 
+def update_slide_page(
+    bucket_name, page_current, page_size, sort_by, filter_query, slide_edits
+):
+    """
+    :brief: query the page of the slide table the custom mode table shows, from
+        the cached catalog with the threshold edits made so far applied, so
+        that only that page is sent to the browser
+    :return: page data, columns, tooltips, page count and current page
+    """
+    ctx = callback_context
+    trigger = ctx.triggered[0]["prop_id"].split(".")
+    if trigger[0] == "bucket-name-dropdown" or trigger[-1] in [
+        "sort_by",
+        "filter_query",
+    ]:
+        page_current = 0
+    if bucket_name is None:
+        bucket_name = bucket_names[0]
+    slides = slide_df_cached(bucket_name, cutoff)
+    columns = get_slide_table_columns(slides)
+    table = apply_row_edits(
+        slides.lazy().select([column["id"] for column in columns]),
+        (slide_edits or {}).get(bucket_name, {}),
+        "slide_name",
+    )
+    page, row_count = query_table_page(
+        table,
+        page_current,
+        page_size,
+        sort_by=sort_by,
+        filter_query=filter_query,
+        tiebreak="slide_name",
+    )
+    page_count = max(1, -(-row_count // page_size))
+    if page_current >= page_count:
+        # the filter left fewer pages than before, show the last one
+        page_current = page_count - 1
+        page, row_count = query_table_page(
+            table,
+            page_current,
+            page_size,
+            sort_by=sort_by,
+            filter_query=filter_query,
+            tiebreak="slide_name",
+        )
+    return (
+        page.to_pandas().to_dict("records"),
+        columns,
+        get_slide_table_tooltips(page),
+        page_count,
+        page_current,
+    )
+
+
+# columns of a slide table row that change with its threshold
+slide_edit_columns = [
+    "threshold",
+    "predicted_positive",
+    "predicted_negative",
+    "predicted_unsure",
+    "pos_annotated",
+    "neg_annotated",
+    "unsure_annotated",
+    "total_annotated_positive_negative",
+    "positives/5M rbc",
+]
+
+
+def edit_slide_threshold(selected_rows, data, bucket_name, data_previous, slide_edits):
+    """
+    :brief: recompute the prediction counts of the selected slide in the custom
+        mode table from the threshold entered in its row, and keep them as an
+        edit applied to every later page query
+    """
+    ctx = callback_context
+    if not selected_rows or not data or selected_rows[0] >= len(data):
+        raise PreventUpdate
+    row_index = selected_rows[0]
+    if ctx.triggered[0]["prop_id"] == "slides-table.data":
+        # only a threshold typed into the selected row counts as an edit, not
+        # a new page of rows being shown
+        try:
+            previous_row = data_previous[row_index]
+        except:
+            raise PreventUpdate
+        if previous_row["slide_name"] != data[row_index]["slide_name"] or (
+            previous_row.get("threshold") == data[row_index].get("threshold")
+        ):
+            raise PreventUpdate
+    if bucket_name is None:
+        bucket_name = bucket_names[0]
+    slide_edits = dict(slide_edits or {})
+    bucket_edits = dict(slide_edits.get(bucket_name, {}))
+    relevant_row = update_slide_data(bucket_name, [row_index], list(data))[row_index]
+    row_edits = {
+        k: relevant_row[k]
+        for k in slide_edit_columns
+        if relevant_row.get(k) is not None
+    }
+    if bucket_edits.get(relevant_row["slide_name"]) == row_edits:
+        raise PreventUpdate
+    bucket_edits[relevant_row["slide_name"]] = row_edits
+    slide_edits[bucket_name] = bucket_edits
+    return slide_edits
+
+
+if slide_table_mode == "custom":
+    app.callback(
+        Output("slides-table", "data"),
+        Output("slides-table", "columns"),
+        Output("slides-table", "tooltip_data"),
+        Output("slides-table", "page_count"),
+        Output("slides-table", "page_current"),
+        [
+            Input("bucket-name-dropdown", "value"),
+            Input("slides-table", "page_current"),
+            Input("slides-table", "page_size"),
+            Input("slides-table", "sort_by"),
+            Input("slides-table", "filter_query"),
+            Input("slide-edits", "data"),
+        ],
+    )(update_slide_page)
+    app.callback(
+        Output("slide-edits", "data"),
+        [
+            Input("slides-table", "selected_rows"),
+            Input("slides-table", "data"),
+        ],
+        [
+            State("bucket-name-dropdown", "value"),
+            State("slides-table", "data_previous"),
+            State("slide-edits", "data"),
+        ],
+    )(edit_slide_threshold)
+else:
+    app.callback(
+        Output("slides-table", "data"),
+        Output("slides-table", "columns"),
+        Output("slides-table", "tooltip_data"),
+        [
+            Input("bucket-name-dropdown", "value"),
+            Input("slides-table", "selected_rows"),
+            Input("slides-table", "data"),
+            Input("slides-table", "columns"),
+            Input("slides-table", "tooltip_data"),
+        ],
+    )(update_slide_df_master)
+
+
 def update_slide_data(bucket_name, selected_rows, data):
     if len(selected_rows) == 0:
         return data
@@ -769,10 +1670,35 @@ def display_page(pathname):
         page_name = pathname.split("/")[-4]
         # get the image name from the URL
         image_name = pathname.split("/")[-2]
-        # get the image from GCS
-        image = get_image(
-            storage_service, bucket_name, page_name, image_name, resize_factor=1.0
-        )
+        if fov_view_mode == "deepzoom":
+            # the viewer only fetches the tiles it shows from serve_fov_tile
+            return html.Div(
+                [
+                    html.H1(f"FOV {image_name} from slide: {page_name}"),
+                    html.Br(),
+                    html.Iframe(
+                        src="/".join(
+                            [
+                                "/fov-viewer",
+                                quote(bucket_name),
+                                quote(page_name),
+                                quote(image_name),
+                            ]
+                        ),
+                        style={"width": "100%", "height": "80vh", "border": "none"},
+                    ),
+                ]
+            )
+        if serve_images_by_url:
+            # the browser fetches (and caches) the image from serve_fov_image
+            image = "/".join(
+                ["/images/fov", quote(bucket_name), quote(page_name), quote(image_name)]
+            )
+        else:
+            # get the image from GCS
+            image = get_image(
+                storage_service, bucket_name, page_name, image_name, resize_factor=1.0
+            )
         # # display the image
         return html.Div(
             [
@@ -801,9 +1727,17 @@ def display_page(pathname):
                 ]
             ).alias("view_fov")
         )
+        mosaic_link = html.Div()
+        if get_mosaic_version(bucket_name, page_name) is not None:
+            mosaic_link = html.A(
+                "View slide mosaic",
+                href="/".join(["/mosaic-viewer", quote(bucket_name), quote(page_name)]),
+                target="_blank",
+            )
         page_content = html.Div(
             [
                 html.H1(f"FOVs from slide: {page_name}"),
+                mosaic_link,
                 html.Div(
                     [
                         # FOVs table
@@ -832,32 +1766,25 @@ def display_page(pathname):
                                     "border": "1px solid blue",
                                 }
                             ],
-                            # show FOV image in tooltip, on hover over the image_uri column
-                            # tooltip_data=[
-                            #     {
-                            #         "image_uri": {
-                            #             # "value": "![Slide Image]({})".format(
-                            #             #     row[
-                            #             #         "image_uri"
-                            #             #     ]  # directly embedding from google, images are too big for tooltips
-                            #             #     # dash.get_relative_path(row["image_uri"])
-                            #             # ),
-                            #             "value": html.Img(
-                            #                 src=get_image(
-                            #                     storage_service,
-                            #                     bucket_name,
-                            #                     page_name,
-                            #                     fovs_df["image_uri"][0].split("/")[-1],
-                            #                     resize_factor=0.1,
-                            #                 ),
-                            #             ),
-                            #             "type": "markdown",
-                            #         }
-                            #     }
-                            #     for row in fovs_df.to_pandas().to_dict("records")
-                            # ],
-                            # tooltip_duration=None,
-                            # tooltip_delay=None,
+                            # show a FOV thumbnail in a tooltip, on hover over the
+                            # image_uri column. The browser only fetches it on hover
+                            tooltip_data=[
+                                {
+                                    "image_uri": {
+                                        "value": "![FOV]({})".format(
+                                            fov_thumbnail_url(
+                                                bucket_name,
+                                                page_name,
+                                                image_uri.split("/")[-1],
+                                            )
+                                        ),
+                                        "type": "markdown",
+                                    }
+                                }
+                                for image_uri in fovs_df["image_uri"].to_list()
+                            ],
+                            tooltip_duration=None,
+                            tooltip_delay=0,
                         ),
                     ]
                 ),
@@ -14,6 +14,7 @@ from utils.demo_io import (
 )
 import polars as pl
 from gcsfs import GCSFileSystem
+from PIL import Image
 
 cutoff = 10  # how many slides to view cropped spot images from
 
@@ -61,23 +62,13 @@ for sl in slides_of_interest:
     spot_df_top = spot_df.sort(pl.col("parasite output"), descending=True).head(20)
 
     spot_df_top = spot_df_top.with_columns(spot_df_top["r"].cast(pl.Int64) * 2)
-    spot_coords = []
-
-    for spot in spot_df_top.rows(named=True):
-        spot_coords.append(
-            (
-                spot["FOV_row"],
-                spot["FOV_col"],
-                spot["FOV_z"],
-                spot["x"],
-                spot["y"],
-                spot["r"],
-            )
-        )
+    spot_coords = spot_df_top.select(
+        ["FOV_row", "FOV_col", "FOV_z", "x", "y", "r"]
+    ).to_numpy()
 
     print(spot_df_top)
 
     spot_imgs = crop_spots_from_slide(storage_service, bucket_name, sl, spot_coords)
 
     for img in spot_imgs:
-        img.show()
+        Image.fromarray(img).show()
@@ -0,0 +1,115 @@
+"""
+Benchmark for building the initial slide dataframe from per-slide inventory rows,
+comparing the old one-row-frame + pl.concat loop against the ColumnAccumulator
+builder used by get_initial_slide_df*. No GCS access is needed, the inventory
+rows are synthetic.
+
+Run from the root directory of the repository:
+    python scripts/benchmark_slide_df_builders.py [slide_count]
+
+Each builder runs in its own subprocess so peak RSS can be reported per builder.
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import polars as pl
+from utils.demo_io import _slide_df_from_inventory
+
+default_slide_count = 10000
+
+
+def synthetic_inventory(slide_count):
+    return [
+        {
+            "slide_name": "slide_" + str(i) + "_2023-01-01_00-00-00.000000",
+            "fov_count": 500 + i % 300,
+            "rbcs": None if i % 7 == 0 else 1000000 + i,
+        }
+        for i in range(slide_count)
+    ]
+
+
+def concat_builder(inventory_rows):
+    """
+    :brief: the per-row builder get_initial_slide_df* used before
+        ColumnAccumulator, kept here as the benchmark baseline
+    """
+    slide_df = pl.DataFrame()
+    for inventory_row in inventory_rows:
+        slide_row_dict = {}
+        slide_row_dict["slide_name"] = [inventory_row["slide_name"]]
+        slide_row_dict["fov_count"] = [inventory_row["fov_count"]]
+        slide_row_dict["rbcs"] = [inventory_row["rbcs"]]
+        slide_row_dict["threshold"] = [None]
+        slide_row_dict["predicted_positive"] = [None]
+        slide_row_dict["predicted_negative"] = [None]
+        slide_row_dict["predicted_unsure"] = [None]
+        slide_row_dict["pos_annotated"] = [None]
+        slide_row_dict["neg_annotated"] = [None]
+        slide_row_dict["unsure_annotated"] = [None]
+        slide_row_dict["total_annotated_positive_negative"] = [None]
+
+        slide_row = pl.DataFrame(slide_row_dict)
+        slide_row = slide_row.with_columns(slide_row["rbcs"].cast(pl.Int64))
+        slide_row = slide_row.with_columns(slide_row["threshold"].cast(pl.Float32))
+        slide_row = slide_row.with_columns(
+            slide_row["predicted_positive"].cast(pl.Int64)
+        )
+        slide_row = slide_row.with_columns(
+            slide_row["predicted_negative"].cast(pl.Int64)
+        )
+        slide_row = slide_row.with_columns(slide_row["predicted_unsure"].cast(pl.Int64))
+        slide_row = slide_row.with_columns(slide_row["pos_annotated"].cast(pl.Int64))
+        slide_row = slide_row.with_columns(slide_row["neg_annotated"].cast(pl.Int64))
+        slide_row = slide_row.with_columns(slide_row["unsure_annotated"].cast(pl.Int64))
+        slide_row = slide_row.with_columns(
+            slide_row["total_annotated_positive_negative"].cast(pl.Int64)
+        )
+        slide_df = pl.concat([slide_df, slide_row])
+    return slide_df
+
+
+builders = {
+    "concat": concat_builder,
+    "accumulator": _slide_df_from_inventory,
+}
+
+
+def run_one(builder_name, slide_count):
+    inventory_rows = synthetic_inventory(slide_count)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    slide_df = builders[builder_name](inventory_rows)
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert slide_df.height == slide_count
+    # ru_maxrss is in KiB on Linux
+    print(
+        builder_name
+        + ": "
+        + str(slide_count)
+        + " slides in "
+        + f"{elapsed:.3f}"
+        + " s, peak RSS growth "
+        + f"{(rss_after - rss_before) / 1024:.1f}"
+        + " MiB"
+    )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2:
+        run_one(sys.argv[1], int(sys.argv[2]))
+    else:
+        slide_count = default_slide_count
+        if len(sys.argv) > 1:
+            slide_count = int(sys.argv[1])
+        for builder_name in builders.keys():
+            subprocess.run(
+                [sys.executable, __file__, builder_name, str(slide_count)],
+                check=True,
+            )
@@ -0,0 +1,170 @@
+"""
+Benchmark for the spot_images.zip layouts written by scripts/zarr_populator.py,
+comparing the original one-uncompressed-chunk-per-spot-and-channel layout against
+the batched layout written with write_spot_zarr's defaults. No GCS access is
+needed, the spots are synthetic and the zips are written to a temporary directory.
+
+For every layout the file size, number of zip members, and the number of reads,
+bytes read and latency of loading pages of spots through RemoteZipStore are
+reported. Reads go through a file wrapper that can add a simulated round trip
+time per read, to approximate reading the zip from GCS.
+
+Run from the root directory of the repository:
+    python scripts/benchmark_zarr_layouts.py [spot_count] [page_size] [rtt_ms]
+"""
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import zarr
+from utils.zarr_utils import (
+    RemoteZipStore,
+    default_spot_compressor,
+    default_spots_per_chunk,
+    get_spot_layout,
+    select_spots,
+    write_spot_zarr,
+)
+
+default_spot_count = 5000
+default_page_size = 100
+default_rtt_ms = 0.0
+
+layouts = {
+    "per_spot_channel": {
+        "spots_per_chunk": 1,
+        "channels_per_chunk": 1,
+        "compressor": None,
+    },
+    "batched": {
+        "spots_per_chunk": default_spots_per_chunk,
+        "channels_per_chunk": None,
+        "compressor": default_spot_compressor,
+    },
+}
+
+
+class CountingFile:
+    """
+    :brief: read-only file wrapper counting reads and bytes read, sleeping rtt
+        seconds per read to simulate a remote file
+    """
+
+    def __init__(self, path, rtt=0.0):
+        self._f = open(path, "rb")
+        self.rtt = rtt
+        self.reads = 0
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        if self.rtt > 0:
+            time.sleep(self.rtt)
+        data = self._f.read(size)
+        self.reads += 1
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+    def seekable(self):
+        return True
+
+    def close(self):
+        self._f.close()
+
+
+def synthetic_spots(spot_count):
+    """
+    :brief: smooth 31x31 blobs plus noise in 4 channels, roughly as compressible
+        as real spot crops
+    """
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:31, 0:31]
+    blob = np.exp(-((yy - 15) ** 2 + (xx - 15) ** 2) / 40.0)
+    data = np.empty((spot_count, 4, 1, 31, 31), dtype=np.uint8)
+    for c in range(4):
+        scale = rng.uniform(50, 200, size=(spot_count, 1, 1))
+        noise = rng.normal(0, 4, size=(spot_count, 31, 31))
+        data[:, c, 0] = np.clip(scale * blob + noise + 20, 0, 255).astype(np.uint8)
+    return data
+
+
+def run_layout(layout_name, data, zip_path, page_size, rtt):
+    with zarr.ZipStore(zip_path, mode="w") as store:
+        write_spot_zarr(store, data, **layouts[layout_name])
+    with zipfile.ZipFile(zip_path) as zf:
+        member_count = len(zf.infolist())
+
+    f = CountingFile(zip_path, rtt=rtt)
+    spot_images = zarr.open(store=RemoteZipStore(f, mode="r"), mode="r")["/spot_images"]
+    open_reads = f.reads
+    layout = get_spot_layout(spot_images)
+
+    page_starts = list(range(0, data.shape[0] - page_size + 1, page_size))[:10]
+    f.reads = 0
+    f.bytes_read = 0
+    start = time.perf_counter()
+    for page_start in page_starts:
+        ids = list(range(page_start, page_start + page_size))
+        spots = select_spots(spot_images, ids)
+        assert np.array_equal(spots, data[page_start : page_start + page_size])
+    elapsed = time.perf_counter() - start
+    f.close()
+
+    pages = len(page_starts)
+    print(
+        layout_name
+        + " ("
+        + str(layout["spots_per_chunk"])
+        + " spots x "
+        + str(layout["channels_per_chunk"])
+        + " channels per chunk, compressor "
+        + str(layout["compressor"])
+        + "): "
+        + f"{os.path.getsize(zip_path) / 1024**2:.2f}"
+        + " MiB, "
+        + str(member_count)
+        + " members, "
+        + str(open_reads)
+        + " reads to open; per "
+        + str(page_size)
+        + "-spot page: "
+        + f"{f.reads / pages:.1f}"
+        + " reads, "
+        + f"{f.bytes_read / pages / 1024:.1f}"
+        + " KiB read, "
+        + f"{1000 * elapsed / pages:.1f}"
+        + " ms"
+    )
+
+
+if __name__ == "__main__":
+    spot_count = default_spot_count
+    page_size = default_page_size
+    rtt_ms = default_rtt_ms
+    if len(sys.argv) > 1:
+        spot_count = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        page_size = int(sys.argv[2])
+    if len(sys.argv) > 3:
+        rtt_ms = float(sys.argv[3])
+
+    data = synthetic_spots(spot_count)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for layout_name in layouts.keys():
+            run_layout(
+                layout_name,
+                data,
+                os.path.join(tmp_dir, layout_name + ".zip"),
+                page_size,
+                rtt_ms / 1000,
+            )
@@ -0,0 +1,76 @@
+"""
+Offline job building slide-wide FOV mosaics, viewable from the FOVs page of each
+slide in the dashboard. Each slide's FOVs are downsampled and placed by the row and
+column in their [row]_[col]_[z].jpg file names, see utils/fov_mosaic.py.
+
+Run from the root directory of the repository, after editing bucket_name below:
+    python scripts/build_fov_mosaics.py [slide name ...]
+
+With no slide names, mosaics are built for every slide in the bucket. Mosaics are
+written to mosaic_store_dir from the DISPLAY section of config.ini (mosaic-store/
+by default); rerunning the job replaces a slide's mosaic.
+"""
+from configparser import ConfigParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcsfs import GCSFileSystem
+from google.cloud import storage
+
+from utils.fov_mosaic import build_slide_mosaic
+from utils.slide_catalog import list_catalog_slides
+from utils.tile_pyramid import TileStore
+
+# Parse in key and bucket name from config file
+cfp = ConfigParser()
+cfp.read("config.ini")
+
+service_account_key_json = cfp["GCS"]["gcs_storage_key"]
+
+bucket_name = "YOUR BUCKET NAME HERE"
+
+mosaic_store_dir = "mosaic-store"
+try:
+    mosaic_store_dir = cfp["DISPLAY"]["mosaic_store_dir"]
+except:
+    pass
+
+# side length in pixels of each FOV in the mosaic at full zoom
+cell_size = 256
+
+# number of FOVs downloaded and downsampled at once, which bounds memory use
+max_workers = 16
+
+gcs = GCSFileSystem(token=service_account_key_json)
+client = storage.Client.from_service_account_json(service_account_key_json)
+
+slides = sys.argv[1:]
+if len(slides) == 0:
+    slides = list_catalog_slides(client, bucket_name)
+
+# mosaics are only built here, so they are never evicted
+tile_store = TileStore(mosaic_store_dir, max_bytes=None)
+for slide_name in slides:
+    start = time.perf_counter()
+    try:
+        build_slide_mosaic(
+            client,
+            gcs,
+            bucket_name,
+            slide_name,
+            tile_store,
+            cell_size=cell_size,
+            max_workers=max_workers,
+        )
+        print(
+            "built mosaic of "
+            + slide_name
+            + " in "
+            + f"{time.perf_counter() - start:.1f}"
+            + " s"
+        )
+    except Exception as e:
+        print("failed to build mosaic of " + slide_name + ": " + str(e))
@@ -0,0 +1,23 @@
+"""
+Convert a slide catalog between the formats supported by utils/slide_catalog.py,
+picked by file extension (.arrow, .parquet or .csv). For example, to import an
+existing csv catalog so the dashboard can memory-map it:
+
+    python scripts/convert_slide_catalog.py slide_df_cache/BUCKET.csv slide_df_cache/BUCKET.arrow
+
+or to export a catalog to csv:
+
+    python scripts/convert_slide_catalog.py slide_df_cache/BUCKET.arrow BUCKET.csv
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.slide_catalog import convert_slide_catalog
+
+if len(sys.argv) != 3:
+    print("usage: python scripts/convert_slide_catalog.py SOURCE DESTINATION")
+    sys.exit(1)
+
+convert_slide_catalog(sys.argv[1], sys.argv[2])
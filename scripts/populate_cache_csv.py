@@ -13,6 +13,7 @@ from utils.demo_io import (
     get_spots_csv,
 )
 from utils.polars_helpers import get_results_from_threshold
+from utils.slide_catalog import build_slide_catalog_incremental, write_slide_catalog
 import polars as pl
 from gcsfs import GCSFileSystem
 
@@ -22,6 +23,10 @@ default_threshold = 0.876  # threshold given in rinni's code
 
 csv_write_path = "slide_df_cache/"
 
+# format to write the catalog in, one of "arrow" (memory-mappable, the default),
+# "parquet" or "csv"
+catalog_format = "arrow"
+
 # Parse in key and bucket name from config file
 cfp = ConfigParser()
 cfp.read("config.ini")
@@ -30,7 +35,11 @@ service_account_key_json = cfp["GCS"]["gcs_storage_key"]
 
 bucket_name = "YOUR BUCKET NAME HERE"
 
-csv_write_path += bucket_name + ".csv"
+# only recompute slides that are new or whose input files changed since the last
+# run, using the manifest written next to the csv. Set to False to rebuild every slide
+incremental = True
+
+csv_write_path += bucket_name + "." + catalog_format
 
 # Define GCS file system so files can be read
 gcs = GCSFileSystem(token=service_account_key_json)
@@ -45,19 +54,25 @@ client = storage.Client.from_service_account_json(service_account_key_json)
 # Create a storage client
 storage_service = build("storage", "v1", credentials=credentials)
 
-# Get an initial, mostly-unpopulated slide dataframe
-slide_df = get_initial_slide_df_with_predictions_only(client, bucket_name, gcs)
-if slide_df.select(pl.count()).item() == 0:
-    slide_df = get_initial_slide_df(client, bucket_name, gcs)
+if incremental:
+    slide_df = build_slide_catalog_incremental(
+        client, bucket_name, gcs, csv_write_path, threshold=default_threshold
+    )
+    print(slide_df)
+else:
+    # Get an initial, mostly-unpopulated slide dataframe
+    slide_df = get_initial_slide_df_with_predictions_only(client, bucket_name, gcs)
+    if slide_df.select(pl.count()).item() == 0:
+        slide_df = get_initial_slide_df(client, bucket_name, gcs)
 
-print(slide_df)
+    print(slide_df)
 
-slide_list = slide_df["slide_name"].to_list()
+    slide_list = slide_df["slide_name"].to_list()
 
-slide_df = populate_slide_rows(
-    client, bucket_name, gcs, slide_df, slide_list, set_threshold=default_threshold
-)
+    slide_df = populate_slide_rows(
+        client, bucket_name, gcs, slide_df, slide_list, set_threshold=default_threshold
+    )
 
-print(slide_df)
+    print(slide_df)
 
-slide_df.write_csv(csv_write_path)
+    write_slide_catalog(slide_df, csv_write_path)
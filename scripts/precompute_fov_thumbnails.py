@@ -0,0 +1,71 @@
+"""
+Batch job making the small FOV thumbnails shown when hovering over rows of the
+FOVs table, so the dashboard never has to decode full FOV frames for them. FOVs
+that already have a thumbnail are skipped, so the job can be rerun as new slides
+are added.
+
+Run from the root directory of the repository, after editing bucket_name below:
+    python scripts/precompute_fov_thumbnails.py [slide name ...]
+
+With no slide names, thumbnails are made for every slide in the bucket. They are
+written to fov_thumbnail_dir from the DISPLAY section of config.ini
+(fov-thumbnails/ by default).
+"""
+from configparser import ConfigParser
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gcsfs import GCSFileSystem
+from google.cloud import storage
+
+from utils.fov_thumbnails import FovThumbnailStore, precompute_slide_thumbnails
+from utils.slide_catalog import list_catalog_slides
+
+# Parse in key and bucket name from config file
+cfp = ConfigParser()
+cfp.read("config.ini")
+
+service_account_key_json = cfp["GCS"]["gcs_storage_key"]
+
+bucket_name = "YOUR BUCKET NAME HERE"
+
+fov_thumbnail_dir = "fov-thumbnails"
+try:
+    fov_thumbnail_dir = cfp["DISPLAY"]["fov_thumbnail_dir"]
+except:
+    pass
+
+fov_thumbnail_size = 256
+try:
+    fov_thumbnail_size = int(cfp["DISPLAY"]["fov_thumbnail_size"])
+except:
+    pass
+
+# number of FOVs downloaded and thumbnailed at once
+max_workers = 16
+
+gcs = GCSFileSystem(token=service_account_key_json)
+client = storage.Client.from_service_account_json(service_account_key_json)
+
+slides = sys.argv[1:]
+if len(slides) == 0:
+    slides = list_catalog_slides(client, bucket_name)
+
+thumbnail_store = FovThumbnailStore(fov_thumbnail_dir, max_size=fov_thumbnail_size)
+for slide_name in slides:
+    start = time.perf_counter()
+    made = precompute_slide_thumbnails(
+        client, gcs, bucket_name, slide_name, thumbnail_store, max_workers=max_workers
+    )
+    print(
+        "made "
+        + str(made)
+        + " thumbnails for "
+        + slide_name
+        + " in "
+        + f"{time.perf_counter() - start:.1f}"
+        + " s"
+    )
@@ -14,11 +14,16 @@ import polars as pl
 from gcsfs import GCSFileSystem
 from PIL import Image
 import asyncio
-import xarray as xr
 import numpy as np
 import zarr
 import os
 
+from utils.zarr_utils import (
+    write_spot_zarr,
+    default_spots_per_chunk,
+    default_spot_compressor,
+)
+
 # Parse in key and bucket name from config file
 cfp = ConfigParser()
 cfp.read("config.ini")
@@ -30,6 +35,14 @@ bucket_name = "YOUR BUCKET NAME HERE"
 
 rel_zipzarr_path = "version1/spot_images.zip"
 
+# spot_images layout: each chunk holds spots_per_chunk spots with all of their
+# channels, compressed with compressor. For the original layout of one uncompressed
+# chunk per spot and channel, set spots_per_chunk = 1, channels_per_chunk = 1 and
+# compressor = None. scripts/benchmark_zarr_layouts.py compares layouts
+spots_per_chunk = default_spots_per_chunk
+channels_per_chunk = None
+compressor = default_spot_compressor
+
 
 # Define GCS file system so files can be read
 gcs = GCSFileSystem(token=service_account_key_json)
@@ -58,21 +71,19 @@ for npypath in slide_npys_of_interest:
     print(slide_name)
     gcs.get(bucket_name.strip("/")+"/"+npypath, slide_dir_path+"test.npy")
     data = np.load(slide_dir_path+"test.npy")
-    data = xr.DataArray(data, dims=['t','c','y','x'])
-    data = data.expand_dims('z')
-    data = data.transpose('t','c','z','y','x')
-
-    print(data)
-
-    y_dim = data.shape[data.dims.index('y')]
-    x_dim = data.shape[data.dims.index('x')]
-
-    ds = xr.Dataset({'spot_images':data})
-    ds.spot_images.encoding = {'chunks': (1,1,1,y_dim,x_dim)}
+    # (t, c, y, x) -> (t, c, z, y, x)
+    data = data[:, :, np.newaxis, :, :]
 
+    print(data.shape)
 
     with zarr.ZipStore(slide_dir_path+'spot_images.zip', mode='w') as store:
-        ds.to_zarr(store, mode='w')
+        write_spot_zarr(
+            store,
+            data,
+            spots_per_chunk=spots_per_chunk,
+            compressor=compressor,
+            channels_per_chunk=channels_per_chunk,
+        )
     print("uploading zarr")
     
     zarr_upload_path = bucket_name+"/"+slide_name+"/"+rel_zipzarr_path
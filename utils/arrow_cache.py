@@ -0,0 +1,173 @@
+"""
+Flask-Caching filesystem backend that stores polars DataFrames as Arrow IPC.
+
+The stock filesystem cache pickles every value, so each hit on a memoized spot
+table or slide catalog unpickles and copies the whole frame. This backend writes
+DataFrame values to uncompressed Arrow IPC files instead, and reads them back with
+pl.read_ipc(memory_map=True): a hit maps the file and wraps its buffers, without
+deserializing or copying the data. Every other value is pickled as before.
+
+The regular cache file of a DataFrame value only holds its expiry time and a small
+pickled ArrowCacheEntry naming the IPC file, which is kept in the arrow/
+subdirectory of the cache directory. So expiry, pruning and the file count work as
+they do for the stock backend. Select it with
+    Cache(app.server, config={"CACHE_TYPE": "utils.arrow_cache.ArrowFileSystemCache",
+                              "CACHE_DIR": "cache-directory"})
+"""
+import os
+import pickle
+import tempfile
+
+from flask_caching.backends.filesystemcache import FileSystemCache
+import polars as pl
+
+
+class ArrowCacheEntry:
+    """
+    :brief: pickled in place of a DataFrame value, naming the Arrow IPC file
+        holding it
+    """
+
+    __slots__ = ["name"]
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getstate__(self):
+        return self.name
+
+    def __setstate__(self, state):
+        self.name = state
+
+
+class ArrowFileSystemCache(FileSystemCache):
+    # subdirectory of the cache directory holding the Arrow IPC files
+    _arrow_dir_name = "arrow"
+
+    def __init__(self, cache_dir, *args, **kwargs):
+        self._arrow_dir = os.path.join(cache_dir, self._arrow_dir_name)
+        os.makedirs(self._arrow_dir, exist_ok=True)
+        FileSystemCache.__init__(self, cache_dir, *args, **kwargs)
+
+    def _is_mgmt(self, name):
+        # keep the arrow/ directory out of the listing of cache files
+        return name == self._arrow_dir_name or FileSystemCache._is_mgmt(self, name)
+
+    def _get_arrow_path(self, key):
+        return os.path.join(
+            self._arrow_dir, os.path.basename(self._get_filename(key)) + ".arrow"
+        )
+
+    def get(self, key):
+        value = FileSystemCache.get(self, key)
+        if isinstance(value, ArrowCacheEntry):
+            try:
+                return pl.read_ipc(
+                    os.path.join(self._arrow_dir, value.name),
+                    memory_map=True,
+                    rechunk=False,
+                )
+            except Exception as e:
+                # the IPC file was pruned or is unreadable, treat it as a miss
+                print("failed to read cached frame " + value.name + ": " + str(e))
+                return None
+        return value
+
+    def _write_arrow(self, key, value):
+        """
+        :brief: write value to the Arrow IPC file of key
+        :return: True if it was written, False if value has to be pickled
+        """
+        if any(dtype == pl.Object for dtype in value.schema.values()):
+            # Arrow can't hold object columns
+            return False
+        fd, tmp = tempfile.mkstemp(
+            suffix=self._fs_transaction_suffix, dir=self._arrow_dir
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                # uncompressed, so reads can map the buffers directly
+                value.write_ipc(f, compression="uncompressed")
+            # readers that mapped the previous file keep its data
+            os.replace(tmp, self._get_arrow_path(key))
+            return True
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except BaseException as e:
+            # polars raises a PanicException, which is not an Exception, for
+            # columns it can't write
+            print("failed to write frame as Arrow IPC, pickling it: " + str(e))
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+
+    def set(self, key, value, timeout=None, mgmt_element=False):
+        if not isinstance(value, pl.DataFrame):
+            return FileSystemCache.set(
+                self, key, value, timeout=timeout, mgmt_element=mgmt_element
+            )
+        arrow_path = self._get_arrow_path(key)
+        # drop the IPC file of a previous value first, so it is never read
+        # under the new cache file
+        try:
+            os.remove(arrow_path)
+        except OSError:
+            pass
+        # the cache file is written before the IPC file, as the base set prunes
+        # first and pruning removes IPC files that have no cache file
+        entry = ArrowCacheEntry(os.path.basename(arrow_path))
+        if not FileSystemCache.set(
+            self, key, entry, timeout=timeout, mgmt_element=mgmt_element
+        ):
+            return False
+        if self._write_arrow(key, value):
+            return True
+        try:
+            pickle.dumps(value)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except BaseException as e:
+            # polars 0.19 panics pickling object columns too, so don't cache it
+            print("failed to pickle frame, not caching it: " + str(e))
+            self.delete(key, mgmt_element=mgmt_element)
+            return False
+        return FileSystemCache.set(
+            self, key, value, timeout=timeout, mgmt_element=mgmt_element
+        )
+
+    def delete(self, key, mgmt_element=False):
+        try:
+            os.remove(self._get_arrow_path(key))
+        except OSError:
+            pass
+        return FileSystemCache.delete(self, key, mgmt_element=mgmt_element)
+
+    def _prune(self):
+        pruning = self._over_threshold()
+        FileSystemCache._prune(self)
+        if pruning:
+            self._remove_orphans()
+
+    def _remove_orphans(self):
+        """
+        :brief: remove Arrow IPC files whose cache file was pruned
+        """
+        for name in os.listdir(self._arrow_dir):
+            if name.endswith(self._fs_transaction_suffix):
+                continue
+            if not os.path.exists(os.path.join(self._path, name[: -len(".arrow")])):
+                try:
+                    os.remove(os.path.join(self._arrow_dir, name))
+                except OSError:
+                    pass
+
+    def clear(self):
+        cleared = FileSystemCache.clear(self)
+        for name in os.listdir(self._arrow_dir):
+            try:
+                os.remove(os.path.join(self._arrow_dir, name))
+            except OSError:
+                pass
+        return cleared
@@ -0,0 +1,207 @@
+"""
+On-disk cache of GCS objects, keyed by bucket/object path.
+
+Every read revalidates the cached copy with a metadata-only request comparing the
+object's current GCS generation to the cached one, so a repeat read of an unchanged
+object costs one small metadata call instead of a full download. The cache is
+bounded by a byte budget, and evicts least recently used objects when it is full.
+
+Cached copies are handed out as file objects opened while the cache's lock is held,
+so an eviction by another thread can remove the file but not the data a reader has
+already opened.
+"""
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import tempfile
+from threading import Lock
+import time
+
+
+class BlobCache:
+    def __init__(self, cache_dir, max_bytes=2 * 1024**3, revalidate_interval=0.0):
+        """
+        :param cache_dir: directory to store cached objects and the cache index in
+        :param max_bytes: total size of cached objects to keep before evicting
+        :param revalidate_interval: seconds after a successful revalidation during
+            which the cached copy is used without checking the generation again.
+            0 checks on every read
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.revalidate_interval = revalidate_interval
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.mutex = Lock()
+        # gcs path -> [Lock, number of threads using or waiting for it]
+        self._path_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.bytes_downloaded = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # gcs path -> {"file", "generation", "size", "last_used", "validated_at"}
+        self._index = {}
+        try:
+            with open(self.index_path, "r") as f:
+                self._index = json.load(f)
+        except:
+            pass
+        # drop index entries whose file has gone missing
+        self._index = {
+            path: entry
+            for path, entry in self._index.items()
+            if os.path.exists(os.path.join(cache_dir, entry["file"]))
+        }
+
+    @contextmanager
+    def _path_lock(self, path):
+        """
+        :brief: hold the lock of one GCS path, so only one thread downloads it.
+            The lock is dropped once no thread uses it
+        """
+        with self.mutex:
+            path_lock = self._path_locks.get(path)
+            if path_lock is None:
+                path_lock = self._path_locks[path] = [Lock(), 0]
+            path_lock[1] += 1
+        try:
+            with path_lock[0]:
+                yield
+        finally:
+            with self.mutex:
+                path_lock[1] -= 1
+                if path_lock[1] == 0:
+                    del self._path_locks[path]
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _evict(self, keep=None):
+        """
+        :brief: remove least recently used objects until under the byte budget,
+            never removing keep. Must be called with self.mutex held
+        """
+        total = sum(entry["size"] for entry in self._index.values())
+        for path in sorted(self._index, key=lambda p: self._index[p]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            entry = self._index.pop(path)
+            total -= entry["size"]
+            self.evictions += 1
+            try:
+                os.remove(os.path.join(self.cache_dir, entry["file"]))
+            except OSError:
+                pass
+
+    def _current_generation(self, gcs, path):
+        # make sure the metadata comes from GCS rather than gcsfs' listing cache
+        if hasattr(gcs, "invalidate_cache"):
+            gcs.invalidate_cache(path)
+        info = gcs.info(path)
+        self.revalidations += 1
+        return str(info.get("generation", info.get("etag", info.get("md5Hash"))))
+
+    def open(self, gcs, path, mode="rb"):
+        """
+        :brief: open a local copy holding the current contents of the GCS
+            object at path, downloading it only if it is not cached or has
+            changed. The file is opened before the cache's lock is released, so
+            it stays readable even if it is evicted while in use
+        :param gcs: GCS file system object
+        :param path: object path including bucket name, i.e. "bucket/path/to/object"
+        :return: file object of the local copy. Raises the file system's error
+            (e.g. FileNotFoundError) if the object does not exist
+        """
+        with self._path_lock(path):
+            now = time.time()
+            with self.mutex:
+                entry = self._index.get(path)
+            if (
+                entry is not None
+                and self.revalidate_interval > 0
+                and now - entry["validated_at"] < self.revalidate_interval
+            ):
+                generation = entry["generation"]
+            else:
+                generation = self._current_generation(gcs, path)
+
+            with self.mutex:
+                entry = self._index.get(path)
+                if entry is not None and entry["generation"] == generation:
+                    self.hits += 1
+                    entry["last_used"] = now
+                    entry["validated_at"] = now
+                    return open(os.path.join(self.cache_dir, entry["file"]), mode)
+                self.misses += 1
+
+            filename = hashlib.sha1(path.encode()).hexdigest()
+            local_path = os.path.join(self.cache_dir, filename)
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.cache_dir)
+            try:
+                with gcs.open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                    while True:
+                        block = src.read(8 * 1024 * 1024)
+                        if not block:
+                            break
+                        dst.write(block)
+            except:
+                os.remove(tmp_path)
+                raise
+            size = os.path.getsize(tmp_path)
+
+            with self.mutex:
+                self.bytes_downloaded += size
+                if size > self.max_bytes:
+                    # too large to keep, so hand out the download uncached
+                    f = open(tmp_path, mode)
+                    os.remove(tmp_path)
+                    return f
+                os.replace(tmp_path, local_path)
+                self._index[path] = {
+                    "file": filename,
+                    "generation": generation,
+                    "size": size,
+                    "last_used": now,
+                    "validated_at": now,
+                }
+                self._evict(keep=path)
+                self._save_index()
+                return open(local_path, mode)
+
+    def invalidate(self, path=None):
+        """
+        :brief: forget the cached copy of path, or of every object if path is None
+        """
+        with self.mutex:
+            paths = list(self._index.keys()) if path is None else [path]
+            for p in paths:
+                entry = self._index.pop(p, None)
+                if entry is not None:
+                    try:
+                        os.remove(os.path.join(self.cache_dir, entry["file"]))
+                    except OSError:
+                        pass
+            self._save_index()
+
+    def stats(self):
+        """
+        :return: dict of hit/miss/revalidation/eviction counters, bytes downloaded,
+            and the number and total size of cached objects
+        """
+        with self.mutex:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+                "bytes_downloaded": self.bytes_downloaded,
+                "cached_objects": len(self._index),
+                "cached_bytes": sum(entry["size"] for entry in self._index.values()),
+            }
@@ -8,15 +8,193 @@ JSON, via config.ini at the root of this repository.
 """
 
 import polars as pl
-from utils.polars_helpers import hist_expr_builder, get_results_from_threshold
+from utils.polars_helpers import (
+    ColumnAccumulator,
+    hist_expr_builder,
+    get_results_from_thresholds_by_slide,
+)
 from PIL import Image
 from io import BytesIO
 import numpy as np
 import base64
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+
+
+# column schema of the per-slide dataframe built by get_initial_slide_df*
+SLIDE_DF_SCHEMA = {
+    "slide_name": pl.Utf8,
+    "fov_count": pl.Int64,
+    "rbcs": pl.Int64,
+    "threshold": pl.Float32,
+    "predicted_positive": pl.Int64,
+    "predicted_negative": pl.Int64,
+    "predicted_unsure": pl.Int64,
+    "pos_annotated": pl.Int64,
+    "neg_annotated": pl.Int64,
+    "unsure_annotated": pl.Int64,
+    "total_annotated_positive_negative": pl.Int64,
+}
+
+# column schema of the per-FOV dataframe built by get_fovs_df, before the
+# timestamp column is parsed into a datetime
+FOV_DF_SCHEMA = {
+    "image_uri": pl.Utf8,
+    "slide_label": pl.Utf8,
+    "id_in_slide": pl.Int64,
+    "timestamp": pl.Utf8,
+}
+
+
+# optional ListingCache consulted by list_blobs_with_prefix, see set_listing_cache
+listing_cache = None
+
+
+# optional BlobCache used for downloading spot csvs, see set_blob_cache
+blob_cache = None
+
+
+# optional DecodedImageCache of FOV images used by get_image, see
+# set_fov_image_cache
+fov_image_cache = None
+
+
+# pool that crop_spots_from_slide fetches and decodes FOVs on, see
+# set_fov_fetch_workers. Its threads are long lived, so each keeps its own
+# storage service between calls
+fov_fetch_workers = 8
+fov_fetch_pool = ThreadPoolExecutor(max_workers=fov_fetch_workers)
+
+# per-thread storage services created by get_thread_storage_service
+_thread_services = threading.local()
+
+
+def set_listing_cache(cache):
+    """
+    :brief: set the ListingCache that list_blobs_with_prefix answers from and
+        stores into, or None to disable listing caching
+    """
+    global listing_cache
+    listing_cache = cache
+
+
+def set_blob_cache(cache):
+    """
+    :brief: set the BlobCache that spot/mapping csv reads go through, or None
+        to always read them directly from GCS
+    """
+    global blob_cache
+    blob_cache = cache
+
+
+def set_fov_image_cache(cache):
+    """
+    :brief: set the DecodedImageCache that get_image answers from, shared by
+        spot cropping and the FOV views, or None to decode FOVs on every read
+    """
+    global fov_image_cache
+    fov_image_cache = cache
+
+
+def set_fov_fetch_workers(max_workers):
+    """
+    :brief: replace the FOV fetch pool with one of max_workers threads
+    """
+    global fov_fetch_workers, fov_fetch_pool
+    old_pool = fov_fetch_pool
+    fov_fetch_workers = max_workers
+    fov_fetch_pool = ThreadPoolExecutor(max_workers=max_workers)
+    old_pool.shutdown(wait=False)
+
+
+def get_thread_storage_service(service_factory):
+    """
+    :brief: get the calling thread's own storage service made by
+        service_factory, creating it on the thread's first call.
+        googleapiclient services share one httplib2 connection and are not
+        thread safe, so every worker thread needs its own
+    :param service_factory: function returning a new storage service, e.g.
+        lambda: build("storage", "v1", credentials=credentials)
+    """
+    services = getattr(_thread_services, "services", None)
+    if services is None:
+        services = _thread_services.services = {}
+    service = services.get(service_factory)
+    if service is None:
+        service = services[service_factory] = service_factory()
+    return service
+
+
+def read_blob_csv(gcs, path):
+    """
+    :brief: read the csv at GCS path (including bucket name) into a dataframe,
+        through the blob cache if one is set
+    """
+    if blob_cache is not None:
+        with blob_cache.open(gcs, path) as f:
+            return pl.read_csv(f)
+    with gcs.open(path, "rb") as f:
+        return pl.read_csv(f)
+
+
+def _list_blobs_with_generations(
+    storage_client, bucket_name, prefix, delimiter=None, cutoff=None, cache=None
+):
+    """
+    :brief: implementation of list_blobs_with_prefix, additionally returning
+        a dict of {blob name: generation} under the "generations" key. Goes
+        through listing_cache when one is set
+    :param cache: ListingCache to use instead of listing_cache
+    """
+    if cache is None:
+        cache = listing_cache
+    if cache is not None:
+        cached = cache.lookup(bucket_name, prefix, delimiter=delimiter)
+        if cached is not None:
+            if cutoff is not None:
+                cached["blobs"] = cached["blobs"][:cutoff]
+                cached["prefixes"] = cached["prefixes"][:cutoff]
+            return cached
+
+    # Note: Client.list_blobs requires at least package version 1.17.0.
+    blobs = storage_client.list_blobs(bucket_name, prefix=prefix, delimiter=delimiter)
+
+    count = 0
+    truncated = False
+    # Note: The call returns a response only when the iterator is consumed.
+    retdict = {"blobs": [], "prefixes": [], "generations": {}}
+    for blob in blobs:
+        if cutoff is not None and count >= cutoff:
+            truncated = True
+            break
+        retdict["blobs"].append(blob.name)
+        retdict["generations"][blob.name] = getattr(blob, "generation", None)
+        count += 1
+
+    count = 0
+    if delimiter:
+        for sub_prefix in blobs.prefixes:
+            if cutoff is not None and count >= cutoff:
+                truncated = True
+                break
+            retdict["prefixes"].append(sub_prefix)
+            count += 1
+
+    # only complete listings can answer later queries
+    if cache is not None and not truncated:
+        cache.store(
+            bucket_name,
+            prefix,
+            retdict["blobs"],
+            [retdict["generations"][name] for name in retdict["blobs"]],
+            delimiter=delimiter,
+            prefixes=retdict["prefixes"],
+        )
+    return retdict
 
 
 def list_blobs_with_prefix(
-    storage_client, bucket_name, prefix, delimiter=None, cutoff=None
+    storage_client, bucket_name, prefix, delimiter=None, cutoff=None, cache=None
 ):
     """Returns a dict with two entries that are both lists, 'blobs' is
     filenames under the given prefix (folder) in the bucket bucket_name,
@@ -45,28 +223,45 @@ def list_blobs_with_prefix(
     that lists the "subfolders" under `a/`:
 
         a/b/
+
+    If a ListingCache has been set with set_listing_cache, the query is
+    answered from any fresh cached listing of the same or a parent prefix,
+    and new complete listings are stored in it. A ListingCache passed as
+    cache is used instead of that one.
     """
-    # Note: Client.list_blobs requires at least package version 1.17.0.
-    blobs = storage_client.list_blobs(bucket_name, prefix=prefix, delimiter=delimiter)
+    retdict = _list_blobs_with_generations(
+        storage_client,
+        bucket_name,
+        prefix,
+        delimiter=delimiter,
+        cutoff=cutoff,
+        cache=cache,
+    )
+    return {"blobs": retdict["blobs"], "prefixes": retdict["prefixes"]}
 
-    count = 0
-    # Note: The call returns a response only when the iterator is consumed.
-    retdict = {"blobs": [], "prefixes": []}
-    for blob in blobs:
-        if cutoff is not None and count >= cutoff:
-            break
-        retdict["blobs"].append(blob.name)
-        count += 1
 
-    count = 0
-    if delimiter:
-        for prefix in blobs.prefixes:
-            if cutoff is not None and count >= cutoff:
-                break
-            retdict["prefixes"].append(prefix)
-            count += 1
+def list_blob_generations(
+    storage_client, bucket_name, prefix, delimiter=None, cache=None
+):
+    """
+    :brief: like list_blobs_with_prefix, but returns a dict of
+        {blob name: GCS object generation} for the blobs under prefix
+    """
+    return _list_blobs_with_generations(
+        storage_client, bucket_name, prefix, delimiter=delimiter, cache=cache
+    )["generations"]
 
-    return retdict
+
+def prefetch_listing(storage_client, bucket_name, prefix=""):
+    """
+    :brief: warm the listing cache with one recursive listing of prefix, so
+        later listings under it (e.g. every slide's spot_detection_result/)
+        are answered without further list calls. Does nothing if no listing
+        cache is set
+    """
+    if listing_cache is None:
+        return
+    _list_blobs_with_generations(storage_client, bucket_name, prefix)
 
 
 def get_histogram_df(file, column_name, ranges):
@@ -99,19 +294,20 @@ def get_top_level_dirs(
         "spot_detection_result/",
         "patient_slides_annotation",
     ],
+    cache=None,
 ):
     """
     :brief: given a storage service and bucket name,
     returns a list of top level directories
     """
     items = list_blobs_with_prefix(
-        client, bucket_name, "", delimiter="/", cutoff=cutoff
+        client, bucket_name, "", delimiter="/", cutoff=cutoff, cache=cache
     )
     dirs = [item for item in items["prefixes"] if item not in excluded_dirnames]
     return dirs
 
 
-def get_fov_image_list(client, bucket_name, slide_name):
+def get_fov_image_list(client, bucket_name, slide_name, cache=None):
     """
     :brief: returns a list of filepaths to the files under
         slide_name/spot_detection_result/. File paths omit bucket name,
@@ -122,42 +318,55 @@ def get_fov_image_list(client, bucket_name, slide_name):
     if not prefix.endswith("/"):
         prefix += "/"
     prefix += "spot_detection_result/"
-    fov_imgs = list_blobs_with_prefix(client, bucket_name, prefix)["blobs"]
+    fov_imgs = list_blobs_with_prefix(client, bucket_name, prefix, cache=cache)["blobs"]
     return fov_imgs
 
 
-def crop_spots_from_slide(storage_service, bucket_name, slide_name, coord_list):
-    """
-    :brief: returns a list of file objects corresponding to spots cropped from
-        various FOVs in the same slide
-    :param coord_list: list of integer 6-tuples in the form (fov_row, fov_col,
-        fov_z, x, y, r) where the relevant fov image is
-        [fov_row]_[fov_col]_[fov_z].jpg and (x,y,r) are integer 3-tuples
-        where x and y are the center coordinate of the spot in pixels in the FOV
-        and r is half the side length of the square in pixels
-    :return: list of file objects corresponding to cropped images of the spots
-    """
-    spot_imgs = []
-    fov_spot_indices = {}
-    fov_spot_coord_lists = {}
-    spot_index = 0
-    for row, col, z, x, y, r in coord_list:  # set up individual lists of spots in
-        # FOVs
-        spot_imgs.append(None)
-        fov_filename = str(row) + "_" + str(col) + "_" + str(z)
-        try:
-            fov_spot_indices[fov_filename].append(spot_index)
-            fov_spot_coord_lists[fov_filename].append((x, y, r))
-        except:  # new FOV encountered
-            fov_spot_indices[fov_filename] = [spot_index]
-            fov_spot_coord_lists[fov_filename] = [(x, y, r)]
-        spot_index += 1
-    for fov in fov_spot_coord_lists.keys():
-        fov_uri = fov + ".jpg"
-        fov_images = crop_spots_from_fov(
-            storage_service, bucket_name, slide_name, fov_uri, fov_spot_coord_lists[fov]
+def crop_spots_from_slide(
+    storage_service, bucket_name, slide_name, coord_list, service_factory=None
+):
+    """
+    :brief: returns a list of arrays corresponding to spots cropped from various
+        FOVs in the same slide
+    :param coord_list: integer array of shape (n, 6), or list of integer
+        6-tuples, in the form (fov_row, fov_col, fov_z, x, y, r) where the
+        relevant fov image is [fov_row]_[fov_col]_[fov_z].jpg and (x,y,r) are
+        integer 3-tuples where x and y are the center coordinate of the spot in
+        pixels in the FOV and r is half the side length of the square in pixels
+    :param service_factory: optional function returning a new storage service.
+        If given, FOVs are fetched and decoded concurrently on fov_fetch_pool,
+        each worker thread using its own service made by service_factory.
+        Otherwise FOVs are fetched one after the other with storage_service
+    :return: list of ndarrays of the cropped spots, see crop_spots_from_array,
+        in the order of coord_list
+    """
+    coords = np.rint(np.asarray(coord_list)).astype(np.int64).reshape(-1, 6)
+    spot_imgs = [None] * len(coords)
+    if len(coords) == 0:
+        return spot_imgs
+    # fov_index[i] is the index in fovs of the FOV spot i is cropped from
+    fovs, fov_index = np.unique(coords[:, :3], axis=0, return_inverse=True)
+    fov_index = fov_index.reshape(-1)
+
+    def crop_fov(i):
+        service = storage_service
+        if service_factory is not None:
+            service = get_thread_storage_service(service_factory)
+        row, col, z = fovs[i]
+        return crop_spots_from_fov(
+            service,
+            bucket_name,
+            slide_name,
+            str(row) + "_" + str(col) + "_" + str(z) + ".jpg",
+            coords[fov_index == i, 3:],
         )
-        for spot_img, global_index in zip(fov_images, fov_spot_indices[fov]):
+
+    if service_factory is not None and len(fovs) > 1:
+        fovs_images = fov_fetch_pool.map(crop_fov, range(len(fovs)))
+    else:
+        fovs_images = map(crop_fov, range(len(fovs)))
+    for i, fov_images in enumerate(fovs_images):
+        for spot_img, global_index in zip(fov_images, np.nonzero(fov_index == i)[0]):
             spot_imgs[global_index] = spot_img
     return spot_imgs
 
@@ -169,30 +378,80 @@ def pil_to_b64(im, enc_format="png", **kwargs):
     return encoded
 
 
+def crop_spots_from_array(image_array, coords):
+    """
+    :brief: crop square spots out of a decoded FOV, with one fancy-indexing
+        step per distinct spot size instead of one crop per spot. Parts of a
+        spot outside the FOV are filled with zeros, as PIL's Image.crop does
+    :param image_array: ndarray of shape (height, width) or
+        (height, width, channels)
+    :param coords: integer array of shape (n, 3) in the form (x,y,r) where x
+        and y are the center coordinates of the spot in pixels and r is half
+        the side length of the square in pixels
+    :return: list of n ndarrays of shape (2r, 2r) or (2r, 2r, channels), in
+        the order of coords
+    """
+    coords = np.rint(np.asarray(coords)).astype(np.int64).reshape(-1, 3)
+    spots = [None] * len(coords)
+    if len(coords) == 0:
+        return spots
+    x, y, r = coords[:, 0], coords[:, 1], np.maximum(coords[:, 2], 0)
+    height, width = image_array.shape[:2]
+    # pad once by however far the furthest spot reaches past an edge
+    pad = int(
+        max(
+            0,
+            (r - x).max(),
+            (r - y).max(),
+            (x + r - width).max(),
+            (y + r - height).max(),
+        )
+    )
+    if pad > 0:
+        pad_width = [(pad, pad), (pad, pad)] + [(0, 0)] * (image_array.ndim - 2)
+        image_array = np.pad(image_array, pad_width)
+    for radius in np.unique(r):
+        group = np.nonzero(r == radius)[0]
+        offsets = np.arange(-radius, radius) + pad
+        rows = y[group, None] + offsets[None, :]
+        cols = x[group, None] + offsets[None, :]
+        # (spots, 2r, 2r[, channels])
+        crops = image_array[rows[:, :, None], cols[:, None, :]]
+        for spot_index, crop in zip(group, crops):
+            spots[spot_index] = crop
+    return spots
+
+
 def crop_spots_from_fov(
     storage_service, bucket_name, slide_name, uri, coord_and_radius_list
 ):
     """
-    :brief: returns a list of file objects corresponding to spots cropped from
-        the FOV at uri
+    :brief: returns a list of arrays corresponding to spots cropped from the
+        FOV at uri
     :param uri: image uri of the FOV, omitting bucket/slide name and
         spot_detection_result directory name
-    :param coord_and_radius_list: list of integer 3-tuples in the form (x,y,r)
-        where x and y are the center coordinates of the spot in pixels in the
-        FOV and r is half side length of the square in pixels
-    :return: list of file objects corresponding to cropped images of the spots
+    :param coord_and_radius_list: integer array of shape (n, 3), or list of
+        integer 3-tuples, in the form (x,y,r) where x and y are the center
+        coordinates of the spot in pixels in the FOV and r is half side length
+        of the square in pixels
+    :return: list of ndarrays of the cropped spots, see crop_spots_from_array
     """
     image = get_image(storage_service, bucket_name, slide_name, uri)
-    spot_images = []
-    for x, y, r in coord_and_radius_list:
-        left = x - r
-        top = y - r
-        right = x + r
-        bottom = y + r
+    return crop_spots_from_array(np.asarray(image), coord_and_radius_list)
+
 
-        spot_image = image.crop((left, top, right, bottom))
-        spot_images.append(spot_image)
-    return spot_images
+def draft_image(image, size):
+    """
+    :brief: for a JPEG that has not been decoded yet, have the decoder scale it
+        down by 1/2, 1/4 or 1/8 in the DCT domain while decoding, to the
+        smallest of those scales still at least size. This skips most of the
+        work of decoding the full frame. Other images are returned as is
+    :param size: (width, height) the image will be resized to afterwards
+    :return: the image, whose size is now between size and twice size
+    """
+    if image.format == "JPEG" and not image.im:
+        image.draft(image.mode, size)
+    return image
 
 
 def get_image(
@@ -203,34 +462,171 @@ def get_image(
     resize_factor=1.0,
 ):
     """
-    :brief: returns a file object corresponding to the image at the given uri
+    :brief: returns a file object corresponding to the image at the given uri.
+        If a DecodedImageCache is set with set_fov_image_cache, the decoded
+        image comes from and is shared through that cache, so the image
+        returned for resize_factor=1.0 must be treated as read-only. Images
+        with resize_factor < 1.0 are decoded at reduced size, see draft_image
     :param uri: uri of the image, omitting bucket name
     """
     prefix = slide_name
     if not prefix.endswith("/"):
         prefix += "/"
     prefix += "spot_detection_result/"
-    image = Image.open(
-        BytesIO(
-            (
-                storage_service.objects()
-                .get_media(bucket=bucket_name, object=(prefix + uri))
-                .execute()
+
+    def download():
+        return Image.open(
+            BytesIO(
+                (
+                    storage_service.objects()
+                    .get_media(bucket=bucket_name, object=(prefix + uri))
+                    .execute()
+                )
             )
         )
-    )
-    image = image.resize(
-        (int(image.size[0] * resize_factor), int(image.size[1] * resize_factor))
-    )
+
+    image = None
+    if fov_image_cache is not None:
+        if resize_factor == 1.0:
+            return fov_image_cache.get((bucket_name, prefix + uri), download)
+        # a full image that is already decoded is cheaper to resize than
+        # downloading again, but reduced reads don't fill the cache
+        image = fov_image_cache.peek((bucket_name, prefix + uri))
+    if image is None:
+        image = download()
+    size = (int(image.size[0] * resize_factor), int(image.size[1] * resize_factor))
+    if resize_factor < 1.0:
+        image = draft_image(image, size)
+    image = image.resize(size)
     # print("Got image at " + str(bucket_name) + "/" + str(slide_name) + "/" + str(uri))
     return image
 
 
-def get_initial_slide_df_with_predictions_only(client, bucket_name, gcs, cutoff=None):
+def get_slide_inventory_row(client, bucket_name, gcs, slide_name, cache=None):
+    """
+    :brief: does the per-slide file i/o needed for the initial slide table,
+        i.e. the FOV listing and the rbc tally lookup
+    :param slide_name: name of slide, not including bucket name
+    :param cache: ListingCache to list FOVs through instead of listing_cache
+    :return: dict with keys "slide_name", "fov_count" and "rbcs"
+    """
+    # list of fovs, mostly for fov count
+    fov_imgs = get_fov_image_list(client, bucket_name, slide_name, cache=cache)
+
+    no_spots = None
+
+    # file paths to segment/rbc tally files
+    total_rbc_count_file_path = (
+        bucket_name.strip("/")
+        + "/"
+        + slide_name.strip("/")
+        + "/total number of RBCs.txt"
+    )
+    segmentation_stat_file_path = (
+        bucket_name.strip("/") + "/" + slide_name.strip("/") + "/segmentation_stat.csv"
+    )
+    try:  # check for rbc count tally file
+        with gcs.open(total_rbc_count_file_path, "r") as f:
+            no_spots = int(f.read().strip())
+    except:  # no rbc count tally file, try tallying segmentation_stat.csv
+        print("no spot tally file found for " + str(slide_name))
+        try:  # check for per-fov segmentation tally file
+            with gcs.open(segmentation_stat_file_path, "rb") as f:
+                seg_stat_df = pl.read_csv(f)
+                no_spots = seg_stat_df.select(pl.sum("count")).item()
+        except:  # otherwise, leave spot count null
+            print("no segmentation_stat file found for " + str(slide_name))
+    return {
+        "slide_name": slide_name.strip("/"),
+        "fov_count": len(fov_imgs),
+        "rbcs": no_spots,
+    }
+
+
+def print_scan_progress(done, total):
+    """
+    :brief: default progress reporter for scan_slide_inventory, prints
+        roughly every 5% of slides scanned
+    """
+    step = max(1, total // 20)
+    if done == total or done % step == 0:
+        print("scanned " + str(done) + "/" + str(total) + " slides")
+
+
+def scan_slide_inventory(
+    client,
+    bucket_name,
+    gcs,
+    slides,
+    max_workers=16,
+    progress_callback=print_scan_progress,
+    cache=None,
+):
+    """
+    :brief: runs get_slide_inventory_row for every slide concurrently, with at most
+        max_workers slides (and so a bounded number of GCS operations) in flight
+        at once
+    :param slides: list of slide names, not including bucket name
+    :param max_workers: maximum number of slides scanned concurrently
+    :param progress_callback: function called as progress_callback(done, total)
+        each time a slide finishes, or None to not report progress
+    :param cache: ListingCache to list FOVs through instead of listing_cache
+    :return: list of dicts in the same order as slides. A slide whose scan
+        raises gets a row with only its name filled in, so one bad slide does
+        not fail the whole scan
+    """
+    rows = [None] * len(slides)
+    if len(slides) == 0:
+        return rows
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                get_slide_inventory_row, client, bucket_name, gcs, sl, cache=cache
+            ): i
+            for i, sl in enumerate(slides)
+        }
+        done = 0
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                rows[i] = future.result()
+            except Exception as e:
+                print("failed to scan slide " + str(slides[i]) + ": " + str(e))
+                rows[i] = {
+                    "slide_name": slides[i].strip("/"),
+                    "fov_count": None,
+                    "rbcs": None,
+                }
+            done += 1
+            if progress_callback is not None:
+                progress_callback(done, len(slides))
+    return rows
+
+
+def _slide_df_from_inventory(inventory_rows):
+    """
+    :brief: builds the initial slide dataframe from scan_slide_inventory rows.
+        Prediction columns are left null, to be filled in by populate_slide_rows
+    """
+    slide_columns = ColumnAccumulator(SLIDE_DF_SCHEMA)
+    for inventory_row in inventory_rows:
+        slide_columns.append(inventory_row)
+    return slide_columns.to_frame()
+
+
+def get_initial_slide_df_with_predictions_only(
+    client, bucket_name, gcs, cutoff=None, max_workers=16, prefetch=False
+):
     """
     :brief: returns a dataframe according to the req1 spec. mostly unpopulated because it
         takes a long time to do all the requisite file i/o
+    :param max_workers: number of slides scanned concurrently
+    :param prefetch: if True and a listing cache is set, list the whole bucket once
+        up front so per-slide FOV listings are answered from the cache
     """
+    if prefetch:
+        prefetch_listing(client, bucket_name)
+
     # get list of slide names
     if cutoff is not None:
         cutoff *= 2
@@ -244,160 +640,32 @@ def get_initial_slide_df_with_predictions_only(client, bucket_name, gcs, cutoff=
         if slidefile.endswith(".npy")
     ]
 
-    slide_df = pl.DataFrame()
-
-    for sl in slides:
-        # list of fovs, mostly for fov count
-        fov_imgs = get_fov_image_list(client, bucket_name, sl)
-
-        # initialize variables
-        no_spots = None
-        threshold = None
-        predicted_positive = None
-        predicted_negative = None
-        predicted_unsure = None
-        pos_annotated = None
-        neg_annotated = None
-        unsure_annotated = None
-        total_annotated_positive_negative = None
-
-        # file paths to segment/rbc tally files
-        total_rbc_count_file_path = (
-            bucket_name.strip("/") + "/" + sl.strip("/") + "/total number of RBCs.txt"
-        )
-        segmentation_stat_file_path = (
-            bucket_name.strip("/") + "/" + sl.strip("/") + "/segmentation_stat.csv"
-        )
-        try:  # check for rbc count tally file
-            with gcs.open(total_rbc_count_file_path, "r") as f:
-                no_spots = int(f.read().strip())
-        except:  # no rbc count tally file, try tallying segmentation_stat.csv
-            print("no spot tally file found for " + str(sl))
-            try:  # check for per-fov segmentation tally file
-                with gcs.open(segmentation_stat_file_path, "rb") as f:
-                    seg_stat_df = pl.read_csv(f)
-                    no_spots = seg_stat_df.select(pl.sum("count")).item()
-            except:  # otherwise, leave spot count null
-                print("no segmentation_stat file found for " + str(sl))
-        no_fovs = len(fov_imgs)
-        slide_row_dict = {}
-
-        # put variables in a dict
-        slide_row_dict["slide_name"] = [sl.strip("/")]
-        slide_row_dict["fov_count"] = [no_fovs]
-        slide_row_dict["rbcs"] = [no_spots]
-        slide_row_dict["threshold"] = [threshold]
-        slide_row_dict["predicted_positive"] = [predicted_positive]
-        slide_row_dict["predicted_negative"] = [predicted_negative]
-        slide_row_dict["predicted_unsure"] = [predicted_unsure]
-        slide_row_dict["pos_annotated"] = [pos_annotated]
-        slide_row_dict["neg_annotated"] = [neg_annotated]
-        slide_row_dict["unsure_annotated"] = [unsure_annotated]
-        slide_row_dict["total_annotated_positive_negative"] = [
-            total_annotated_positive_negative
-        ]
-
-        # turn into a row and cast nullable values to datatypes to ensure compliance
-        slide_row = pl.DataFrame(slide_row_dict)
-        slide_row = slide_row.with_columns(slide_row["rbcs"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(slide_row["threshold"].cast(pl.Float32))
-        slide_row = slide_row.with_columns(
-            slide_row["predicted_positive"].cast(pl.Int64)
-        )
-        slide_row = slide_row.with_columns(
-            slide_row["predicted_negative"].cast(pl.Int64)
-        )
-        slide_row = slide_row.with_columns(slide_row["predicted_unsure"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(slide_row["pos_annotated"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(slide_row["neg_annotated"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(slide_row["unsure_annotated"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(
-            slide_row["total_annotated_positive_negative"].cast(pl.Int64)
-        )
-        slide_df = pl.concat([slide_df, slide_row])
-    return slide_df
+    inventory_rows = scan_slide_inventory(
+        client, bucket_name, gcs, slides, max_workers=max_workers
+    )
+    return _slide_df_from_inventory(inventory_rows)
 
 
-def get_initial_slide_df(client, bucket_name, gcs, cutoff=None):
+def get_initial_slide_df(
+    client, bucket_name, gcs, cutoff=None, max_workers=16, prefetch=False
+):
     """
     :brief: returns a dataframe according to the req1 spec. mostly unpopulated because it
         takes a long time to do all the requisite file i/o
+    :param max_workers: number of slides scanned concurrently
+    :param prefetch: if True and a listing cache is set, list the whole bucket once
+        up front so per-slide FOV listings are answered from the cache
     """
+    if prefetch:
+        prefetch_listing(client, bucket_name)
+
     # get list of slide names
     slides = get_top_level_dirs(client, bucket_name, cutoff=cutoff)
 
-    slide_df = pl.DataFrame()
-
-    for sl in slides:
-        # list of fovs, mostly for fov count
-        fov_imgs = get_fov_image_list(client, bucket_name, sl)
-
-        # initialize variables
-        no_spots = None
-        threshold = None
-        predicted_positive = None
-        predicted_negative = None
-        predicted_unsure = None
-        pos_annotated = None
-        neg_annotated = None
-        unsure_annotated = None
-        total_annotated_positive_negative = None
-
-        # file paths to segment/rbc tally files
-        total_rbc_count_file_path = (
-            bucket_name.strip("/") + "/" + sl.strip("/") + "/total number of RBCs.txt"
-        )
-        segmentation_stat_file_path = (
-            bucket_name.strip("/") + "/" + sl.strip("/") + "/segmentation_stat.csv"
-        )
-        try:  # check for rbc count tally file
-            with gcs.open(total_rbc_count_file_path, "r") as f:
-                no_spots = int(f.read().strip())
-        except:  # no rbc count tally file, try tallying segmentation_stat.csv
-            print("no spot tally file found for " + str(sl))
-            try:  # check for per-fov segmentation tally file
-                with gcs.open(segmentation_stat_file_path, "rb") as f:
-                    seg_stat_df = pl.read_csv(f)
-                    no_spots = seg_stat_df.select(pl.sum("count")).item()
-            except:  # otherwise, leave spot count null
-                print("no segmentation_stat file found for " + str(sl))
-        no_fovs = len(fov_imgs)
-        slide_row_dict = {}
-
-        # put variables in a dict
-        slide_row_dict["slide_name"] = [sl.strip("/")]
-        slide_row_dict["fov_count"] = [no_fovs]
-        slide_row_dict["rbcs"] = [no_spots]
-        slide_row_dict["threshold"] = [threshold]
-        slide_row_dict["predicted_positive"] = [predicted_positive]
-        slide_row_dict["predicted_negative"] = [predicted_negative]
-        slide_row_dict["predicted_unsure"] = [predicted_unsure]
-        slide_row_dict["pos_annotated"] = [pos_annotated]
-        slide_row_dict["neg_annotated"] = [neg_annotated]
-        slide_row_dict["unsure_annotated"] = [unsure_annotated]
-        slide_row_dict["total_annotated_positive_negative"] = [
-            total_annotated_positive_negative
-        ]
-
-        # turn into a row and cast nullable values to datatypes to ensure compliance
-        slide_row = pl.DataFrame(slide_row_dict)
-        slide_row = slide_row.with_columns(slide_row["rbcs"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(slide_row["threshold"].cast(pl.Float32))
-        slide_row = slide_row.with_columns(
-            slide_row["predicted_positive"].cast(pl.Int64)
-        )
-        slide_row = slide_row.with_columns(
-            slide_row["predicted_negative"].cast(pl.Int64)
-        )
-        slide_row = slide_row.with_columns(slide_row["predicted_unsure"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(slide_row["pos_annotated"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(slide_row["neg_annotated"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(slide_row["unsure_annotated"].cast(pl.Int64))
-        slide_row = slide_row.with_columns(
-            slide_row["total_annotated_positive_negative"].cast(pl.Int64)
-        )
-        slide_df = pl.concat([slide_df, slide_row])
-    return slide_df
+    inventory_rows = scan_slide_inventory(
+        client, bucket_name, gcs, slides, max_workers=max_workers
+    )
+    return _slide_df_from_inventory(inventory_rows)
 
 
 #### NOTE: The image URIs given are in the form path/to/image/in/bucket (omitting bucket name)
@@ -408,51 +676,38 @@ def get_fovs_df(client, bucket_name, list_of_slide_names):
     :param list_of_slide_names: Slide names. Should be the names and only the names of
         top-level directories in the bucket
     """
-    fovs = pl.DataFrame()
+    fov_columns = ColumnAccumulator(FOV_DF_SCHEMA)
     for sl in list_of_slide_names:
-        sl_fovs_dict = {}
         # get image uris
         fov_list = get_fov_image_list(client, bucket_name, sl)
 
-        # for i in range(
-        #     len(fov_list)
-        # ):  # stopgap measure using the authenticated url for demo, since these images aren't public
-        #     fov_list[i] = (
-        #         "https://storage.cloud.google.com/"
-        #         + bucket_name.strip("/")
-        #         + "/"
-        #         + fov_list[i]
-        #     )
-
-        sl_fovs_dict["image_uri"] = [
-            bucket_name.strip("/") + "/" + uri for uri in fov_list
-        ]
-        # same slide label for all fovs in a slide
-        sl_fovs_dict["slide_label"] = [sl.strip("/")] * len(fov_list)
-        # no default id in slide, so assign programmatically
-        sl_fovs_dict["id_in_slide"] = list(range(len(fov_list)))
         timestamp = None
         try:  # get timestamp from slide name
             timestamp = "_".join(sl.split(".")[-2].split("_")[-2:])
         except:
             print("Unable to extract timestamp string from slide name: " + sl)
 
-        # same timestamp over entire slide
-        sl_fovs_dict["timestamp"] = [timestamp] * len(fov_list)
-
-        sl_fovs_df = pl.DataFrame(sl_fovs_dict)
+        fov_columns.extend(
+            {
+                "image_uri": [bucket_name.strip("/") + "/" + uri for uri in fov_list],
+                # same slide label for all fovs in a slide
+                "slide_label": [sl.strip("/")] * len(fov_list),
+                # no default id in slide, so assign programmatically
+                "id_in_slide": list(range(len(fov_list))),
+                # same timestamp over entire slide
+                "timestamp": [timestamp] * len(fov_list),
+            }
+        )
+    fovs = fov_columns.to_frame()
 
-        # format timestamp column as datetime
-        try:
-            sl_fovs_df = sl_fovs_df.with_columns(
-                sl_fovs_df["timestamp"].str.to_datetime("%Y-%m-%d_%H-%M-%S")
-            )
-        except:
-            print(
-                "Unable to convert timestamp column to datetime from slide name: " + sl
-            )
-        # add to total fov df
-        fovs = pl.concat([fovs, sl_fovs_df])
+    # format timestamp column as datetime
+    try:
+        fovs = fovs.with_columns(fovs["timestamp"].str.to_datetime("%Y-%m-%d_%H-%M-%S"))
+    except:
+        print(
+            "Unable to convert timestamp column to datetime for slides: "
+            + ", ".join(list_of_slide_names)
+        )
     return fovs
 
 
@@ -476,6 +731,9 @@ def populate_slide_rows(
         set_threshold = [set_threshold] * len(list_of_slide_names)
 
     new_slide_df = slide_df
+    slide_row_dicts = {}
+    spot_dfs = []
+    slide_thresholds = {}
 
     for sl, thresh in zip(list_of_slide_names, set_threshold):
         #### To set a new value in the row, set slide_row_dict[column_name][0]=value
@@ -520,18 +778,45 @@ def populate_slide_rows(
         if thresh is not None:
             spot_df = get_spots_csv(bucket_name, gcs, sl)
             try:
-                results = get_results_from_threshold(spot_df, thresh)
-                for k in results.keys():
-                    slide_row_dict[k] = [results[k]]
+                # only keep the columns needed for thresholding so spot tables
+                # from different slides can be stacked
+                spot_dfs.append(
+                    spot_df.select(
+                        pl.lit(sl.strip("/")).alias("slide_name"),
+                        pl.col("parasite output").cast(pl.Float64),
+                        pl.col("non-parasite output").cast(pl.Float64),
+                        pl.col("unsure output").cast(pl.Float64),
+                        pl.col("annotation").cast(pl.Int64),
+                    )
+                )
+                slide_thresholds[sl.strip("/")] = thresh
             except:
                 print("failed to get prediction results for slide " + str(sl))
 
+        slide_row_dicts[sl.strip("/")] = slide_row_dict
+
+    ### threshold every slide with spot data in one vectorized query
+    if len(spot_dfs) > 0:
+        try:
+            results_df = get_results_from_thresholds_by_slide(
+                pl.concat(spot_dfs), slide_thresholds
+            )
+            for results in results_df.rows(named=True):
+                slide_row_dict = slide_row_dicts[results["slide_name"]]
+                for k in results.keys():
+                    if k in ["slide_name", "threshold"]:
+                        continue
+                    slide_row_dict[k] = [results[k]]
+        except:
+            print("failed to get prediction results for slides")
+
+    for sl, slide_row_dict in slide_row_dicts.items():
         ### update row in dataframe to be returned
         for k in slide_row_dict.keys():
             if k == "slide_name":
                 continue
             new_slide_df = new_slide_df.with_columns(
-                pl.when(pl.col("slide_name") == sl.strip("/"))
+                pl.when(pl.col("slide_name") == sl)
                 .then(slide_row_dict[k][0])
                 .otherwise(pl.col(k))
                 .alias(k)
@@ -550,9 +835,8 @@ def get_mapping_csv(bucket_name, gcs, slide_name):
     """
     spot_data_raw_file_path = bucket_name.strip("/") + "/" + slide_name + "/mapping.csv"
     try:
-        with gcs.open(spot_data_raw_file_path, "rb") as f:
-            spots_csv = pl.read_csv(f)
-            return spots_csv
+        spots_csv = read_blob_csv(gcs, spot_data_raw_file_path)
+        return spots_csv
     except:
         print("No mapping.csv found for " + str(slide_name))
         return None
@@ -576,9 +860,8 @@ def get_spots_csv(bucket_name, gcs, slide_name):
         + "_ann_w_pred.csv"
     )
     try:
-        with gcs.open(spot_data_raw_file_path, "rb") as f:
-            spots_csv = pl.read_csv(f)
-            return spots_csv
+        spots_csv = read_blob_csv(gcs, spot_data_raw_file_path)
+        return spots_csv
     except:
         print("No annotation/prediction csv found for " + str(slide_name))
         return None
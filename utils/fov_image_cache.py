@@ -0,0 +1,136 @@
+"""
+In-process LRU cache of decoded FOV images, bounded by their total decoded size.
+
+Concurrent requests for an image that is not cached yet are coalesced: the first
+request downloads and decodes it, and the others wait for that result instead of
+fetching the same FOV again. Cached images are shared between callers, so they
+must be treated as read-only (crop, resize, copy, but never draw into them).
+"""
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Lock
+
+
+def get_decoded_size(image):
+    """
+    :return: size in bytes of a decoded PIL image
+    """
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+class DecodedImageCache:
+    def __init__(self, max_bytes=1024**3):
+        """
+        :param max_bytes: total decoded size of images to keep before evicting
+            the least recently used ones
+        """
+        self.max_bytes = max_bytes
+        self.mutex = Lock()
+        # key -> (image, decoded size), least recently used first
+        self._images = OrderedDict()
+        # key -> Future of a load in progress
+        self._loading = {}
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get(self, key, load):
+        """
+        :brief: get the decoded image for key, calling load() to download and
+            decode it if it is not cached and not already being loaded
+        :param load: function returning the decoded PIL image
+        :return: PIL image, to be treated as read-only
+        """
+        with self.mutex:
+            entry = self._images.get(key)
+            if entry is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            future = self._loading.get(key)
+            leader = future is None
+            if leader:
+                future = self._loading[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+
+        try:
+            image = load()
+            image.load()  # decode now, not lazily in some later caller
+        except BaseException as e:
+            with self.mutex:
+                del self._loading[key]
+            future.set_exception(e)
+            raise
+        size = get_decoded_size(image)
+        with self.mutex:
+            del self._loading[key]
+            if size <= self.max_bytes:
+                self._images[key] = (image, size)
+                self._total_bytes += size
+                self._evict()
+        future.set_result(image)
+        return image
+
+    def peek(self, key):
+        """
+        :brief: get the decoded image for key only if it is already cached,
+            without loading it
+        :return: PIL image to be treated as read-only, or None
+        """
+        with self.mutex:
+            entry = self._images.get(key)
+            if entry is None:
+                return None
+            self._images.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _evict(self):
+        """
+        :brief: drop least recently used images until under the byte budget.
+            Must be called with self.mutex held
+        """
+        while self._total_bytes > self.max_bytes and len(self._images) > 0:
+            key, (image, size) = self._images.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def invalidate(self, key=None):
+        """
+        :brief: forget the cached image for key, or every image if key is None
+        """
+        with self.mutex:
+            if key is None:
+                self._images.clear()
+                self._total_bytes = 0
+                return
+            entry = self._images.pop(key, None)
+            if entry is not None:
+                self._total_bytes -= entry[1]
+
+    def stats(self):
+        """
+        :return: dict of hit/miss/coalesced/eviction counters, the hit rate
+            (counting coalesced requests as hits, since they did no I/O), and
+            the number and total decoded size of cached images
+        """
+        with self.mutex:
+            requests = self.hits + self.misses + self.coalesced
+            hit_rate = 0.0
+            if requests > 0:
+                hit_rate = (self.hits + self.coalesced) / requests
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "hit_rate": hit_rate,
+                "cached_images": len(self._images),
+                "cached_bytes": self._total_bytes,
+            }
@@ -0,0 +1,254 @@
+"""
+Slide-wide mosaics of FOV images, stored as Deep Zoom pyramids in a TileStore so
+they can be shown in the same pan/zoom viewer as single FOVs.
+
+FOV images are named [row]_[col]_[z].[format] in spot_detection_result/, which gives
+their position on the slide. Each FOV is downsampled (and letterboxed) to one
+cell_size x cell_size tile of the pyramid's full resolution level, placed at its
+(col, row) grid position. Every lower level is then built by merging 2x2 tiles of
+the level above it, so no level is ever held in memory whole: generation only
+needs memory for one FOV or four tiles per worker, however many FOVs the slide has.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import json
+import math
+import os
+
+from PIL import Image
+
+from utils.demo_io import get_fov_image_list
+from utils.tile_pyramid import (
+    get_level_size,
+    get_max_level,
+    pyramid_name,
+    save_tile,
+    write_dzi,
+)
+
+# name of the file describing the FOV grid, stored in the pyramid directory
+mosaic_info_name = "mosaic.json"
+
+
+def get_mosaic_key(tile_store, bucket_name, slide_name):
+    """
+    :brief: tile store key of a slide's mosaic
+    """
+    return tile_store.get_key(bucket_name + "/" + slide_name.strip("/"), "mosaic")
+
+
+def parse_fov_grid(fov_paths, z=None):
+    """
+    :brief: map FOV images to their grid positions
+    :param fov_paths: paths ending in [row]_[col]_[z].[format]
+    :param z: focal plane to use, or None to use the lowest z of every FOV
+    :return: dict of {(row, col): path}
+    """
+    grid = {}
+    grid_z = {}
+    for path in fov_paths:
+        try:
+            row, col, fov_z = os.path.splitext(path.split("/")[-1])[0].split("_")
+            row, col, fov_z = int(row), int(col), int(fov_z)
+        except ValueError:
+            continue
+        if z is not None and fov_z != z:
+            continue
+        if (row, col) not in grid or fov_z < grid_z[(row, col)]:
+            grid[(row, col)] = path
+            grid_z[(row, col)] = fov_z
+    return grid
+
+
+def load_fov_cell(gcs, fov_path, cell_size):
+    """
+    :brief: download a FOV and fit it into a cell_size x cell_size tile,
+        preserving its aspect ratio and centering it on black
+    """
+    image = Image.open(BytesIO(gcs.cat(fov_path)))
+    # let the JPEG decoder downscale by up to 8x while decoding
+    image.draft("RGB", (cell_size, cell_size))
+    image = image.convert("RGB")
+    image.thumbnail((cell_size, cell_size), Image.BOX)
+    cell = Image.new("RGB", (cell_size, cell_size))
+    cell.paste(
+        image, ((cell_size - image.size[0]) // 2, (cell_size - image.size[1]) // 2)
+    )
+    return cell
+
+
+def _tile_path(pyramid_dir, level, column, row, format):
+    return os.path.join(
+        pyramid_dir,
+        pyramid_name + "_files",
+        str(level),
+        str(column) + "_" + str(row) + "." + format,
+    )
+
+
+def _merge_tile(pyramid_dir, level, column, row, size, cell_size, format, quality):
+    """
+    :brief: build tile (column, row) of a level from the up to 4 tiles below it
+        in level + 1. Tiles missing from level + 1 (grid positions without a
+        FOV) are left black, and if all 4 are missing no tile is written
+    :param size: (width, height) of level + 1
+    """
+    children = []
+    for dx in range(2):
+        for dy in range(2):
+            child_path = _tile_path(
+                pyramid_dir, level + 1, 2 * column + dx, 2 * row + dy, format
+            )
+            if os.path.exists(child_path):
+                children.append((dx, dy, child_path))
+    if len(children) == 0:
+        return
+    left = 2 * column * cell_size
+    top = 2 * row * cell_size
+    canvas = Image.new(
+        "RGB",
+        (
+            min(size[0], left + 2 * cell_size) - left,
+            min(size[1], top + 2 * cell_size) - top,
+        ),
+    )
+    for dx, dy, child_path in children:
+        with Image.open(child_path) as child:
+            canvas.paste(child, (dx * cell_size, dy * cell_size))
+    tile = canvas.resize(
+        (int(math.ceil(canvas.size[0] / 2)), int(math.ceil(canvas.size[1] / 2))),
+        Image.BOX,
+    )
+    save_tile(
+        tile,
+        _tile_path(pyramid_dir, level, column, row, format),
+        format,
+        quality=quality,
+    )
+
+
+def build_fov_mosaic(
+    gcs,
+    bucket_name,
+    fov_paths,
+    pyramid_dir,
+    cell_size=256,
+    z=None,
+    max_workers=16,
+    format="jpg",
+    quality=90,
+):
+    """
+    :brief: build the Deep Zoom pyramid of a slide's FOV mosaic in pyramid_dir
+    :param fov_paths: FOV image paths omitting bucket name, as returned by
+        get_fov_image_list
+    :param cell_size: side length in pixels of each FOV in the full resolution
+        level, which is also the tile size
+    :param z: focal plane to use, or None to use the lowest z of every FOV
+    :param max_workers: number of FOVs downloaded and downsampled, or tiles
+        merged, at once. Bounds memory use
+    :return: dict describing the mosaic grid, also written to mosaic.json
+    """
+    grid = parse_fov_grid(fov_paths, z=z)
+    if len(grid) == 0:
+        raise ValueError("no FOV images named [row]_[col]_[z] found")
+    min_row = min(row for row, col in grid.keys())
+    min_col = min(col for row, col in grid.keys())
+    rows = max(row for row, col in grid.keys()) - min_row + 1
+    columns = max(col for row, col in grid.keys()) - min_col + 1
+    width = columns * cell_size
+    height = rows * cell_size
+    max_level = get_max_level(width, height)
+
+    base_dir = os.path.join(pyramid_dir, pyramid_name + "_files", str(max_level))
+    os.makedirs(base_dir, exist_ok=True)
+
+    def place_fov(item):
+        (row, col), fov_path = item
+        try:
+            cell = load_fov_cell(gcs, bucket_name + "/" + fov_path, cell_size)
+        except Exception as e:
+            print("failed to load FOV " + fov_path + ": " + str(e))
+            return
+        save_tile(
+            cell,
+            _tile_path(pyramid_dir, max_level, col - min_col, row - min_row, format),
+            format,
+            quality=quality,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for i, _ in enumerate(executor.map(place_fov, sorted(grid.items()))):
+            if (i + 1) % 100 == 0:
+                print("placed " + str(i + 1) + " of " + str(len(grid)) + " FOVs")
+
+        for level in range(max_level - 1, -1, -1):
+            os.makedirs(
+                os.path.join(pyramid_dir, pyramid_name + "_files", str(level)),
+                exist_ok=True,
+            )
+            size = get_level_size(width, height, level + 1, max_level)
+            level_size = get_level_size(width, height, level, max_level)
+            tiles = [
+                (column, row)
+                for column in range(int(math.ceil(level_size[0] / cell_size)))
+                for row in range(int(math.ceil(level_size[1] / cell_size)))
+            ]
+            list(
+                executor.map(
+                    lambda tile: _merge_tile(
+                        pyramid_dir,
+                        level,
+                        tile[0],
+                        tile[1],
+                        size,
+                        cell_size,
+                        format,
+                        quality,
+                    ),
+                    tiles,
+                )
+            )
+
+    write_dzi(pyramid_dir, width, height, cell_size, 0, format)
+    mosaic_info = {
+        "rows": rows,
+        "columns": columns,
+        "min_row": min_row,
+        "min_col": min_col,
+        "cell_size": cell_size,
+        "fov_count": len(grid),
+        "fovs": {
+            str(row) + "_" + str(col): fov_path.split("/")[-1]
+            for (row, col), fov_path in grid.items()
+        },
+    }
+    with open(os.path.join(pyramid_dir, mosaic_info_name), "w") as f:
+        json.dump(mosaic_info, f)
+    return mosaic_info
+
+
+def build_slide_mosaic(
+    client, gcs, bucket_name, slide_name, tile_store, cell_size=256, **kwargs
+):
+    """
+    :brief: list a slide's FOVs and build or rebuild its mosaic in tile_store.
+        Takes any keyword arguments of build_fov_mosaic
+    :return: tile store key of the mosaic
+    """
+    fov_paths = get_fov_image_list(client, bucket_name, slide_name)
+    key = get_mosaic_key(tile_store, bucket_name, slide_name)
+    tile_store.write_pyramid(
+        key,
+        lambda tmp_dir: build_fov_mosaic(
+            gcs,
+            bucket_name,
+            fov_paths,
+            tmp_dir,
+            cell_size=cell_size,
+            format=tile_store.format,
+            **kwargs
+        ),
+        replace=True,
+    )
+    return key
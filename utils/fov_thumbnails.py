@@ -0,0 +1,120 @@
+"""
+Local store of small FOV thumbnails, used for the hover previews in the FOVs table.
+
+Thumbnails are made with reduced JPEG decoding (see demo_io.draft_image), so the
+full frame is never decoded, and stored as
+[store_dir]/[bucket]/[slide]/[image name].jpg. They can be precomputed for whole
+slides with scripts/precompute_fov_thumbnails.py, and are otherwise made the
+first time they are requested.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import os
+from threading import Lock
+
+from PIL import Image
+
+from utils.demo_io import draft_image, get_fov_image_list
+
+# extensions of the files in spot_detection_result/ that are FOV images
+fov_image_extensions = [".jpg", ".jpeg", ".png", ".bmp"]
+
+
+def make_thumbnail(data, max_size):
+    """
+    :brief: make a thumbnail of encoded image bytes that fits in
+        max_size x max_size, keeping the aspect ratio
+    :return: JPEG bytes
+    """
+    image = draft_image(Image.open(BytesIO(data)), (max_size, max_size))
+    image = image.convert("RGB")
+    image.thumbnail((max_size, max_size), Image.BOX)
+    buffered = BytesIO()
+    image.save(buffered, format="JPEG", quality=85)
+    return buffered.getvalue()
+
+
+class FovThumbnailStore:
+    def __init__(self, store_dir, max_size=256):
+        """
+        :param store_dir: directory to keep thumbnails in
+        :param max_size: longest side of a thumbnail in pixels
+        """
+        self.store_dir = store_dir
+        self.max_size = max_size
+        self.mutex = Lock()
+        self._path_locks = {}
+        os.makedirs(store_dir, exist_ok=True)
+
+    def _path_lock(self, path):
+        with self.mutex:
+            lock = self._path_locks.get(path)
+            if lock is None:
+                lock = self._path_locks[path] = Lock()
+            return lock
+
+    def get_path(self, bucket_name, slide_name, image_name):
+        """
+        :return: path the thumbnail of a FOV is stored at
+        """
+        return os.path.join(
+            self.store_dir,
+            bucket_name.strip("/"),
+            slide_name.strip("/"),
+            os.path.splitext(image_name)[0] + ".jpg",
+        )
+
+    def has_thumbnail(self, bucket_name, slide_name, image_name):
+        return os.path.exists(self.get_path(bucket_name, slide_name, image_name))
+
+    def ensure_thumbnail(self, bucket_name, slide_name, image_name, load_bytes):
+        """
+        :brief: make sure the thumbnail of a FOV exists, making it on first use
+        :param load_bytes: function returning the encoded FOV image, only called
+            if the thumbnail has to be made
+        :return: path of the thumbnail
+        """
+        path = self.get_path(bucket_name, slide_name, image_name)
+        with self._path_lock(path):
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                thumbnail = make_thumbnail(load_bytes(), self.max_size)
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(thumbnail)
+                os.replace(tmp_path, path)
+        return path
+
+
+def precompute_slide_thumbnails(
+    client, gcs, bucket_name, slide_name, thumbnail_store, max_workers=16
+):
+    """
+    :brief: make the thumbnails of every FOV of a slide that does not have one
+        yet, downloading FOVs concurrently
+    :return: number of thumbnails made
+    """
+    fov_paths = [
+        fov_path
+        for fov_path in get_fov_image_list(client, bucket_name, slide_name)
+        if os.path.splitext(fov_path)[1].lower() in fov_image_extensions
+        and not thumbnail_store.has_thumbnail(
+            bucket_name, slide_name, fov_path.split("/")[-1]
+        )
+    ]
+
+    def make_one(fov_path):
+        try:
+            thumbnail_store.ensure_thumbnail(
+                bucket_name,
+                slide_name,
+                fov_path.split("/")[-1],
+                lambda: gcs.cat(bucket_name.strip("/") + "/" + fov_path),
+            )
+            return 1
+        except Exception as e:
+            print("failed to make thumbnail of " + fov_path + ": " + str(e))
+            return 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(make_one, fov_paths))
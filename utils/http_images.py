@@ -0,0 +1,56 @@
+"""
+Helpers for serving images over plain HTTP routes on the dashboard's Flask server,
+rather than inside Dash callback payloads, so browsers and proxies can cache them.
+
+Every response carries a strong ETag derived from the GCS generation of the object
+the image comes from, and a Cache-Control max-age. Requests whose If-None-Match
+matches are answered with 304 Not Modified before any image work is done.
+"""
+import hashlib
+
+from flask import Response, request
+
+
+def make_etag(*parts):
+    """
+    :brief: build an ETag from the parts identifying an image, e.g. the GCS
+        generation of its source object, a spot id and a channel
+    """
+    return hashlib.sha1(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def not_modified(etag, max_age, public=True):
+    """
+    :brief: check the current request's If-None-Match against etag
+    :return: a 304 response to return as is if the client's copy is current,
+        otherwise None
+    """
+    if not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    _set_cache_headers(response, etag, max_age, public)
+    return response
+
+
+def image_response(data, mimetype, etag, max_age, public=True):
+    """
+    :brief: build a cacheable response for encoded image bytes, answering
+        conditional requests
+    :param data: encoded image bytes
+    :param mimetype: e.g. "image/png"
+    :param max_age: seconds browsers and proxies may reuse the response without
+        revalidating
+    :param public: whether shared caches (proxies) may store the response
+    """
+    response = Response(data, mimetype=mimetype)
+    _set_cache_headers(response, etag, max_age, public)
+    return response.make_conditional(request)
+
+
+def _set_cache_headers(response, etag, max_age, public):
+    response.set_etag(etag)
+    response.cache_control.max_age = max_age
+    if public:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
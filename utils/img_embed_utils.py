@@ -1,14 +1,110 @@
 import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import time
+
+
+def generate_signed_url(client, bucket_name, file_path, expiration):
+    """
+    :brief: sign a URL for an object that expires at a given time
+    :param expiration: naive UTC datetime the URL expires at
+    """
+    blob = client.bucket(bucket_name).blob(file_path)
+    return blob.generate_signed_url(expiration=expiration)
 
-def generate_temporary_public_url(client, bucket_name, file_path, timeout_seconds):
-    # Get the bucket and blob
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(file_path)
 
+def generate_temporary_public_url(client, bucket_name, file_path, timeout_seconds):
     # Calculate the expiration time
     expiration_time = datetime.datetime.utcnow() + datetime.timedelta(seconds=timeout_seconds)
 
     # Generate a signed URL that expires after the specified timeout
-    signed_url = blob.generate_signed_url(expiration=expiration_time)
+    return generate_signed_url(client, bucket_name, file_path, expiration_time)
+
+
+class SignedUrlCache:
+    def __init__(self, client, timeout_seconds, max_workers=8, max_entries=100000):
+        """
+        :brief: cache of signed URLs, keyed by object and expiry bucket. Time is
+            cut into buckets of timeout_seconds, and every URL issued during a
+            bucket expires at the end of the following one, so a cached URL
+            always has at least timeout_seconds left and is only signed again
+            once its bucket has passed. URLs issued in the same bucket are also
+            identical across page renders, so browsers can cache the images
+        :param timeout_seconds: minimum lifetime of a returned URL
+        :param max_workers: number of threads URLs are signed on
+        :param max_entries: number of URLs to keep before dropping the least
+            recently used ones
+        """
+        self.client = client
+        self.timeout_seconds = max(1.0, float(timeout_seconds))
+        self.max_entries = max_entries
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.mutex = Lock()
+        # (bucket name, file path) -> (expiry bucket, signed url)
+        self._urls = OrderedDict()
+        self.hits = 0
+        self.signed = 0
+
+    def _expiry_bucket(self, now=None):
+        if now is None:
+            now = time.time()
+        return int(now // self.timeout_seconds)
+
+    def _expiration(self, expiry_bucket):
+        return datetime.datetime.utcfromtimestamp(
+            (expiry_bucket + 2) * self.timeout_seconds
+        )
+
+    def get_urls(self, bucket_name, file_paths):
+        """
+        :brief: signed URLs of objects in a bucket, signing the ones not cached
+            for the current expiry bucket concurrently
+        :return: list of URLs, in the order of file_paths
+        """
+        expiry_bucket = self._expiry_bucket()
+        urls = [None] * len(file_paths)
+        missing = []
+        with self.mutex:
+            for i, file_path in enumerate(file_paths):
+                entry = self._urls.get((bucket_name, file_path))
+                if entry is not None and entry[0] == expiry_bucket:
+                    self._urls.move_to_end((bucket_name, file_path))
+                    urls[i] = entry[1]
+                    self.hits += 1
+                else:
+                    missing.append(i)
+        if len(missing) == 0:
+            return urls
+
+        expiration = self._expiration(expiry_bucket)
+        signed_urls = self.pool.map(
+            lambda i: generate_signed_url(
+                self.client, bucket_name, file_paths[i], expiration
+            ),
+            missing,
+        )
+        for i, url in zip(missing, signed_urls):
+            urls[i] = url
+        with self.mutex:
+            for i in missing:
+                self._urls[(bucket_name, file_paths[i])] = (expiry_bucket, urls[i])
+                self._urls.move_to_end((bucket_name, file_paths[i]))
+            self.signed += len(missing)
+            while len(self._urls) > self.max_entries:
+                self._urls.popitem(last=False)
+        return urls
+
+    def get_url(self, bucket_name, file_path):
+        return self.get_urls(bucket_name, [file_path])[0]
 
-    return signed_url
+    def stats(self):
+        """
+        :return: dict with the number of URLs served from the cache and signed
+        """
+        with self.mutex:
+            return {
+                "hits": self.hits,
+                "signed": self.signed,
+                "cached_urls": len(self._urls),
+            }
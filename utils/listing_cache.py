@@ -0,0 +1,225 @@
+"""
+In-process cache of GCS blob listings, organized as a prefix tree over "/"-separated
+path segments. A recursive (delimiter-less) listing stored at some prefix can answer
+any later query for a longer prefix, with or without a delimiter, so one listing of
+a parent directory can stand in for many listings of its subdirectories.
+
+Entries expire after a TTL, and can be invalidated either per prefix or for a whole
+bucket by bumping the bucket's generation number.
+"""
+from bisect import bisect_left
+from threading import Lock
+import time
+
+
+class _Listing:
+    """
+    :brief: one stored listing. names is sorted, generations[i] is the GCS object
+        generation of names[i] (or None if unknown)
+    """
+
+    __slots__ = ["prefix", "names", "generations", "fetched_at", "generation"]
+
+    def __init__(self, prefix, names, generations, fetched_at, generation):
+        self.prefix = prefix
+        self.names = names
+        self.generations = generations
+        self.fetched_at = fetched_at
+        self.generation = generation
+
+
+class _PrefixNode:
+    __slots__ = ["children", "recursive", "delimited"]
+
+    def __init__(self):
+        # path segment -> _PrefixNode
+        self.children = {}
+        # exact prefix string -> _Listing, for recursive listings whose prefix
+        # falls in this node's directory
+        self.recursive = {}
+        # (exact prefix string, delimiter) -> (_Listing of blobs, list of prefixes)
+        self.delimited = {}
+
+
+def _segments(prefix):
+    """
+    :brief: the complete directory segments of a prefix, e.g. "a/b/c" -> ["a", "b"]
+        and "a/b/" -> ["a", "b"]
+    """
+    return prefix.split("/")[:-1]
+
+
+class ListingCache:
+    def __init__(self, ttl=300.0):
+        """
+        :param ttl: seconds a listing stays valid after it was fetched, or None to
+            only expire listings through invalidate()
+        """
+        self.ttl = ttl
+        self.mutex = Lock()
+        self._roots = {}
+        self._generations = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _is_fresh(self, bucket_name, listing, now):
+        if listing.generation != self._generations.get(bucket_name, 0):
+            return False
+        if self.ttl is not None and now - listing.fetched_at > self.ttl:
+            return False
+        return True
+
+    def _node(self, bucket_name, prefix, create=False):
+        node = self._roots.get(bucket_name)
+        if node is None:
+            if not create:
+                return None
+            node = self._roots[bucket_name] = _PrefixNode()
+        for segment in _segments(prefix):
+            child = node.children.get(segment)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[segment] = _PrefixNode()
+            node = child
+        return node
+
+    def _covering_listing(self, bucket_name, prefix, now):
+        """
+        :brief: find the deepest fresh recursive listing whose prefix is a prefix of
+            the given one, walking down the tree along prefix's directory segments
+        """
+        node = self._roots.get(bucket_name)
+        best = None
+        segments = _segments(prefix)
+        depth = 0
+        while node is not None:
+            for listing_prefix, listing in node.recursive.items():
+                if prefix.startswith(listing_prefix) and self._is_fresh(
+                    bucket_name, listing, now
+                ):
+                    if best is None or len(listing_prefix) > len(best.prefix):
+                        best = listing
+            if depth >= len(segments):
+                break
+            node = node.children.get(segments[depth])
+            depth += 1
+        return best
+
+    def lookup(self, bucket_name, prefix, delimiter=None):
+        """
+        :brief: answer a listing query from the cache if possible
+        :return: dict with entries "blobs" (list of blob names), "prefixes" (list of
+            "subdirectories", only filled when delimiter is given) and
+            "generations" (dict of {blob name: generation}), or None on a miss
+        """
+        now = time.monotonic()
+        with self.mutex:
+            if delimiter:
+                node = self._node(bucket_name, prefix)
+                if node is not None and (prefix, delimiter) in node.delimited:
+                    listing, prefixes = node.delimited[(prefix, delimiter)]
+                    if self._is_fresh(bucket_name, listing, now):
+                        self.hits += 1
+                        return {
+                            "blobs": list(listing.names),
+                            "prefixes": list(prefixes),
+                            "generations": dict(
+                                zip(listing.names, listing.generations)
+                            ),
+                        }
+            listing = self._covering_listing(bucket_name, prefix, now)
+            if listing is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        # slice out the names under prefix, which are contiguous since names is sorted
+        start = bisect_left(listing.names, prefix)
+        retdict = {"blobs": [], "prefixes": [], "generations": {}}
+        seen_prefixes = set()
+        for i in range(start, len(listing.names)):
+            name = listing.names[i]
+            if not name.startswith(prefix):
+                break
+            rest = name[len(prefix) :]
+            if delimiter and delimiter in rest:
+                sub_prefix = prefix + rest[: rest.index(delimiter) + len(delimiter)]
+                if sub_prefix not in seen_prefixes:
+                    seen_prefixes.add(sub_prefix)
+                    retdict["prefixes"].append(sub_prefix)
+                continue
+            retdict["blobs"].append(name)
+            retdict["generations"][name] = listing.generations[i]
+        return retdict
+
+    def store(
+        self, bucket_name, prefix, blobs, generations, delimiter=None, prefixes=None
+    ):
+        """
+        :brief: store a complete (untruncated) listing result
+        :param blobs: list of blob names returned by the listing
+        :param generations: list of GCS object generations, one per blob
+        :param delimiter: delimiter the listing was made with, if any
+        :param prefixes: list of "subdirectories" returned when delimiter is given
+        """
+        order = sorted(range(len(blobs)), key=lambda i: blobs[i])
+        with self.mutex:
+            listing = _Listing(
+                prefix,
+                [blobs[i] for i in order],
+                [generations[i] for i in order],
+                time.monotonic(),
+                self._generations.get(bucket_name, 0),
+            )
+            node = self._node(bucket_name, prefix, create=True)
+            if delimiter:
+                node.delimited[(prefix, delimiter)] = (listing, list(prefixes or []))
+            else:
+                node.recursive[prefix] = listing
+
+    def invalidate(self, bucket_name, prefix=None):
+        """
+        :brief: drop cached listings. With no prefix, every listing of the bucket
+            is invalidated by bumping its generation. With a prefix, listings that
+            cover it or fall under it are dropped
+        """
+        with self.mutex:
+            if prefix is None:
+                self._generations[bucket_name] = (
+                    self._generations.get(bucket_name, 0) + 1
+                )
+                self._roots.pop(bucket_name, None)
+                return
+            node = self._roots.get(bucket_name)
+            segments = _segments(prefix)
+            depth = 0
+            while node is not None:
+                # listings stored here either cover prefix or fall under it
+                for listing_prefix in list(node.recursive.keys()):
+                    if prefix.startswith(listing_prefix) or listing_prefix.startswith(
+                        prefix
+                    ):
+                        del node.recursive[listing_prefix]
+                for key in list(node.delimited.keys()):
+                    if prefix.startswith(key[0]) or key[0].startswith(prefix):
+                        del node.delimited[key]
+                if depth >= len(segments):
+                    # children whose segment starts with the trailing partial
+                    # segment of prefix fall under it
+                    trailing = prefix.split("/")[-1]
+                    node.children = {
+                        segment: child
+                        for segment, child in node.children.items()
+                        if not segment.startswith(trailing)
+                    }
+                    break
+                node = node.children.get(segments[depth])
+                depth += 1
+
+    def stats(self):
+        """
+        :return: dict with "hits" and "misses" counts
+        """
+        with self.mutex:
+            return {"hits": self.hits, "misses": self.misses}
@@ -149,6 +149,48 @@ def default_csv_downloader(url, savepath):
     return urllib.request.urlretrieve(url, filename=savepath)[0]
 
 
+class ColumnAccumulator:
+    """
+    :brief: accumulates rows into per-column python lists against a declared
+        schema, so a table can be built up row by row and materialized into
+        a dataframe once at the end instead of concatenating one-row frames
+    """
+
+    def __init__(self, schema):
+        """
+        :param schema: dict of {column_name: polars dtype}, in column order
+        """
+        self.schema = dict(schema)
+        self.columns = {name: [] for name in self.schema}
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), []))
+
+    def append(self, row):
+        """
+        :brief: add a row. Columns missing from row are filled with None
+        :param row: dict of {column_name: value}
+        """
+        for name, values in self.columns.items():
+            values.append(row.get(name))
+
+    def extend(self, columns):
+        """
+        :brief: add several rows at once, given column-wise
+        :param columns: dict of {column_name: list of values}, all lists having
+            the same length. Columns missing from it are filled with None
+        """
+        length = len(next(iter(columns.values()), []))
+        for name, values in self.columns.items():
+            values.extend(columns.get(name, [None] * length))
+
+    def to_frame(self):
+        """
+        :return: pl.DataFrame with the declared schema
+        """
+        return pl.DataFrame(self.columns, schema=self.schema)
+
+
 def hist_expr_builder(column_name: str, ranges: list) -> pl.Expr:
     """
     :brief: Builds a pl.when(...).then(...).when(...).
@@ -187,6 +229,42 @@ def get_histogram_from_file(filepath, column_name, ranges):
     return q
 
 
+def _threshold_result_exprs(
+    threshold_expr,
+    ann_dict={"non-parasite": 0, "parasite": 1, "unsure": 2, "unlabeled": -1},
+):
+    """
+    :brief: build the list of aggregation expressions computing every
+        threshold result count in a single pass over a spot table
+    :param threshold_expr: pl.Expr (column or literal) giving the threshold
+        to compare "parasite output" against
+    :return: list of aliased pl.Expr, one per result key
+    """
+    pred_pos = (pl.col("parasite output") > threshold_expr).sum()
+    pred_neg = (
+        (pl.col("parasite output") < threshold_expr)
+        & (pl.col("non-parasite output") > pl.col("unsure output"))
+    ).sum()
+    ann_pos = (pl.col("annotation") == ann_dict["parasite"]).sum()
+    ann_neg = (pl.col("annotation") == ann_dict["non-parasite"]).sum()
+    ann_unsure = (pl.col("annotation") == ann_dict["unsure"]).sum()
+    return [
+        pred_pos.cast(pl.Int64).alias("predicted_positive"),
+        pred_neg.cast(pl.Int64).alias("predicted_negative"),
+        (
+            pl.count().cast(pl.Int64)
+            - pred_pos.cast(pl.Int64)
+            - pred_neg.cast(pl.Int64)
+        ).alias("predicted_unsure"),
+        ann_pos.cast(pl.Int64).alias("pos_annotated"),
+        ann_neg.cast(pl.Int64).alias("neg_annotated"),
+        ann_unsure.cast(pl.Int64).alias("unsure_annotated"),
+        (ann_pos.cast(pl.Int64) + ann_neg.cast(pl.Int64)).alias(
+            "total_annotated_positive_negative"
+        ),
+    ]
+
+
 def get_results_from_threshold(
     spot_df,
     threshold,
@@ -195,6 +273,7 @@ def get_results_from_threshold(
     """
     :brief: Given a dataframe of spots and a threshold, compute
         the number of positive/negative/unsure spots in a slide
+        in a single aggregation pass
     :param spot_df: dataframe containing spots. Should have
         columns "parasite output", "non-parasite output",
         "unsure output", "annotation"
@@ -203,43 +282,104 @@ def get_results_from_threshold(
     "predicted_negative", "predicted_unsure", "pos_annotated",
     "neg_annotated", "unsure_annotated", "total_annotated_positive_negative"
     """
-    pred_pos = (
-        spot_df.filter(pl.col("parasite output") > threshold).select(pl.count()).item()
+    results = (
+        spot_df.lazy()
+        .select(_threshold_result_exprs(pl.lit(threshold), ann_dict))
+        .collect()
+        .row(0, named=True)
     )
-    pred_neg = (
-        spot_df.filter(
-            (pl.col("parasite output") < threshold)
-            & (pl.col("non-parasite output") > pl.col("unsure output"))
+    return {k: int(v or 0) for k, v in results.items()}
+
+
+def get_results_from_thresholds_by_slide(
+    spot_df,
+    thresholds,
+    slide_column="slide_name",
+    ann_dict={"non-parasite": 0, "parasite": 1, "unsure": 2, "unlabeled": -1},
+):
+    """
+    :brief: Batched version of get_results_from_threshold. Given spots from
+        any number of slides concatenated into one dataframe and a threshold
+        per slide, compute every slide's counts with one join and one group_by
+    :param spot_df: dataframe containing spots from one or more slides. Should
+        have columns slide_column, "parasite output", "non-parasite output",
+        "unsure output", "annotation"
+    :param thresholds: either a dict of {slide: threshold}, or a dataframe with
+        columns slide_column and "threshold"
+    :param slide_column: name of the column identifying the slide of each spot
+    :return: dataframe with columns slide_column, "threshold" and the same
+        count columns as the keys returned by get_results_from_threshold, one row
+        per slide given a threshold, in order of the thresholds given. Slides
+        without spots get counts of 0
+    """
+    if isinstance(thresholds, dict):
+        thresholds = pl.DataFrame(
+            {
+                slide_column: list(thresholds.keys()),
+                "threshold": list(thresholds.values()),
+            },
+            schema={slide_column: pl.Utf8, "threshold": pl.Float64},
         )
-        .select(pl.count())
-        .item()
+    thresholds = thresholds.lazy().select(
+        pl.col(slide_column), pl.col("threshold").cast(pl.Float64)
     )
-    pred_unsure = spot_df.select(pl.count()).item() - pred_pos - pred_neg
-    ann_pos = (
-        spot_df.filter(pl.col("annotation") == ann_dict["parasite"])
-        .select(pl.count())
-        .item()
+
+    result_exprs = _threshold_result_exprs(pl.col("threshold"), ann_dict)
+    results = (
+        spot_df.lazy()
+        .join(thresholds, on=slide_column, how="inner")
+        .group_by(slide_column)
+        .agg(*result_exprs)
     )
-    ann_neg = (
-        spot_df.filter(pl.col("annotation") == ann_dict["non-parasite"])
-        .select(pl.count())
-        .item()
+    # left join from the thresholds, so slides whose spot table has no rows
+    # are kept (with zero counts), in the order the thresholds were given in
+    return (
+        thresholds.join(results, on=slide_column, how="left")
+        .with_columns(
+            [pl.col(expr.meta.output_name()).fill_null(0) for expr in result_exprs]
+        )
+        .collect()
     )
-    ann_unsure = (
-        spot_df.filter(pl.col("annotation") == ann_dict["unsure"])
-        .select(pl.count())
-        .item()
+
+
+def count_scores_vs_thresholds(sorted_scores, thresholds, strictly_greater=True):
+    """
+    :brief: count, for every threshold, how many scores are strictly above
+        (or strictly below) it, using a binary search over pre-sorted scores
+        instead of comparing every score against every threshold
+    :param sorted_scores: 1D numpy array of scores sorted in ascending order,
+        with nulls and NaNs already removed (a NaN would sort to the end and
+        count as larger than every threshold)
+    :param thresholds: 1D numpy array of thresholds, in any order
+    :param strictly_greater: if True, count scores > threshold, otherwise
+        count scores < threshold
+    :return: numpy int64 array of counts, one per threshold
+    """
+    if strictly_greater:
+        return len(sorted_scores) - np.searchsorted(
+            sorted_scores, thresholds, side="right"
+        )
+    return np.searchsorted(sorted_scores, thresholds, side="left")
+
+
+def _sorted_score_column(spot_df, condition=None):
+    """
+    :brief: return the sorted, non-null "parasite output" scores of the
+        spots matching condition as a numpy array. NaN scores are dropped
+        too, as polars compares NaN as neither above nor below a threshold
+    """
+    scores = spot_df.lazy()
+    if condition is not None:
+        scores = scores.filter(condition)
+    scores = (
+        scores.select(pl.col("parasite output").cast(pl.Float64))
+        .drop_nulls()
+        .filter(pl.col("parasite output").is_not_nan())
+        .collect()
+        .to_series()
+        .to_numpy()
     )
-    total_ann_pos_neg = ann_pos + ann_neg
-    return {
-        "predicted_positive": pred_pos,
-        "predicted_negative": pred_neg,
-        "predicted_unsure": pred_unsure,
-        "pos_annotated": ann_pos,
-        "neg_annotated": ann_neg,
-        "unsure_annotated": ann_unsure,
-        "total_annotated_positive_negative": total_ann_pos_neg,
-    }
+    return np.sort(scores)
 
 
 def get_detection_stats_vs_threshold(
@@ -250,43 +390,54 @@ def get_detection_stats_vs_threshold(
     """
     :brief: get a dataframe with thresholds in one column and per-threshold
         annotated/predicted positive/negative/unsure data, along with
-        false positive/false negative counts
+        false positive/false negative counts. Scores are sorted once per
+        condition and counted with a binary search per threshold, so
+        the cost is O((n_spots + n_thresholds) log n_spots) rather than
+        n_spots * n_thresholds
     :param spot_df: dataframe containing spots. should have columns
         "parasite output", "non-parasite output", "unsure output",
         "annotation"
     :param thresholds array: numpy ndarray of thresholds
+    :return: dataframe sorted by threshold with one row per distinct threshold
     """
-    plot_df = pl.DataFrame({"threshold": thresholds_array})
-
-    # create a dictionary of pl.Expr for each condition we want to count
-    expr_dict = {
-        "predicted_positive": pl.col("parasite output") > pl.col("threshold"),
-        "predicted_negative": (pl.col("parasite output") < pl.col("threshold"))
-        & (pl.col("non-parasite output") > pl.col("unsure output")),
-    }
+    thresholds = np.unique(np.asarray(thresholds_array, dtype=np.float64))
 
-    expr_dict["false_positive"] = (expr_dict["predicted_positive"]) & (
-        pl.col("annotation") == pl.lit(ann_dict["non-parasite"])
-    )
-    expr_dict["false_negative"] = (expr_dict["predicted_negative"]) & (
+    negative_condition = pl.col("non-parasite output") > pl.col("unsure output")
+    false_positive_condition = pl.col("annotation") == pl.lit(ann_dict["non-parasite"])
+    false_negative_condition = negative_condition & (
         pl.col("annotation") == pl.lit(ann_dict["parasite"])
     )
 
-    df_list = []
-
-    for column in expr_dict.keys():
-        # counts per threshold of matching instances
-        matching_df = (
-            plot_df.lazy()
-            .join(spot_df.lazy(), how="cross")
-            .filter(expr_dict[column])
-            .group_by("threshold", maintain_order=True)
-            .agg(pl.count().alias(column))
-        )
-        df_list.append(matching_df)
-
-    # collect all queries at once
-    plot_df = pl.concat(df_list, how="align").collect(streaming=True)
+    # sort each relevant subset of scores once
+    all_scores = _sorted_score_column(spot_df)
+    negative_scores = _sorted_score_column(spot_df, negative_condition)
+    false_positive_scores = _sorted_score_column(spot_df, false_positive_condition)
+    false_negative_scores = _sorted_score_column(spot_df, false_negative_condition)
+
+    plot_df = pl.DataFrame(
+        {
+            "threshold": thresholds,
+            "predicted_positive": count_scores_vs_thresholds(
+                all_scores, thresholds, strictly_greater=True
+            ),
+            "predicted_negative": count_scores_vs_thresholds(
+                negative_scores, thresholds, strictly_greater=False
+            ),
+            "false_positive": count_scores_vs_thresholds(
+                false_positive_scores, thresholds, strictly_greater=True
+            ),
+            "false_negative": count_scores_vs_thresholds(
+                false_negative_scores, thresholds, strictly_greater=False
+            ),
+        },
+        schema={
+            "threshold": pl.Float64,
+            "predicted_positive": pl.UInt32,
+            "predicted_negative": pl.UInt32,
+            "false_positive": pl.UInt32,
+            "false_negative": pl.UInt32,
+        },
+    )
 
     spot_count = spot_df.select(pl.count()).item()
 
@@ -298,22 +449,12 @@ def get_detection_stats_vs_threshold(
     )
 
     # get annotation counts for ease of plotting
-
-    ann_pos = (
-        spot_df.filter(pl.col("annotation") == ann_dict["parasite"])
-        .select(pl.count())
-        .item()
-    )
-    ann_neg = (
-        spot_df.filter(pl.col("annotation") == ann_dict["non-parasite"])
-        .select(pl.count())
-        .item()
-    )
-    ann_unsure = (
-        spot_df.filter(pl.col("annotation") == ann_dict["unsure"])
-        .select(pl.count())
-        .item()
-    )
+    ann_counts = spot_df.select(
+        (pl.col("annotation") == ann_dict["parasite"]).sum().alias("pos"),
+        (pl.col("annotation") == ann_dict["non-parasite"]).sum().alias("neg"),
+        (pl.col("annotation") == ann_dict["unsure"]).sum().alias("unsure"),
+    ).row(0)
+    ann_pos, ann_neg, ann_unsure = (int(count or 0) for count in ann_counts)
     total_ann_pos_neg = ann_pos + ann_neg
 
     plot_df = plot_df.with_columns(
@@ -322,6 +463,5 @@ def get_detection_stats_vs_threshold(
         pl.lit(ann_unsure).alias("unsure_annotated"),
         pl.lit(total_ann_pos_neg).alias("total_annotated_positive_negative"),
     )
-    plot_df = plot_df.with_columns(pl.all().fill_null(strategy="zero"))
 
     return plot_df
@@ -0,0 +1,369 @@
+"""
+Incremental builder for the per-slide catalog cached under slide_df_cache/.
+
+Alongside the catalog, a manifest records the GCS generation of every input that
+went into each slide's row: the RBC tally file, segmentation_stat.csv, the
+_ann_w_pred.csv prediction file, and a digest of the spot_detection_result/
+listing. On rerun only slides that are new, or whose inputs changed, are
+recomputed; every other row is carried over from the previous catalog.
+
+Catalogs can be stored as Arrow IPC (.arrow), Parquet (.parquet) or CSV (.csv),
+picked by file extension. Arrow IPC is the default since it can be memory-mapped
+and read with column projection without any parsing; CSV remains available for
+importing and exporting.
+"""
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+
+import utils.demo_io as demo_io
+from utils.demo_io import (
+    SLIDE_DF_SCHEMA,
+    get_top_level_dirs,
+    list_blob_generations,
+    populate_slide_rows,
+    scan_slide_inventory,
+    _slide_df_from_inventory,
+)
+from utils.listing_cache import ListingCache
+
+
+def get_manifest_path(catalog_path):
+    """
+    :brief: path of the manifest stored next to a catalog file
+    """
+    return catalog_path + ".manifest.json"
+
+
+def list_catalog_slides(client, bucket_name, cutoff=None, cache=None):
+    """
+    :brief: list the slides that belong in the catalog, preferring slides with
+        prediction data in patient_slides_analysis/ and falling back to the
+        top level directories of the bucket
+    :param cache: ListingCache to list through instead of demo_io's
+    """
+    if cutoff is not None:
+        cutoff *= 2
+    slide_files_raw = demo_io.list_blobs_with_prefix(
+        client,
+        bucket_name,
+        prefix="patient_slides_analysis",
+        cutoff=cutoff,
+        cache=cache,
+    )["blobs"]
+    slides = [
+        slidefile.split("/")[-1].strip(".npy")
+        for slidefile in slide_files_raw
+        if slidefile.endswith(".npy")
+    ]
+    if len(slides) == 0:
+        slides = [
+            sl.strip("/")
+            for sl in get_top_level_dirs(
+                client,
+                bucket_name,
+                cutoff=None if cutoff is None else cutoff // 2,
+                cache=cache,
+            )
+        ]
+    return slides
+
+
+def get_slide_input_fingerprint(
+    client, bucket_name, slide_name, prediction_generations, cache=None
+):
+    """
+    :brief: get the generations of every input used to compute a slide's row
+    :param prediction_generations: dict of {blob name: generation} for
+        patient_slides_analysis/, listed once for all slides
+    :return: dict of {input name: generation or digest}, with None for missing inputs
+    """
+    slide_prefix = slide_name.strip("/") + "/"
+    top_level = list_blob_generations(
+        client, bucket_name, slide_prefix, delimiter="/", cache=cache
+    )
+    fov_generations = list_blob_generations(
+        client, bucket_name, slide_prefix + "spot_detection_result/", cache=cache
+    )
+    fov_digest = hashlib.sha1()
+    for name in sorted(fov_generations.keys()):
+        fov_digest.update((name + ":" + str(fov_generations[name]) + "\n").encode())
+    return {
+        "rbc_tally": top_level.get(slide_prefix + "total number of RBCs.txt"),
+        "segmentation_stat": top_level.get(slide_prefix + "segmentation_stat.csv"),
+        "ann_w_pred": prediction_generations.get(
+            "patient_slides_analysis/" + slide_name.strip("/") + "_ann_w_pred.csv"
+        ),
+        "spot_detection_result": fov_digest.hexdigest(),
+    }
+
+
+def get_slide_input_fingerprints(
+    client, bucket_name, slides, max_workers=16, cache=None
+):
+    """
+    :brief: get_slide_input_fingerprint for every slide, concurrently
+    :return: dict of {slide name: fingerprint dict}. Slides whose fingerprint could
+        not be computed map to None, so they are always treated as changed
+    """
+    prediction_generations = list_blob_generations(
+        client, bucket_name, "patient_slides_analysis/", cache=cache
+    )
+
+    def fingerprint(sl):
+        try:
+            return get_slide_input_fingerprint(
+                client, bucket_name, sl, prediction_generations, cache=cache
+            )
+        except Exception as e:
+            print("failed to fingerprint slide " + str(sl) + ": " + str(e))
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fingerprints = list(executor.map(fingerprint, slides))
+    return dict(zip(slides, fingerprints))
+
+
+# extensions of the supported catalog formats, in order of preference
+CATALOG_EXTENSIONS = [".arrow", ".parquet", ".csv"]
+
+
+def find_slide_catalog(catalog_dir, bucket_name):
+    """
+    :brief: find an existing catalog for a bucket in catalog_dir, preferring
+        the formats in the order of CATALOG_EXTENSIONS
+    :return: path to the catalog, or None if there is none
+    """
+    for extension in CATALOG_EXTENSIONS:
+        catalog_path = os.path.join(catalog_dir, bucket_name + extension)
+        if os.path.exists(catalog_path):
+            return catalog_path
+    return None
+
+
+def scan_slide_catalog(catalog_path):
+    """
+    :brief: lazily scan a catalog file. Arrow IPC files are memory-mapped, so
+        only the columns and rows a query ends up needing are ever touched
+    :return: pl.LazyFrame over the catalog
+    """
+    if catalog_path.endswith(".arrow"):
+        return pl.scan_ipc(catalog_path, memory_map=True)
+    if catalog_path.endswith(".parquet"):
+        return pl.scan_parquet(catalog_path)
+    return pl.scan_csv(catalog_path, dtypes=SLIDE_DF_SCHEMA)
+
+
+def read_slide_catalog(catalog_path, columns=None):
+    """
+    :brief: read a catalog file written by write_slide_catalog
+    :param columns: optional list of columns to read, None for all
+    :return: pl.DataFrame
+    """
+    slides = scan_slide_catalog(catalog_path)
+    if columns is not None:
+        slides = slides.select(columns)
+    return slides.collect()
+
+
+def _conform_to_schema(slide_df):
+    """
+    :brief: select the slide table columns in order, cast to SLIDE_DF_SCHEMA
+    """
+    return slide_df.select(
+        [pl.col(name).cast(dtype) for name, dtype in SLIDE_DF_SCHEMA.items()]
+    )
+
+
+def write_slide_catalog(slide_df, catalog_path):
+    """
+    :brief: write a catalog in the format given by catalog_path's extension,
+        creating its directory if needed. The file is written next to its
+        destination and moved into place, so readers with the old file
+        memory-mapped are unaffected
+    """
+    catalog_dir = os.path.dirname(catalog_path)
+    if catalog_dir != "":
+        os.makedirs(catalog_dir, exist_ok=True)
+    slide_df = _conform_to_schema(slide_df)
+    tmp_path = catalog_path + ".tmp"
+    if catalog_path.endswith(".arrow"):
+        # uncompressed so the file can be memory-mapped without decoding
+        slide_df.write_ipc(tmp_path, compression="uncompressed")
+    elif catalog_path.endswith(".parquet"):
+        slide_df.write_parquet(tmp_path)
+    else:
+        slide_df.write_csv(tmp_path)
+    os.replace(tmp_path, catalog_path)
+
+
+def convert_slide_catalog(source_path, destination_path):
+    """
+    :brief: convert a catalog between formats, e.g. to import a csv catalog
+        as .arrow or to export an .arrow catalog to csv
+    """
+    write_slide_catalog(read_slide_catalog(source_path), destination_path)
+
+
+def with_derived_columns(slides, bucket_name):
+    """
+    :brief: add the columns computed from the stored catalog: the positive rate
+        per 5M rbcs and the markdown links to the charts/spots/FOVs pages. On a
+        LazyFrame these are only computed for the rows and columns a query uses
+    :param slides: pl.DataFrame or pl.LazyFrame with the slide table's columns
+    """
+    return slides.with_columns(
+        # null for slides without an rbc count, rather than failing the query
+        pl.when(pl.col("rbcs") > 0)
+        .then(pl.col("predicted_positive") * (5e6) / pl.col("rbcs"))
+        .otherwise(None)
+        .cast(pl.Int64, strict=False)
+        .alias("positives/5M rbc"),
+        pl.concat_str(
+            [
+                pl.lit("[View Charts](/"),
+                pl.lit("chartsview_"),
+                pl.lit(bucket_name),
+                pl.lit("/"),
+                pl.col("slide_name"),
+                pl.lit("/)"),
+            ]
+        ).alias("view_charts"),
+        pl.concat_str(
+            [
+                pl.lit("[View Spots](/"),
+                pl.lit("spotsview_"),
+                pl.lit(bucket_name),
+                pl.lit("/"),
+                pl.col("slide_name"),
+                pl.lit("/)"),
+            ]
+        ).alias("view_spots"),
+        pl.concat_str(
+            [
+                pl.lit("[View FOVs](/"),
+                pl.lit("fovsview_"),
+                pl.lit(bucket_name),
+                pl.lit("/"),
+                pl.col("slide_name"),
+                pl.lit("/)"),
+            ]
+        ).alias("view_fovs"),
+    )
+
+
+def build_slide_catalog_incremental(
+    client,
+    bucket_name,
+    gcs,
+    catalog_path,
+    threshold=None,
+    cutoff=None,
+    max_workers=16,
+):
+    """
+    :brief: bring the slide catalog at catalog_path up to date, recomputing only
+        the rows of slides that are new or whose inputs changed since the catalog
+        was last written, then write the catalog and its manifest back
+    :param catalog_path: path of the catalog, e.g. slide_df_cache/[bucket].arrow,
+        in any of the formats in CATALOG_EXTENSIONS
+    :param threshold: prediction threshold to populate rows with, or None to leave
+        prediction columns unpopulated. Changing it recomputes every slide
+    :param cutoff: optional maximum number of slides, for testing
+    :param max_workers: number of slides fingerprinted/scanned concurrently
+    :return: the up to date slide dataframe
+    """
+    manifest_path = get_manifest_path(catalog_path)
+
+    # every listing below is reused at least twice, so they go through a cache
+    # private to this build, leaving the process-wide listing cache alone
+    cache = ListingCache(ttl=None)
+    slides = list_catalog_slides(client, bucket_name, cutoff=cutoff, cache=cache)
+    fingerprints = get_slide_input_fingerprints(
+        client, bucket_name, slides, max_workers=max_workers, cache=cache
+    )
+
+    previous_df = None
+    previous_manifest = {"threshold": None, "slides": {}}
+    try:
+        previous_df = _conform_to_schema(read_slide_catalog(catalog_path))
+        with open(manifest_path, "r") as f:
+            previous_manifest = json.load(f)
+    except:
+        print("no usable catalog/manifest at " + catalog_path + ", rebuilding")
+        previous_df = None
+    if previous_df is None or previous_manifest.get("threshold") != threshold:
+        previous_df = None
+        previous_manifest = {"threshold": threshold, "slides": {}}
+
+    previous_slides = set()
+    if previous_df is not None:
+        previous_slides = set(previous_df["slide_name"].to_list())
+    changed_slides = [
+        sl
+        for sl in slides
+        if fingerprints[sl] is None
+        or sl not in previous_slides
+        or previous_manifest["slides"].get(sl) != fingerprints[sl]
+    ]
+    print(
+        str(len(changed_slides))
+        + " of "
+        + str(len(slides))
+        + " slides are new or changed"
+    )
+
+    changed_df = _slide_df_from_inventory(
+        scan_slide_inventory(
+            client,
+            bucket_name,
+            gcs,
+            changed_slides,
+            max_workers=max_workers,
+            cache=cache,
+        )
+    )
+    if threshold is not None and len(changed_slides) > 0:
+        changed_df = populate_slide_rows(
+            client,
+            bucket_name,
+            gcs,
+            changed_df,
+            changed_slides,
+            set_threshold=threshold,
+        )
+
+    changed_set = set(changed_slides)
+    frames = [_conform_to_schema(changed_df)]
+    if previous_df is not None:
+        frames.append(
+            previous_df.filter(
+                pl.col("slide_name").is_in(
+                    [sl for sl in slides if sl not in changed_set]
+                )
+            )
+        )
+    # keep the catalog in listing order, dropping slides no longer in the bucket
+    slide_df = (
+        pl.DataFrame({"slide_name": slides}, schema={"slide_name": pl.Utf8})
+        .join(pl.concat(frames), on="slide_name", how="inner")
+        .pipe(_conform_to_schema)
+    )
+
+    # the manifest goes in after the catalog: a crash in between leaves the old
+    # manifest, which can only make the next run recompute slides needlessly
+    write_slide_catalog(slide_df, catalog_path)
+    manifest = {
+        "threshold": threshold,
+        "slides": {
+            sl: fingerprints[sl] for sl in slides if fingerprints[sl] is not None
+        },
+    }
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+    return slide_df
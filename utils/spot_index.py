@@ -0,0 +1,169 @@
+"""
+Per-slide index of the combined spot table for paging through spots in some order.
+
+Sorting a slide's spots on every page request costs O(n log n) however shallow the
+page. A SpotIndex instead computes the permutation that sorts the table by a key
+once, the first time that key is asked for, and keeps it with the table. A page is
+then a slice of the permutation and a gather of page-size rows, so a deep page of a
+500k-spot slide costs the same as the first one. For score sorts the sorted scores
+are kept too, so a score range is two binary searches into the permutation.
+"""
+from collections import OrderedDict
+from threading import Lock
+import time
+
+import numpy as np
+import polars as pl
+
+# sort methods offered on the spots page, see SpotIndex.get_permutation
+spot_sort_methods = ["no sort", "ascending", "descending", "annotation", "FOV"]
+
+
+class SpotIndex:
+    def __init__(
+        self,
+        spot_df,
+        score_column="parasite output",
+        annotation_column="annotation",
+        fov_columns=["FOV_row", "FOV_col", "FOV_z"],
+        index_column="index",
+    ):
+        """
+        :param spot_df: combined spot table of a slide, see get_combined_spots_df
+        """
+        self.spot_df = spot_df
+        self.score_column = score_column
+        self.annotation_column = annotation_column
+        self.fov_columns = fov_columns
+        self.index_column = index_column
+        self.mutex = Lock()
+        # sort method -> (permutation, sorted key or None)
+        self._permutations = {}
+        self._scores = spot_df[score_column].cast(pl.Float64).to_numpy()
+
+    def __len__(self):
+        return self.spot_df.height
+
+    def _sort(self, sort_method):
+        """
+        :return: (permutation sorting the table by sort_method, the sorted
+            score key for score sorts or None)
+        """
+        if sort_method == "ascending":
+            permutation = np.argsort(self._scores, kind="stable")
+            return permutation, self._scores[permutation]
+        if sort_method == "descending":
+            # negated so the key is ascending, NaN scores still sort last
+            permutation = np.argsort(-self._scores, kind="stable")
+            return permutation, -self._scores[permutation]
+        columns = self.spot_df.columns
+        if sort_method == "annotation" and self.annotation_column in columns:
+            # by annotation, most confident prediction first within each.
+            # Annotations are ranked first so text columns and nulls sort too,
+            # with unannotated (null) spots last
+            annotation_rank = (
+                self.spot_df[self.annotation_column]
+                .rank("dense")
+                .fill_null(self.spot_df.height + 1)
+                .to_numpy()
+            )
+            keys = [-self._scores, annotation_rank]
+            return np.lexsort(keys), None
+        if sort_method == "FOV" and all(c in columns for c in self.fov_columns):
+            keys = [self.spot_df[self.index_column].to_numpy()] + [
+                self.spot_df[column].to_numpy() for column in self.fov_columns[::-1]
+            ]
+            return np.lexsort(keys), None
+        permutation = np.argsort(
+            self.spot_df[self.index_column].to_numpy(), kind="stable"
+        )
+        return permutation, None
+
+    def get_permutation(self, sort_method):
+        """
+        :brief: rows of the table in sort_method order, computed once per sort
+            method. "ascending" and "descending" sort by score, "annotation" by
+            annotation then descending score, "FOV" by FOV then spot index, and
+            anything else (or a sort whose columns the table lacks) by spot
+            index
+        :return: (permutation, sorted score key or None)
+        """
+        with self.mutex:
+            entry = self._permutations.get(sort_method)
+        if entry is None:
+            entry = self._sort(sort_method)
+            with self.mutex:
+                self._permutations[sort_method] = entry
+        return entry
+
+    def get_positions(self, sort_method, score_range=None):
+        """
+        :brief: rows of the table in sort_method order, keeping only spots
+            with a score in score_range
+        :param score_range: (min score, max score), inclusive, either of which
+            may be None, or None for every spot
+        :return: ndarray of row positions
+        """
+        permutation, sorted_key = self.get_permutation(sort_method)
+        if score_range is None or score_range == (None, None):
+            return permutation
+        score_min, score_max = score_range
+        if score_min is None:
+            score_min = -np.inf
+        if score_max is None:
+            score_max = np.inf
+        if sorted_key is not None:
+            # the range is a contiguous run of the score sort
+            if sort_method == "descending":
+                score_min, score_max = -score_max, -score_min
+            start = np.searchsorted(sorted_key, score_min, side="left")
+            end = np.searchsorted(sorted_key, score_max, side="right")
+            return permutation[start:end]
+        scores = self._scores[permutation]
+        return permutation[(scores >= score_min) & (scores <= score_max)]
+
+    def get_page(self, sort_method, start, end, score_range=None):
+        """
+        :brief: rows start to end (inclusive) of the table in sort_method
+            order, after applying score_range, see get_positions
+        :return: (DataFrame of the page, number of spots in score_range)
+        """
+        positions = self.get_positions(sort_method, score_range=score_range)
+        page_positions = positions[max(0, start) : max(0, end + 1)]
+        return self.spot_df[page_positions], len(positions)
+
+
+class SpotIndexCache:
+    def __init__(self, max_entries=8, ttl=60.0):
+        """
+        :brief: in-process cache of the SpotIndex of the most recently viewed
+            slides, so their permutations are reused across page requests
+        :param max_entries: number of slides to keep
+        :param ttl: seconds an index is reused before the spot table is read
+            again, or None to keep it until it is evicted
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.mutex = Lock()
+        # key -> (SpotIndex, time it was built), least recently used first
+        self._indexes = OrderedDict()
+
+    def get(self, key, load):
+        """
+        :param load: function returning the spot table, only called if there
+            is no fresh index for key
+        :return: SpotIndex
+        """
+        now = time.time()
+        with self.mutex:
+            entry = self._indexes.get(key)
+            if entry is not None and (self.ttl is None or now - entry[1] <= self.ttl):
+                self._indexes.move_to_end(key)
+                return entry[0]
+        spot_index = SpotIndex(load())
+        with self.mutex:
+            self._indexes[key] = (spot_index, now)
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        return spot_index
@@ -0,0 +1,214 @@
+"""
+Server-side paging, sorting and filtering of Dash DataTables backed by polars.
+
+With page_action, sort_action and filter_action set to "custom", a DataTable only
+holds the rows of the page it shows, and sends its page_current, page_size,
+sort_by and filter_query to a callback instead. query_table_page answers that with
+one lazy query, so only the visible page is ever collected and sent to the browser.
+
+filter_query uses the DataTable filtering syntax, e.g.
+    {slide_name} contains "abc" && {fov_count} >= 100
+filter_query_to_expr translates the parts the table's filter row produces (one
+relational or "is blank" expression per column, joined by &&) to polars expressions.
+"""
+import re
+
+import polars as pl
+
+_FILTER_PART = re.compile(
+    r"^\s*\{(?P<column>[^}]+)\}\s*"
+    r"(?P<operator>is blank|is nil|"
+    r"[si]?(?:contains|datestartswith|eq|ne|le|lt|ge|gt|<=|>=|!=|=|<|>))"
+    r"\s*(?P<value>.*?)\s*$"
+)
+
+_OPERATOR_ALIASES = {
+    "eq": "=",
+    "ne": "!=",
+    "lt": "<",
+    "le": "<=",
+    "gt": ">",
+    "ge": ">=",
+}
+
+
+def parse_filter_value(value):
+    """
+    :brief: parse the value of a filter expression: a quoted string (with ", '
+        or `), a number, or else an unquoted string
+    :return: str, int or float
+    """
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'`":
+        return value[1:-1].replace("\\" + value[0], value[0])
+    for parse in [int, float]:
+        try:
+            return parse(value)
+        except ValueError:
+            pass
+    return value
+
+
+def _relational_expr(column, dtype, operator, value, case_insensitive):
+    if dtype in pl.NUMERIC_DTYPES:
+        try:
+            value = float(value)
+        except ValueError:
+            return pl.lit(False)  # text never matches a number
+    else:
+        column = column.cast(pl.Utf8)
+        value = str(value)
+        if case_insensitive:
+            column = column.str.to_lowercase()
+            value = value.lower()
+    if operator == "=":
+        return column == value
+    if operator == "!=":
+        return column != value
+    if operator == "<":
+        return column < value
+    if operator == "<=":
+        return column <= value
+    if operator == ">":
+        return column > value
+    return column >= value
+
+
+def filter_part_to_expr(filter_part, schema):
+    """
+    :brief: translate one expression of a filter query, such as
+        {fov_count} >= 100, to a polars expression
+    :param schema: dict of {column name: polars dtype} of the table
+    :return: polars boolean expression, or None if the expression is not
+        understood or names a column that is not in schema
+    """
+    match = _FILTER_PART.match(filter_part)
+    if match is None or match.group("column") not in schema:
+        return None
+    name = match.group("column")
+    dtype = schema[name]
+    column = pl.col(name)
+    operator = match.group("operator")
+    if operator == "is nil":
+        return column.is_null()
+    if operator == "is blank":
+        if dtype in pl.NUMERIC_DTYPES:
+            return column.is_null()
+        return column.is_null() | (column.cast(pl.Utf8) == "")
+
+    # an s or i prefix makes the comparison case sensitive or insensitive
+    case_insensitive = operator[0] == "i"
+    if operator[0] in "si":
+        operator = operator[1:]
+    operator = _OPERATOR_ALIASES.get(operator, operator)
+    value = parse_filter_value(match.group("value"))
+
+    if operator in ["contains", "datestartswith"]:
+        column = column.cast(pl.Utf8)
+        value = str(value)
+        if case_insensitive:
+            column = column.str.to_lowercase()
+            value = value.lower()
+        if operator == "contains":
+            return column.str.contains(value, literal=True)
+        return column.str.starts_with(value)
+    return _relational_expr(column, dtype, operator, value, case_insensitive)
+
+
+def filter_query_to_expr(filter_query, schema):
+    """
+    :brief: translate a DataTable filter_query to a polars expression. Parts
+        that are not understood are ignored, as the native filter would
+        ignore an invalid expression
+    :param schema: dict of {column name: polars dtype} of the table
+    :return: polars boolean expression, or None if there is nothing to filter
+    """
+    expr = None
+    if not filter_query:
+        return expr
+    for filter_part in filter_query.split(" && "):
+        part_expr = filter_part_to_expr(filter_part, schema)
+        if part_expr is None:
+            print("ignoring filter expression: " + filter_part)
+            continue
+        if expr is None:
+            expr = part_expr
+        else:
+            expr = expr & part_expr
+    return expr
+
+
+def apply_row_edits(table, edits, key):
+    """
+    :brief: overwrite values of a LazyFrame with edits kept outside of it, so
+        they are sorted and filtered on like every other value
+    :param edits: dict of {key value: {column name: new value}}
+    :param key: name of the column identifying rows
+    """
+    schema = table.schema
+    columns = sorted(
+        set(
+            name
+            for row_edits in edits.values()
+            for name in row_edits.keys()
+            if name in schema and name != key
+        )
+    )
+    if len(edits) == 0 or len(columns) == 0:
+        return table
+    edits_df = pl.DataFrame(
+        {
+            key: list(edits.keys()),
+            **{
+                name: [row_edits.get(name) for row_edits in edits.values()]
+                for name in columns
+            },
+        }
+    ).select(
+        pl.col(key).cast(schema[key]),
+        *[pl.col(name).cast(schema[name]) for name in columns],
+    )
+    return (
+        table.join(edits_df.lazy(), on=key, how="left", suffix="_edited")
+        .with_columns(
+            [
+                pl.coalesce([pl.col(name + "_edited"), pl.col(name)]).alias(name)
+                for name in columns
+            ]
+        )
+        .drop([name + "_edited" for name in columns])
+    )
+
+
+def query_table_page(
+    table, page_current, page_size, sort_by=None, filter_query=None, tiebreak=None
+):
+    """
+    :brief: filter, sort and page a LazyFrame the way a DataTable with custom
+        page/sort/filter actions asks for
+    :param sort_by: DataTable sort_by, a list of
+        {"column_id": column name, "direction": "asc" or "desc"}
+    :param filter_query: DataTable filter_query
+    :param tiebreak: column to sort by last, so rows that compare equal keep
+        the same order from page to page
+    :return: (DataFrame of the page, number of rows passing the filter)
+    """
+    schema = table.schema
+    expr = filter_query_to_expr(filter_query, schema)
+    if expr is not None:
+        table = table.filter(expr)
+
+    sort_columns = []
+    descending = []
+    for sort in sort_by or []:
+        if sort["column_id"] in schema and sort["column_id"] not in sort_columns:
+            sort_columns.append(sort["column_id"])
+            descending.append(sort["direction"] == "desc")
+    if len(sort_columns) > 0:
+        if tiebreak is not None and tiebreak not in sort_columns:
+            sort_columns.append(tiebreak)
+            descending.append(False)
+        table = table.sort(sort_columns, descending=descending, nulls_last=True)
+
+    row_count = table.select(pl.count()).collect().item()
+    page = table.slice(page_current * page_size, page_size).collect()
+    return page, row_count
@@ -0,0 +1,315 @@
+"""
+Deep Zoom (DZI) tile pyramids of large images, persisted in a local tile store.
+
+A pyramid is generated the first time an image is viewed and kept on disk, keyed by
+the image's source path and GCS generation, so a changed image gets a new pyramid.
+A pan/zoom viewer such as OpenSeadragon reads the .dzi descriptor and then only
+requests the tiles it shows: a small low resolution level for the first screen, and
+full resolution tiles only where the user zooms in.
+
+Pyramids follow the Deep Zoom layout: level L is the image scaled by
+1 / 2 ** (max_level - L), where max_level = ceil(log2(max(width, height))), cut into
+tile_size tiles stored as [name]_files/[level]/[column]_[row].[format].
+"""
+import hashlib
+import html
+import json
+import math
+import os
+import shutil
+from threading import Lock
+
+from PIL import Image
+
+DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{format}" '
+    'Overlap="{overlap}" TileSize="{tile_size}">'
+    '<Size Width="{width}" Height="{height}"/></Image>\n'
+)
+
+# name of the descriptor and tile directory inside a pyramid directory
+pyramid_name = "image"
+
+
+def get_max_level(width, height):
+    """
+    :brief: highest (full resolution) level of a Deep Zoom pyramid
+    """
+    return int(math.ceil(math.log2(max(width, height, 1))))
+
+
+def get_level_size(width, height, level, max_level):
+    """
+    :return: (width, height) of a pyramid level
+    """
+    scale = 2 ** (max_level - level)
+    return (
+        max(1, int(math.ceil(width / scale))),
+        max(1, int(math.ceil(height / scale))),
+    )
+
+
+def write_dzi(pyramid_dir, width, height, tile_size, overlap, format):
+    """
+    :brief: write the .dzi descriptor of a pyramid
+    """
+    with open(os.path.join(pyramid_dir, pyramid_name + ".dzi"), "w") as f:
+        f.write(
+            DZI_TEMPLATE.format(
+                format=format,
+                overlap=overlap,
+                tile_size=tile_size,
+                width=width,
+                height=height,
+            )
+        )
+
+
+def get_dir_size(path):
+    """
+    :brief: total size in bytes of the files under path
+    """
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            size += os.path.getsize(os.path.join(dirpath, filename))
+    return size
+
+
+def save_tile(tile, path, format, quality=90):
+    """
+    :brief: save one tile image, converting it to a mode the format supports
+    """
+    if format in ["jpg", "jpeg"]:
+        if tile.mode not in ["L", "RGB"]:
+            tile = tile.convert("RGB")
+        tile.save(path, format="JPEG", quality=quality)
+    else:
+        tile.save(path, format=format.upper())
+
+
+def cut_level(image, level_dir, tile_size, overlap, format, quality=90):
+    """
+    :brief: cut one pyramid level into tiles named [column]_[row].[format]
+    """
+    os.makedirs(level_dir, exist_ok=True)
+    level_width, level_height = image.size
+    for column in range(int(math.ceil(level_width / tile_size))):
+        for row in range(int(math.ceil(level_height / tile_size))):
+            left = max(0, column * tile_size - overlap)
+            top = max(0, row * tile_size - overlap)
+            right = min(level_width, (column + 1) * tile_size + overlap)
+            bottom = min(level_height, (row + 1) * tile_size + overlap)
+            save_tile(
+                image.crop((left, top, right, bottom)),
+                os.path.join(level_dir, str(column) + "_" + str(row) + "." + format),
+                format,
+                quality=quality,
+            )
+
+
+def build_pyramid(image, pyramid_dir, tile_size=256, overlap=1, format="jpg"):
+    """
+    :brief: build the complete Deep Zoom pyramid of a PIL image in pyramid_dir,
+        halving the previous level to get each lower one
+    """
+    width, height = image.size
+    max_level = get_max_level(width, height)
+    files_dir = os.path.join(pyramid_dir, pyramid_name + "_files")
+    level_image = image
+    for level in range(max_level, -1, -1):
+        level_size = get_level_size(width, height, level, max_level)
+        if level_image.size != level_size:
+            level_image = level_image.resize(level_size, Image.BOX)
+        cut_level(
+            level_image, os.path.join(files_dir, str(level)), tile_size, overlap, format
+        )
+    write_dzi(pyramid_dir, width, height, tile_size, overlap, format)
+
+
+class TileStore:
+    def __init__(
+        self, store_dir, max_bytes=4 * 1024**3, tile_size=256, overlap=1, format="jpg"
+    ):
+        """
+        :param store_dir: directory pyramids are kept in, one subdirectory each
+        :param max_bytes: total size of pyramids to keep before removing the
+            least recently viewed ones, None to keep every pyramid
+        :param tile_size: tile side length in pixels
+        :param overlap: pixels each tile overlaps its neighbours by
+        :param format: tile image format, "jpg" or "png"
+        """
+        self.store_dir = store_dir
+        self.max_bytes = max_bytes
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.format = format
+        self.mutex = Lock()
+        self._key_locks = {}
+        self.builds = 0
+        self.evictions = 0
+        os.makedirs(store_dir, exist_ok=True)
+
+    def _key_lock(self, key):
+        with self.mutex:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = Lock()
+            return lock
+
+    def get_key(self, source_path, generation):
+        """
+        :brief: pyramid key of a source image version
+        """
+        return hashlib.sha1((source_path + ":" + str(generation)).encode()).hexdigest()
+
+    def get_pyramid_dir(self, key):
+        return os.path.join(self.store_dir, key)
+
+    def get_dzi_path(self, key):
+        return os.path.join(self.get_pyramid_dir(key), pyramid_name + ".dzi")
+
+    def has_pyramid(self, key):
+        return os.path.exists(self.get_dzi_path(key))
+
+    def ensure_pyramid(self, key, load_image):
+        """
+        :brief: make sure the pyramid for key exists, building it on first use
+        :param load_image: function returning the full resolution PIL image,
+            only called if the pyramid has to be built
+        :return: path of the pyramid's .dzi descriptor
+        """
+        dzi_path = self.get_dzi_path(key)
+        with self._key_lock(key):
+            if not os.path.exists(dzi_path):
+                self.write_pyramid(
+                    key,
+                    lambda tmp_dir: build_pyramid(
+                        load_image(),
+                        tmp_dir,
+                        tile_size=self.tile_size,
+                        overlap=self.overlap,
+                        format=self.format,
+                    ),
+                )
+        # the descriptor's mtime records when the pyramid was last viewed
+        try:
+            os.utime(dzi_path)
+        except OSError:
+            pass
+        return dzi_path
+
+    def write_pyramid(self, key, build, replace=False):
+        """
+        :brief: build a pyramid into a temporary directory and move it into
+            place, so readers never see a partial pyramid
+        :param build: function taking the temporary directory to write into
+        :param replace: replace an existing pyramid for key. Otherwise an
+            existing pyramid is kept, as it was built from the same source
+        """
+        pyramid_dir = self.get_pyramid_dir(key)
+        tmp_dir = pyramid_dir + ".tmp" + str(os.getpid())
+        old_dir = pyramid_dir + ".tmp" + str(os.getpid()) + "old"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        try:
+            build(tmp_dir)
+            with open(os.path.join(tmp_dir, "size"), "w") as f:
+                f.write(str(get_dir_size(tmp_dir)))
+            if replace and os.path.exists(pyramid_dir):
+                os.replace(pyramid_dir, old_dir)
+            os.replace(tmp_dir, pyramid_dir)
+        except OSError:
+            # another process finished the same pyramid first
+            if not self.has_pyramid(key):
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        with self.mutex:
+            self.builds += 1
+        self._evict(keep=key)
+
+    def get_tile_path(self, key, level, column, row):
+        """
+        :return: path of one tile, or None if it does not exist
+        """
+        tile_path = os.path.join(
+            self.get_pyramid_dir(key),
+            pyramid_name + "_files",
+            str(int(level)),
+            str(int(column)) + "_" + str(int(row)) + "." + self.format,
+        )
+        if not os.path.exists(tile_path):
+            return None
+        return tile_path
+
+    def _evict(self, keep=None):
+        """
+        :brief: remove least recently viewed pyramids until under the byte budget
+        """
+        if self.max_bytes is None:
+            return
+        pyramids = []
+        total = 0
+        for key in os.listdir(self.store_dir):
+            if ".tmp" in key:  # pyramid still being built
+                continue
+            dzi_path = self.get_dzi_path(key)
+            if not os.path.exists(dzi_path):
+                continue
+            try:
+                with open(os.path.join(self.get_pyramid_dir(key), "size"), "r") as f:
+                    size = int(f.read())
+            except:
+                size = get_dir_size(self.get_pyramid_dir(key))
+            pyramids.append((os.path.getmtime(dzi_path), key, size))
+            total += size
+        for last_viewed, key, size in sorted(pyramids):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.get_pyramid_dir(key), ignore_errors=True)
+            total -= size
+            with self.mutex:
+                self.evictions += 1
+
+    def stats(self):
+        """
+        :return: dict with the number of pyramids built and evicted
+        """
+        with self.mutex:
+            return {"builds": self.builds, "evictions": self.evictions}
+
+
+VIEWER_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<script src="https://cdn.jsdelivr.net/npm/openseadragon@4.1.0/build/openseadragon/openseadragon.min.js"></script>
+<style>html, body, #viewer {{ margin: 0; width: 100%; height: 100%; background: #000; }}</style>
+</head>
+<body>
+<div id="viewer"></div>
+<script>
+OpenSeadragon({{
+    id: "viewer",
+    prefixUrl: "https://cdn.jsdelivr.net/npm/openseadragon@4.1.0/build/openseadragon/images/",
+    tileSources: {dzi_url},
+    showNavigator: true,
+    maxZoomPixelRatio: 4
+}});
+</script>
+</body>
+</html>
+"""
+
+
+def get_viewer_html(dzi_url, title=""):
+    """
+    :brief: standalone OpenSeadragon viewer page for the pyramid at dzi_url
+    """
+    return VIEWER_TEMPLATE.format(title=html.escape(title), dzi_url=json.dumps(dzi_url))
@@ -1,8 +1,13 @@
 # Mostly adapted from octopi-ml repo
 
+from concurrent.futures import ThreadPoolExecutor
+import os
 from threading import Lock, RLock
+import struct
 import zipfile
+import zlib
 import zarr
+from numcodecs import Blosc
 
 import random
 
@@ -11,6 +16,7 @@ from PIL import Image
 from io import BytesIO
 import base64
 import asyncio
+import time
 
 class RemoteZipStore(zarr.ZipStore):
     def __init__(
@@ -20,7 +26,15 @@ class RemoteZipStore(zarr.ZipStore):
         allowZip64=True,
         mode="a",
         dimension_separator=None,
+        max_gap=64 * 1024,
+        max_request_bytes=16 * 1024 * 1024,
     ):
+        """
+        :param path: file-like object (e.g. from gcs.open) of the zip file
+        :param max_gap: members separated by at most this many bytes are fetched
+            in one ranged read by getitems
+        :param max_request_bytes: maximum size of one coalesced ranged read
+        """
         # store properties
         self.path = None  # TODO: This need to be handled properly for os.PathLike or file-like object
         self.compression = compression
@@ -36,6 +50,136 @@ class RemoteZipStore(zarr.ZipStore):
         self.zf = zipfile.ZipFile(
             path, mode=mode, compression=compression, allowZip64=allowZip64
         )
+        self._file = path
+        self.max_gap = max_gap
+        self.max_request_bytes = max_request_bytes
+
+    # local file header: signature, versions/flags/method/time/date, crc,
+    # sizes, then file name length and extra field length
+    _local_header_size = 30
+    # allowance for a local extra field longer than the central directory's one
+    _local_extra_slack = 64
+
+    def _member_range(self, info):
+        """
+        :brief: estimated byte range [start, end) of a member's local header and
+            data, from its central directory entry
+        """
+        start = info.header_offset
+        end = (
+            start
+            + self._local_header_size
+            + len(info.orig_filename.encode("utf-8"))
+            + len(info.extra)
+            + self._local_extra_slack
+            + info.compress_size
+        )
+        return start, end
+
+    def _coalesce(self, ranges):
+        """
+        :brief: merge sorted (start, end, key) ranges that are at most max_gap
+            apart into larger requests of at most max_request_bytes
+        :return: list of [start, end, [(start, end, key), ...]]
+        """
+        merged = []
+        for start, end, key in sorted(ranges):
+            if (
+                len(merged) > 0
+                and start - merged[-1][1] <= self.max_gap
+                and max(end, merged[-1][1]) - merged[-1][0] <= self.max_request_bytes
+            ):
+                merged[-1][1] = max(end, merged[-1][1])
+                merged[-1][2].append((start, end, key))
+            else:
+                merged.append([start, end, [(start, end, key)]])
+        return merged
+
+    def _fetch_ranges(self, starts, ends):
+        """
+        :brief: read several byte ranges of the zip file. fsspec files (e.g. from
+            gcsfs) fetch them concurrently with cat_ranges, other file objects are
+            read serially
+        """
+        fs = getattr(self._file, "fs", None)
+        fs_path = getattr(self._file, "path", None)
+        if fs is not None and fs_path is not None and hasattr(fs, "cat_ranges"):
+            blocks = fs.cat_ranges([fs_path] * len(starts), starts, ends)
+            for block in blocks:
+                if isinstance(block, Exception):
+                    raise block
+            return blocks
+        blocks = []
+        with self.mutex:
+            for start, end in zip(starts, ends):
+                self.zf.fp.seek(start)
+                blocks.append(self.zf.fp.read(end - start))
+        return blocks
+
+    def _extract_member(self, info, block, offset):
+        """
+        :brief: get a member's contents from a fetched block, where offset is the
+            position of its local header in block
+        :return: the member's bytes, or None if the block does not hold all of it
+        """
+        header = block[offset : offset + self._local_header_size]
+        if len(header) < self._local_header_size or header[:4] != b"PK\x03\x04":
+            return None
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        data_start = offset + self._local_header_size + name_length + extra_length
+        data = block[data_start : data_start + info.compress_size]
+        if len(data) < info.compress_size:
+            return None
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            data = zlib.decompressobj(-15).decompress(data)
+        if zlib.crc32(data) != info.CRC:
+            raise zipfile.BadZipFile("Bad CRC-32 for file " + repr(info.filename))
+        return data
+
+    def getitems(self, keys, *, contexts=None):
+        """
+        :brief: retrieve several members at once. Member byte ranges are looked up
+            in the central directory, nearby ranges are merged, and the merged
+            ranges are fetched concurrently, so a page of spots costs a few ranged
+            reads rather than one serialized read per chunk. zarr uses this for
+            every multi-chunk selection
+        :param keys: keys to retrieve, missing keys are left out of the result
+        :param contexts: unused, for compatibility with zarr.storage.BaseStore
+        :return: dict of {key: bytes}
+        """
+        results = {}
+        ranges = []
+        infos = {}
+        with self.mutex:
+            for key in keys:
+                try:
+                    info = self.zf.getinfo(key)
+                except KeyError:
+                    continue
+                if info.flag_bits & 0x1 or info.compress_type not in [
+                    zipfile.ZIP_STORED,
+                    zipfile.ZIP_DEFLATED,
+                ]:
+                    # encrypted or unusual compression, let zipfile handle it
+                    results[key] = self[key]
+                    continue
+                infos[key] = info
+                start, end = self._member_range(info)
+                ranges.append((start, end, key))
+        if len(ranges) == 0:
+            return results
+
+        requests = self._coalesce(ranges)
+        blocks = self._fetch_ranges(
+            [request[0] for request in requests], [request[1] for request in requests]
+        )
+        for request, block in zip(requests, blocks):
+            for start, end, key in request[2]:
+                data = self._extract_member(infos[key], block, start - request[0])
+                if data is None:  # local header larger than estimated
+                    data = self[key]
+                results[key] = data
+        return results
 
 
 def generate_signed_url_v4(
@@ -64,6 +208,90 @@ def parse_slide(gcs, slide_img_url):
     spot_images = source["/spot_images"]
     return spot_images
 
+class ZarrHandlePool:
+    """
+    :brief: process-wide pool of opened spot image zarr arrays, keyed by URL, so the
+        GCS file and the zip central directory of a slide's spot_images.zip are only
+        opened/read once, and later pages of the same slide only pay for chunk reads.
+        Handles unused for idle_timeout seconds are dropped from the pool
+    """
+
+    def __init__(self, idle_timeout=600.0, max_handles=32):
+        """
+        :param idle_timeout: seconds a handle can go unused before it is dropped
+        :param max_handles: maximum number of open handles, least recently used
+            handles are dropped beyond this
+        """
+        self.idle_timeout = idle_timeout
+        self.max_handles = max_handles
+        self.mutex = Lock()
+        # url -> [spot_images array, last used time]
+        self._handles = {}
+        # url -> Lock, so concurrent first requests for a url only open it once
+        self._open_locks = {}
+
+    def _evict(self, now):
+        """
+        :brief: drop idle handles and least recently used handles beyond
+            max_handles. Must be called with self.mutex held. Handles are only
+            dereferenced, not closed, so readers still holding one are unaffected;
+            the file is closed once the last reference goes away
+        """
+        for url in list(self._handles.keys()):
+            if now - self._handles[url][1] > self.idle_timeout:
+                del self._handles[url]
+        if self.max_handles is not None and len(self._handles) > self.max_handles:
+            by_last_used = sorted(self._handles, key=lambda u: self._handles[u][1])
+            for url in by_last_used[: len(self._handles) - self.max_handles]:
+                del self._handles[url]
+
+    def get(self, gcs, slide_img_url):
+        """
+        :brief: get the spot_images zarr array at slide_img_url, opening it with
+            parse_slide only if it is not already in the pool
+        """
+        now = time.monotonic()
+        with self.mutex:
+            self._evict(now)
+            handle = self._handles.get(slide_img_url)
+            if handle is not None:
+                handle[1] = now
+                return handle[0]
+            open_lock = self._open_locks.setdefault(slide_img_url, Lock())
+        with open_lock:
+            with self.mutex:
+                handle = self._handles.get(slide_img_url)
+                if handle is not None:
+                    return handle[0]
+            spot_images = parse_slide(gcs, slide_img_url)
+            with self.mutex:
+                self._handles[slide_img_url] = [spot_images, time.monotonic()]
+                self._open_locks.pop(slide_img_url, None)
+            return spot_images
+
+    def invalidate(self, slide_img_url=None):
+        """
+        :brief: drop the handle for slide_img_url, or every handle if None
+        """
+        with self.mutex:
+            if slide_img_url is None:
+                self._handles = {}
+            else:
+                self._handles.pop(slide_img_url, None)
+
+
+# shared by every caller of parse_slide_pooled
+zarr_handle_pool = ZarrHandlePool()
+
+
+def parse_slide_pooled(gcs, slide_img_url):
+    """
+    :brief: pooled version of parse_slide, reusing the opened zarr array for a url
+        across calls. See ZarrHandlePool
+    """
+    return zarr_handle_pool.get(gcs, slide_img_url)
+
+
 async def _get_image_from_zarr(spot_images, sample_id, img_list, img_index):
     img_list[img_index]= get_image_from_zarr(spot_images,sample_id)
 
@@ -79,49 +307,306 @@ async def get_images_from_zarr_async(spot_images, sample_id_list):
 def get_images_from_zarr_async_wrapper(spot_images,sample_id_list):
     return asyncio.run(get_images_from_zarr_async(spot_images,sample_id_list))
 
-def get_images_from_zarr_built_in(spot_images, sample_id_list):
-    sel_indices = [sample_id_list]
-    for i in range(len(spot_images.shape)-1):
+# dimension names of the spot_images array, as written by xarray
+spot_image_dims = ["t", "c", "z", "y", "x"]
+
+# spots per chunk and compressor of the batched layout written by write_spot_zarr
+default_spots_per_chunk = 64
+default_spot_compressor = Blosc(cname="lz4", clevel=5, shuffle=Blosc.BITSHUFFLE)
+
+
+def write_spot_zarr(
+    store,
+    data,
+    spots_per_chunk=default_spots_per_chunk,
+    compressor=default_spot_compressor,
+    channels_per_chunk=None,
+):
+    """
+    :brief: write spot images to store as the "spot_images" array. The defaults
+        give the batched layout; spots_per_chunk=1, channels_per_chunk=1 and
+        compressor=None give the original one-chunk-per-spot-and-channel layout
+    :param store: zarr store to write to, e.g. zarr.ZipStore(path, mode="w")
+    :param data: uint8 ndarray of shape (spots, channels, z, y, x)
+    :param spots_per_chunk: number of spots, with all of their channels, packed
+        into one chunk
+    :param compressor: numcodecs compressor for the chunks, or None to store
+        them uncompressed
+    :param channels_per_chunk: number of channels per chunk, None for all
+    :return: the written zarr array
+    """
+    if channels_per_chunk is None:
+        channels_per_chunk = data.shape[1]
+    root = zarr.group(store=store, overwrite=True)
+    spot_images = root.create_dataset(
+        "spot_images",
+        shape=data.shape,
+        dtype=data.dtype,
+        chunks=(spots_per_chunk, channels_per_chunk) + tuple(data.shape[2:]),
+        compressor=compressor,
+    )
+    spot_images[...] = data
+    # lets xarray open the array with named dimensions, like the old layout
+    spot_images.attrs["_ARRAY_DIMENSIONS"] = spot_image_dims
+    return spot_images
+
+
+def get_spot_layout(spot_images):
+    """
+    :brief: describe how a spot_images array is laid out
+    :return: dict with "spots_per_chunk", "channels_per_chunk", and "compressor"
+        (codec id or None), and "layout", which is "per_spot_channel" for the
+        original one-chunk-per-spot-and-channel layout and "batched" otherwise
+    """
+    spots_per_chunk = spot_images.chunks[0]
+    channels_per_chunk = spot_images.chunks[1]
+    layout = "batched"
+    if spots_per_chunk == 1 and channels_per_chunk == 1:
+        layout = "per_spot_channel"
+    compressor = None
+    if spot_images.compressor is not None:
+        compressor = spot_images.compressor.codec_id
+    return {
+        "layout": layout,
+        "spots_per_chunk": spots_per_chunk,
+        "channels_per_chunk": channels_per_chunk,
+        "compressor": compressor,
+    }
+
+
+def select_spots(spot_images, sample_id_list):
+    """
+    :brief: read the given spots from a spot_images array in either layout
+    :return: ndarray of shape (len(sample_id_list), channels, z, y, x), in the
+        order of sample_id_list
+    """
+    sample_ids = np.asarray(sample_id_list, dtype=np.int64)
+    if len(sample_ids) == 0:
+        return np.zeros((0,) + tuple(spot_images.shape[1:]), dtype=spot_images.dtype)
+    first = int(sample_ids.min())
+    last = int(sample_ids.max())
+    if spot_images.chunks[0] > 1 and last - first + 1 <= 2 * len(sample_ids):
+        # batched layout: the spots' chunks have to be read whole anyway, so a
+        # plain slice over the covering range is cheaper than an orthogonal
+        # selection
+        return spot_images[first : last + 1][sample_ids - first]
+    sel_indices = [sample_ids]
+    for i in range(len(spot_images.shape) - 1):
         sel_indices.append(slice(None))
-    sel_indices = tuple(sel_indices)
-    spot_samples = spot_images.get_orthogonal_selection(sel_indices)
+    return spot_images.get_orthogonal_selection(tuple(sel_indices))
+
+
+# channels built from the spot_images array by compose_spot_channels
+spot_channel_names = ["bf", "dapi", "compose"]
+
+
+def compose_spot_channels(spot_samples, channels=None):
+    """
+    :brief: build the bf, dapi and compose images of a batch of spots at once.
+        This is highly dependent on our current way of stacking spot image
+        fields: channels 0-2 are the fluorescence channels and channel 3 is
+        brightfield
+    :param spot_samples: uint8 ndarray of shape (N, C, Y, X) or (N, C, 1, Y, X)
+    :param channels: list of the channels to build, None for all of
+        spot_channel_names
+    :return: dict with "bf" of shape (N, Y, X), and "dapi" and "compose" of
+        shape (N, Y, X, 3), all uint8, holding the requested channels
+    """
+    if channels is None:
+        channels = spot_channel_names
+    if spot_samples.ndim == 5:
+        spot_samples = spot_samples[:, :, 0, :, :]
+    bf = spot_samples[:, 3, :, :]
+    dapi = np.moveaxis(spot_samples[:, 2::-1, :, :], 1, 3)
+    ret = {}
+    if "bf" in channels:
+        ret["bf"] = np.ascontiguousarray(bf)
+    if "dapi" in channels:
+        ret["dapi"] = np.ascontiguousarray(dapi)
+    if "compose" in channels:
+        # 0.4 * bf + 0.6 * dapi in integer math, 10 * 255 fits in uint16
+        ret["compose"] = (
+            (
+                4 * bf[:, :, :, np.newaxis].astype(np.uint16)
+                + 6 * dapi.astype(np.uint16)
+            )
+            // 10
+        ).astype(np.uint8)
+    return ret
+
+
+# PNG encoding runs in zlib, which releases the GIL, so a page of spots is
+# encoded across a pool of threads
+image_encode_workers = min(8, os.cpu_count() or 1)
+image_encode_pool = ThreadPoolExecutor(max_workers=image_encode_workers)
+
+
+def set_image_encode_workers(max_workers):
+    """
+    :brief: replace the image encoding pool with one of max_workers threads
+    """
+    global image_encode_workers, image_encode_pool
+    old_pool = image_encode_pool
+    image_encode_workers = max_workers
+    image_encode_pool = ThreadPoolExecutor(max_workers=max_workers)
+    old_pool.shutdown(wait=False)
+
+
+def encode_images(images):
+    """
+    :brief: encode_image for every image in a list, on image_encode_pool
+    :return: list of data URIs, in the order of images
+    """
+    return list(image_encode_pool.map(encode_image, images))
+
+
+def encode_spot_samples(spot_samples, sample_id_list, channels=None):
+    """
+    :brief: encode raw spot samples, e.g. from select_spots, as per-spot images
+    :param channels: list of the channels to encode, None for all of
+        spot_channel_names. Unknown channels are ignored, and if none of the
+        requested channels are known the first channel is encoded
+    :return: list of dicts in the form {"spot_id": spot id, "bf": data URI,
+        "dapi": data URI, "compose": data URI}, with None for channels that
+        were not encoded
+    """
+    if channels is None:
+        channels = spot_channel_names
+    channels = [name for name in spot_channel_names if name in channels]
+    if len(channels) == 0:
+        channels = spot_channel_names[:1]
+    images = compose_spot_channels(spot_samples, channels)
+    count = len(sample_id_list)
+    encoded = encode_images([images[name][i] for name in channels for i in range(count)])
     ret_images = []
-    for sample_id,i in zip(sample_id_list,range(spot_samples.shape[0])):
-        array = spot_samples[i,:,0,:,:]
-        dapi = np.stack([array[2, :, :], array[1, :, :], array[0, :, :]], axis=2)
-        bf = array[3, :, :]
-        compose = (0.4* np.stack([bf]* 3,axis=2)+ 0.6 * dapi).astype("uint8")
-        ret_images.append({"spot_id": sample_id, "bf": encode_image(bf), "dapi": encode_image(dapi), "compose": encode_image(compose)})
+    for i, sample_id in enumerate(sample_id_list):
+        spot_dict = {"spot_id": sample_id}
+        for name in spot_channel_names:
+            spot_dict[name] = None
+        for channel_index, name in enumerate(channels):
+            spot_dict[name] = encoded[channel_index * count + i]
+        ret_images.append(spot_dict)
     return ret_images
 
+
+def get_images_from_zarr_built_in(spot_images, sample_id_list, channels=None):
+    """
+    :brief: read and encode the given spots, see encode_spot_samples
+    """
+    return encode_spot_samples(
+        select_spots(spot_images, sample_id_list), sample_id_list, channels=channels
+    )
+
+
+def pack_sprite_sheet(images, columns):
+    """
+    :brief: tile equally sized images into one sprite sheet, row by row
+    :param images: list of uint8 ndarrays of shape (Y, X) or (Y, X, 3)
+    :param columns: number of images per row of the sheet
+    :return: ndarray sprite sheet of shape (rows * Y, columns * X[, 3]), with
+        unused cells left black
+    """
+    cell_shape = images[0].shape
+    rows = -(-len(images) // columns)
+    padded = np.zeros((rows * columns,) + cell_shape, dtype=np.uint8)
+    padded[: len(images)] = np.stack(images)
+    padded = padded.reshape((rows, columns) + cell_shape)
+    # (rows, columns, Y, X[, 3]) -> (rows, Y, columns, X[, 3])
+    padded = np.swapaxes(padded, 1, 2)
+    return np.ascontiguousarray(
+        padded.reshape((rows * cell_shape[0], columns * cell_shape[1]) + cell_shape[2:])
+    )
+
+
+def spot_sprite_sheet(spot_samples, channel, columns):
+    """
+    :brief: tile one channel of raw spot samples into a sprite sheet
+    :param channel: "bf", "dapi" or "compose". Unknown channels fall back to the
+        first channel
+    :return: tuple of (channel rendered, sprite sheet ndarray)
+    """
+    if channel not in spot_channel_names:
+        channel = spot_channel_names[0]
+    images = compose_spot_channels(spot_samples, [channel])[channel]
+    return channel, pack_sprite_sheet(list(images), columns)
+
+
+def spot_sprite_info(spot_images, sample_id_list, channel, columns, sprite):
+    """
+    :brief: describe the sprite sheet of the given spots without rendering it
+    :param spot_images: spot_images array, only its shape is used
+    :param sprite: image source of the sheet, e.g. a data URI or URL
+    :return: dict with "spot_ids", "channel" (the channel rendered), "channels"
+        (all available channels), "sprite", "columns", "rows", "cell_width" and
+        "cell_height" (spot size in pixels). Spot i is the cell at row
+        i // columns, column i % columns
+    """
+    if channel not in spot_channel_names:
+        channel = spot_channel_names[0]
+    return {
+        "spot_ids": list(sample_id_list),
+        "channel": channel,
+        "channels": list(spot_channel_names),
+        "sprite": sprite,
+        "columns": columns,
+        "rows": -(-len(sample_id_list) // columns),
+        "cell_width": int(spot_images.shape[-1]),
+        "cell_height": int(spot_images.shape[-2]),
+    }
+
+
+def encode_spot_sprite(spot_samples, sample_id_list, channel, columns):
+    """
+    :brief: render one channel of raw spot samples, e.g. from select_spots, as a
+        single encoded sprite sheet, instead of one encoded image per spot
+    :param columns: number of spots per row of the sheet
+    :return: spot_sprite_info dict, with the sheet as a PNG data URI in "sprite"
+    """
+    channel, sprite = spot_sprite_sheet(spot_samples, channel, columns)
+    return spot_sprite_info(
+        spot_samples, sample_id_list, channel, columns, encode_image(sprite)
+    )
+
+
+def get_sprite_from_zarr_built_in(spot_images, sample_id_list, channel, columns):
+    """
+    :brief: read the given spots and render them as a sprite sheet, see
+        encode_spot_sprite
+    """
+    return encode_spot_sprite(
+        select_spots(spot_images, sample_id_list), sample_id_list, channel, columns
+    )
+
+
 def get_image_from_zarr(spot_images, sample_id):
     """
     :brief: This is highly dependent on our current way of stacking
     spot image fields. May need to change the way this dict is returned
     in the future.
     """
-    array = spot_images[sample_id, :, 0, :, :]
-    dapi = np.stack([array[2, :, :], array[1, :, :], array[0, :, :]], axis=2)
-    bf = array[3, :, :]
-    compose = (
-        0.4
-        * np.stack(
-            [
-                bf,
-            ]
-            * 3,
-            axis=2,
-        )
-        + 0.6 * dapi
-    ).astype("uint8")
-    return {"spot_id": sample_id, "bf": bf, "dapi": dapi, "compose": compose}
+    channels = compose_spot_channels(spot_images[sample_id : sample_id + 1])
+    return {
+        "spot_id": sample_id,
+        "bf": channels["bf"][0],
+        "dapi": channels["dapi"][0],
+        "compose": channels["compose"][0],
+    }
 
 
-def encode_image(image):
-    image = Image.fromarray(image)
+def encode_image_bytes(image, format="PNG"):
+    """
+    :brief: encode an image as bytes in the given PIL format
+    :param image: ndarray or PIL image
+    """
+    if isinstance(image, np.ndarray):
+        image = Image.fromarray(image)
     buffered = BytesIO()
-    image.save(buffered, format="PNG")
-    img_str = "data:image/png;base64," + base64.b64encode(buffered.getvalue()).decode(
-        "ascii"
-    )
+    image.save(buffered, format=format)
+    return buffered.getvalue()
+
+
+def encode_image(image):
+    img_str = "data:image/png;base64," + base64.b64encode(
+        encode_image_bytes(image)
+    ).decode("ascii")
     return img_str